@@ -0,0 +1,65 @@
+import asyncio
+import logging
+from typing import Dict
+
+from database.address_pool import add_addresses, claim_address, count_free_addresses, reserve_indexes
+from settings.common import ADDRESS_POOL_SETTINGS, CRYPTOS
+from units.registry import registry
+
+
+class AddressPool:
+    """
+    Заранее выведенные адреса для новых пользователей. Фоновая задача держит в базе запас
+    свободных адресов каждой сети, первое сообщение пользователя только забирает их из пула
+    и не ждет деривации ключей и API сети.
+    """
+
+    def __init__(self, low_water: int = 50, target: int = 200, interval: int = 60):
+        self.low_water = low_water
+        self.target = target
+        self.interval = interval
+        self._free: Dict[str, int] = {}
+        self._fallbacks = 0
+
+    async def refill_crypto(self, crypto: str) -> int:
+        free = await count_free_addresses(crypto)
+        self._free[crypto] = free
+        if free >= self.low_water:
+            return 0
+        unit = registry.get(crypto)
+        addresses = []
+        for index in await reserve_indexes(crypto, self.target - free):
+            address, private_key = await unit.derive_address(index)
+            addresses.append({'index': index, 'address': address, 'private_key': private_key})
+        added = await add_addresses(crypto, addresses)
+        self._free[crypto] = free + added
+        logging.info(f'[{crypto}] Address pool refilled with {added} addresses')
+        return added
+
+    async def refill(self):
+        results = await asyncio.gather(*[self.refill_crypto(crypto) for crypto in CRYPTOS], return_exceptions=True)
+        for crypto, result in zip(CRYPTOS, results):
+            if isinstance(result, Exception):
+                logging.error(f'[{crypto}] Failed to refill address pool: {result!r}')
+
+    async def claim(self, crypto: str, user_id: int) -> dict:
+        address = await claim_address(crypto, user_id)
+        if address:
+            return {'address': address['address'], 'private_key': address['private_key']}
+        # пул пуст (еще не наполнен или не задан секрет) - старая генерация по user_id, чтобы не оставить без адреса
+        self._fallbacks += 1
+        logging.warning(f'[{crypto}] Address pool is empty, generating address for user {user_id}')
+        address, private_key = await registry.get(crypto).generate_address(user_id)
+        if not isinstance(private_key, str):
+            private_key = private_key.hex()
+        return {'address': address, 'private_key': private_key}
+
+    async def claim_wallet(self, user_id: int, cryptos=CRYPTOS) -> Dict[str, dict]:
+        claimed = await asyncio.gather(*[self.claim(crypto, user_id) for crypto in cryptos])
+        return dict(zip(cryptos, claimed))
+
+    def stats(self) -> dict:
+        return {'free': dict(self._free), 'fallbacks': self._fallbacks}
+
+
+address_pool = AddressPool(**ADDRESS_POOL_SETTINGS)
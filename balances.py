@@ -0,0 +1,118 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Set, Tuple
+
+from pymongo import UpdateOne
+
+from database.db import DB
+from database.ledger import get_available, observe_operation
+from money import Amount
+from settings.common import BALANCE_REFRESH_SETTINGS, CRYPTOS, ROOT_ID, SWEEP_SETTINGS
+from units.registry import registry
+
+
+class BalanceRefresher:
+    """
+    Фоновое обновление балансов кошельков пачками.
+    Берет устаревшие адреса всех пользователей, запрашивает их батч-запросами провайдеров
+    и записывает результат одним bulk_write. Экран кошелька только читает готовые балансы.
+    """
+
+    def __init__(self, interval: int = 30, stale_after: int = 120, limit: int = 1000, batch_size: dict = None):
+        self.interval = interval
+        self.stale_after = stale_after
+        self.limit = limit
+        self.batch_size = batch_size or {}
+
+    @staticmethod
+    async def touch(user_id: int):
+        """
+        Пользователь открыл кошелек - обновим его балансы в ближайший проход без запросов из рендера.
+        Запрос хранится в базе: проход выполняется только на лидере, а touch вызывают все процессы.
+        """
+        await DB.users.update_one(
+            {'user_id': user_id}, {'$set': {'balance_refresh_requested_at': datetime.now(timezone.utc)}}
+        )
+
+    async def _stale_users(self, crypto: str, started: datetime) -> list:
+        wallet = f'profile.wallet.{crypto}'
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.stale_after)
+        query = {
+            f'{wallet}.address': {'$exists': True},
+            '$or': [
+                {'balance_refresh_requested_at': {'$lte': started}},
+                {f'{wallet}.balance_updated_at': {'$lt': cutoff}},
+                {f'{wallet}.balance_updated_at': {'$exists': False}},
+            ],
+        }
+        # горячий кошелек - не баланс корневого пользователя, иначе ему доступны все собранные депозиты
+        if crypto in SWEEP_SETTINGS['chains']:
+            query['user_id'] = {'$ne': ROOT_ID}
+        projection = {'user_id': 1, f'{wallet}.address': 1}
+        cursor = DB.users.find(query, projection).limit(self.limit)
+        return await cursor.to_list(length=None)
+
+    async def refresh_crypto(self, crypto: str, started: datetime) -> Tuple[Set[int], Set[int]]:
+        """(пользователи, выбранные проходом; пользователи, чьи балансы обновлены)"""
+        users = await self._stale_users(crypto, started)
+        selected = {user['user_id'] for user in users}
+        if not users:
+            return selected, set()
+        unit = registry.get(crypto)
+        wallets = {user['profile']['wallet'][crypto]['address']: user for user in users}
+        addresses = list(wallets)
+        size = self.batch_size.get(crypto, 50)
+        chunks = [addresses[i : i + size] for i in range(0, len(addresses), size)]
+        results = await asyncio.gather(*[unit.fetch_balances(chunk) for chunk in chunks], return_exceptions=True)
+
+        observed = {}
+        for chunk, result in zip(chunks, results):
+            if isinstance(result, Exception):
+                logging.error(f'[{crypto}] Balance batch of {len(chunk)} failed: {result!r}')
+                continue
+            for address, balance in result.items():
+                observed[wallets[address]['user_id']] = balance
+        if not observed:
+            return selected, set()
+        await DB.balances.bulk_write(
+            [observe_operation(user_id, crypto, balance) for user_id, balance in observed.items()], ordered=False
+        )
+        # показывается доступный остаток проекции: во время сбора адреса наблюдение его не меняет
+        now = datetime.now(timezone.utc)
+        operations = [
+            UpdateOne(
+                {'user_id': user_id},
+                {
+                    '$set': {
+                        f'profile.wallet.{crypto}.balance': Amount.of(crypto, available),
+                        f'profile.wallet.{crypto}.balance_updated_at': now,
+                    }
+                },
+            )
+            for user_id, available in (await get_available(crypto, observed)).items()
+        ]
+        if operations:
+            await DB.users.bulk_write(operations, ordered=False)
+        return selected, set(observed)
+
+    async def refresh(self):
+        started = datetime.now(timezone.utc)
+        results = await asyncio.gather(*[self.refresh_crypto(crypto, started) for crypto in CRYPTOS])
+        refreshed = set().union(*(updated for _, updated in results))
+        for selected, updated in results:
+            # выбранные, но не обновленные (ошибка батча) ждут следующего прохода
+            refreshed -= selected - updated
+            # проход уперся в limit: не выбранные в этой сети пользователи еще не обновлены
+            if len(selected) >= self.limit:
+                refreshed &= selected
+        # запросы, пришедшие во время прохода, остаются до следующего
+        if refreshed:
+            await DB.users.update_many(
+                {'user_id': {'$in': list(refreshed)}, 'balance_refresh_requested_at': {'$lte': started}},
+                {'$unset': {'balance_refresh_requested_at': ''}},
+            )
+        logging.info(f'Balances refreshed: {dict(zip(CRYPTOS, (len(updated) for _, updated in results)))}')
+
+
+balance_refresher = BalanceRefresher(**BALANCE_REFRESH_SETTINGS)
@@ -1,11 +1,12 @@
-from decimal import Decimal
 from typing import Optional
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from jinja2 import Environment, FileSystemLoader
 from validators.wallet import BillAmountValidator, CheckAmountValidator, WithdrawAddressValidator, WithdrawAmountValidator
 from settings.common import BOT_NAME
 from database.bot_settings import get_or_create_bot_settings
-from database.rates import get_all_rates
+from conversion import ConversionMatrix
+from money import Amount
+from rates import get_rates_snapshot
 from database.state import States, get_state
 from mixins.base import UserInputMixin
 from triggers import Triggers
@@ -20,7 +21,12 @@ class Expectations:  #  todo: this is not used yet anywhere
 
 class RatesContext:
     async def get_rates(self):
-        return await get_all_rates()
+        snapshot = await get_rates_snapshot()
+        return snapshot.rates
+
+    async def get_conversion(self) -> ConversionMatrix:
+        snapshot = await get_rates_snapshot()
+        return snapshot.matrix
 
 
 class BotSettingsContext:
@@ -36,15 +42,8 @@ class DefaultContext(RatesContext, BotSettingsContext):
         self.triggers = Triggers
 
     @staticmethod
-    def format(value: Decimal, crypto: str) -> str:
-        round_map = {
-            'BTC': 8,
-            'ETH': 6,
-            'USDT': 2,
-            'TRX': 7,
-            'TON': 7
-        }
-        return str(round(value, round_map.get(crypto, 2)))
+    def format(value, crypto: str) -> str:
+        return Amount.of(crypto, value).format()
     
     async def render_template(self, template_name: str, ctx: Optional[dict] = None) -> str:
         template = env.get_template(template_name)
@@ -115,8 +114,10 @@ class UserInputContext(DefaultContext, UserInputMixin):
             "wallet_currency": self.user['profile']['wallet_currency'],
             "bot_name": BOT_NAME
         }
-        rates = await self.get_rates()
-        instance, fiat_amount = await self.get_model_amount_in_fiat(rates=rates, code=selected[-1], trigger=trigger)
+        conversion = await self.get_conversion()
+        instance, fiat_amount = await self.get_model_amount_in_fiat(
+            conversion=conversion, fiat=base_ctx['wallet_currency'], code=selected[-1], trigger=trigger
+        )
         template_map = {
             Triggers.CHECK: 'wallet/check.html',
             Triggers.BILL: 'wallet/bill.html',
@@ -1,55 +1,68 @@
-import asyncio
+from balances import balance_refresher
 from context.base import DefaultContext
 from gettext import gettext as _
 from database.bill import get_bills_by_user
 from database.check import get_checks_by_user
-from database.user import get_user_by_id, save_user
+from database.user import provision_wallets
+from fees import fee_oracle
+from money import Amount
 from settings.common import CRYPTO_SETTINGS, CRYPTOS
-from utils import get_unit
+from units.registry import registry
 
 
 class WalletContext(DefaultContext):
     async def ctx(self):
-        db_user = await get_user_by_id(user_id=self.user['user_id'])
+        # пользователь уже прочитан в начале апдейта, балансы в нем актуальны на момент последнего батча
+        wallet = self.user['profile']['wallet']
+        balances = {crypto: Amount.of(crypto, wallet[crypto]['balance']) for crypto in CRYPTOS}
 
-        balances = {crypto: db_user['profile']['wallet'][crypto]['balance'] for crypto in CRYPTOS}
+        # балансы обновятся в фоне ближайшим батчем; запрос, который еще ждет прохода, не переписываем
+        if not self.user.get('balance_refresh_requested_at'):
+            await balance_refresher.touch(self.user['user_id'])
 
-        asyncio.create_task(self._update_wallet_balances())  # Запуск асинхронного обновления балансов
-
-        rates = await self.get_rates()
+        conversion = await self.get_conversion()
         wallet_currency = self.user['profile']['wallet_currency']
 
-        fiat_balances = {
-            crypto: round(rates.get(crypto, 0) * balances[crypto] * rates.get(wallet_currency, 0), 2)
-            for crypto in CRYPTOS
-        }
+        fiat_balances = conversion.convert_wallet(balances, wallet_currency)
 
         result = {f"{crypto.lower()}_balance": self.format(value=balances[crypto], crypto=crypto) for crypto in CRYPTOS}
         result.update({f"{crypto.lower()}_balance_fiat": fiat_balances[crypto] for crypto in CRYPTOS})
         result.update(
             {
-                f"{crypto.lower()}_wallet_link": get_unit(crypto)(
-                    network=CRYPTO_SETTINGS[crypto]['network']
-                ).get_wallet_url(db_user['profile']['wallet'][crypto]['address'])
+                # адрес появляется только после первого пополнения или вывода в этой валюте
+                f"{crypto.lower()}_wallet_link": registry.get(crypto).get_wallet_url(wallet[crypto]['address'])
+                if wallet[crypto].get('address')
+                else ''
                 for crypto in CRYPTOS
             }
         )
         result['wallet_currency'] = wallet_currency
-        result['total_balance'] = round(sum(fiat_balances.values()), 2)
+        result['total_balance'] = sum(fiat_balances.values())
 
         return result
 
-    async def _update_wallet_balances(self):
-        db_user = await get_user_by_id(user_id=self.user['user_id'])
 
-        for crypto in CRYPTOS:
-            unit = get_unit(crypto)
-            address = self.user['profile']['wallet'][crypto]['address']
-            balance = await unit(network=CRYPTO_SETTINGS[crypto]['network']).get_balance(address=address)
-            if balance:
-                db_user['profile']['wallet'][crypto]['balance'] = balance
+class FeesContext(DefaultContext):
+    async def markup(self):
+        return [[[_('Назад'), self.triggers.WALLET]]]
 
-        await save_user(user_id=self.user['user_id'], user_data=db_user)
+    async def ctx(self):
+        conversion = await self.get_conversion()
+        wallet_currency = self.user['profile']['wallet_currency']
+        fees = [
+            {
+                'crypto': crypto,
+                'low': self.format(value=estimate.low, crypto=crypto),
+                'medium': self.format(value=estimate.medium, crypto=crypto),
+                'high': self.format(value=estimate.high, crypto=crypto),
+                'medium_fiat': conversion.convert(estimate.medium, crypto, wallet_currency),
+                'stale': estimate.stale,
+                'age': int(estimate.age // 60),
+            }
+            for crypto, estimate in fee_oracle.all().items()
+        ]
+        text = await self.render_template('wallet/fees.html', {'fees': fees, 'wallet_currency': wallet_currency})
+        return {'text': text}
 
 
 class ReplenishContext(DefaultContext):
@@ -77,12 +90,16 @@ class CryptoContext(DefaultContext):
         crypto = selected[-1]
         action_type = selected[-2]
         ctx = {'crypto': crypto}
-        address = self.user['profile']['wallet'][crypto]['address']
+        address = None
+        if action_type in (self.triggers.REPLENISH, self.triggers.WITHDRAW):
+            # ключи сети генерируются, только когда пользователь впервые пополняет или выводит эту валюту
+            wallet = await provision_wallets(self.user, [crypto])
+            address = wallet[crypto]['address']
         bot_settings = await self.bot_settings
         min_amount = bot_settings['limits'][crypto]['min']
         max_amount = bot_settings['limits'][crypto]['max']
-        rates = await self.get_rates()
-        rate = rates.get(crypto, 0)
+        conversion = await self.get_conversion()
+        wallet_currency = self.user['profile']['wallet_currency']
         templates_map = {
             self.triggers.REPLENISH: [
                 "wallet/replenish.html",
@@ -93,9 +110,9 @@ class CryptoContext(DefaultContext):
                 "wallet/check_amount.html",
                 {
                     **ctx,
-                    "max_value_fiat": round(max_amount * rate, 2),
-                    "min_value_fiat": round(min_amount * rate, 2),
-                    "wallet_currency": self.user['profile']['wallet_currency'],
+                    "max_value_fiat": conversion.convert(max_amount, crypto, wallet_currency),
+                    "min_value_fiat": conversion.convert(min_amount, crypto, wallet_currency),
+                    "wallet_currency": wallet_currency,
                     "min_check_amount": min_amount,
                     "max_check_amount": max_amount,
                 },
@@ -104,9 +121,9 @@ class CryptoContext(DefaultContext):
                 "wallet/bill_amount.html",
                 {
                     **ctx,
-                    "max_value_fiat": round(max_amount * rate, 2),
-                    "min_value_fiat": round(min_amount * rate, 2),
-                    "wallet_currency": self.user['profile']['wallet_currency'],
+                    "max_value_fiat": conversion.convert(max_amount, crypto, wallet_currency),
+                    "min_value_fiat": conversion.convert(min_amount, crypto, wallet_currency),
+                    "wallet_currency": wallet_currency,
                     "min_bill_amount": min_amount,
                     "max_bill_amount": max_amount,
                 },
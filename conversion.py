@@ -0,0 +1,53 @@
+from decimal import Decimal, ROUND_HALF_EVEN
+from typing import Dict, Iterable, List, Mapping, Tuple, Union
+
+Number = Union[Decimal, int, float, str]
+
+BASE_CURRENCY = 'USD'
+FIAT_QUANTUM = Decimal('0.01')
+
+
+def to_decimal(value: Number) -> Decimal:
+    if isinstance(value, Decimal):
+        return value
+    if hasattr(value, 'to_decimal'):  # Amount и Decimal128
+        return value.to_decimal()
+    # float через str, чтобы не тащить двоичный хвост в Decimal
+    return Decimal(str(value))
+
+
+class ConversionMatrix:
+    """
+    Цены крипта x фиат, посчитанные один раз на тик курсов.
+    Суммы считаются в Decimal и округляются до копеек только в конце.
+    """
+
+    def __init__(self, rates: Mapping[str, Number], cryptos: Iterable[str], fiats: Iterable[str]):
+        fiat_per_base = {
+            fiat: Decimal(1) if fiat == BASE_CURRENCY else to_decimal(rates.get(fiat, 0)) for fiat in fiats
+        }
+        self.prices: Dict[str, Dict[str, Decimal]] = {
+            crypto: {fiat: to_decimal(rates.get(crypto, 0)) * per_base for fiat, per_base in fiat_per_base.items()}
+            for crypto in cryptos
+        }
+
+    def price(self, crypto: str, fiat: str) -> Decimal:
+        return self.prices.get(crypto, {}).get(fiat, Decimal(0))
+
+    def convert(self, amount: Number, crypto: str, fiat: str) -> Decimal:
+        return (to_decimal(amount) * self.price(crypto, fiat)).quantize(FIAT_QUANTUM, rounding=ROUND_HALF_EVEN)
+
+    def convert_minor(self, amount: Number, crypto: str, fiat: str) -> int:
+        """Сумма в копейках/центах"""
+        return int(self.convert(amount, crypto, fiat) / FIAT_QUANTUM)
+
+    def convert_many(self, amounts: Iterable[Tuple[Number, str]], fiat: str) -> List[Decimal]:
+        """Пачка пар (сумма, крипта) в один фиат, например для портфеля или отчета"""
+        column = {crypto: prices.get(fiat, Decimal(0)) for crypto, prices in self.prices.items()}
+        return [
+            (to_decimal(amount) * column.get(crypto, Decimal(0))).quantize(FIAT_QUANTUM, rounding=ROUND_HALF_EVEN)
+            for amount, crypto in amounts
+        ]
+
+    def convert_wallet(self, balances: Mapping[str, Number], fiat: str) -> Dict[str, Decimal]:
+        return dict(zip(balances, self.convert_many(((amount, crypto) for crypto, amount in balances.items()), fiat)))
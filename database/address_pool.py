@@ -0,0 +1,47 @@
+from datetime import datetime, timezone
+from typing import List, Optional
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import BulkWriteError
+
+from database.db import DB
+
+
+async def reserve_indexes(crypto: str, count: int) -> range:
+    """Атомарно выделяет диапазон номеров для деривации: два процесса не выведут один и тот же адрес"""
+    cursor = await DB.address_pool_cursors.find_one_and_update(
+        {'crypto': crypto},
+        {'$inc': {'next_index': count}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return range(cursor['next_index'] - count, cursor['next_index'])
+
+
+async def add_addresses(crypto: str, addresses: List[dict]) -> int:
+    """addresses - словари с index, address и private_key"""
+    if not addresses:
+        return 0
+    now = datetime.now(timezone.utc)
+    documents = [{**address, 'crypto': crypto, 'user_id': None, 'creation_date': now} for address in addresses]
+    try:
+        result = await DB.address_pool.insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        return e.details['nInserted']
+    return len(result.inserted_ids)
+
+
+async def claim_address(crypto: str, user_id: int) -> Optional[dict]:
+    """Отдает пользователю свободный адрес одним find_one_and_update; повторный вызов вернет тот же адрес"""
+    claimed = await DB.address_pool.find_one({'crypto': crypto, 'user_id': user_id})
+    if claimed:
+        return claimed
+    return await DB.address_pool.find_one_and_update(
+        {'crypto': crypto, 'user_id': None},
+        {'$set': {'user_id': user_id, 'claimed_at': datetime.now(timezone.utc)}},
+        sort=[('index', ASCENDING)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def count_free_addresses(crypto: str) -> int:
+    return await DB.address_pool.count_documents({'crypto': crypto, 'user_id': None})
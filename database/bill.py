@@ -1,16 +1,24 @@
-from decimal import Decimal
 from database.db import DB
 from datetime import datetime, timezone
+from typing import Optional
 
+from money import Amount
 from utils import generate_unique_code
 
 
 class BillStatus:
     NEW = 'new'
     PAYED = 'payed'
+    EXPIRED = 'expired'
 
 
-async def create_bill(user: dict, amount: Decimal, cryptocurrency: str) -> dict:
+def _decode(bill: Optional[dict]) -> Optional[dict]:
+    if bill:
+        bill['amount'] = Amount.of(bill['cryptocurrency'], bill['amount'])
+    return bill
+
+
+async def create_bill(user: dict, amount: Amount, cryptocurrency: str) -> dict:
     unique_code = generate_unique_code()
     creation_date = datetime.now(timezone.utc)
 
@@ -18,7 +26,7 @@ async def create_bill(user: dict, amount: Decimal, cryptocurrency: str) -> dict:
 
     bill = {
         "user_id": user.get('user_id'),
-        "amount": str(amount),
+        "amount": amount,
         "cryptocurrency": cryptocurrency,
         "creation_date": creation_date,
         "status": status,
@@ -29,12 +37,19 @@ async def create_bill(user: dict, amount: Decimal, cryptocurrency: str) -> dict:
     return bill
 
 async def get_bill_by_code(code: str):
-    return await DB.bills.find_one({"code": code})
+    return _decode(await DB.bills.find_one({"code": code}))
 
 async def get_bills_by_user(user_id: str):
     cursor = DB.bills.find({"user_id": user_id})
-    return await cursor.to_list(length=None)
+    return [_decode(bill) for bill in await cursor.to_list(length=None)]
 
 async def delete_bill_by_code(code: str):
     result = await DB.bills.delete_one({"code": code})
-    return result.deleted_count
\ No newline at end of file
+    return result.deleted_count
+
+async def expire_bills(before: datetime) -> int:
+    result = await DB.bills.update_many(
+        {"status": BillStatus.NEW, "creation_date": {"$lt": before}},
+        {"$set": {"status": BillStatus.EXPIRED}},
+    )
+    return result.modified_count
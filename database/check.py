@@ -1,7 +1,8 @@
-from decimal import Decimal
 from database.db import DB
 from datetime import datetime, timezone
+from typing import Optional
 
+from money import Amount
 from utils import generate_unique_code
 
 
@@ -9,9 +10,17 @@ class CheckStatus:
     NEW = 'new'
     WINNING = 'winning'
     CASHED = 'cashed'
+    EXPIRED = 'expired'
 
 
-async def create_check(user: dict, amount: Decimal, cryptocurrency: str) -> dict:
+def _decode(check: Optional[dict]) -> Optional[dict]:
+    if check:
+        check['amount'] = Amount.of(check['cryptocurrency'], check['amount'])
+        check['hold'] = Amount.of(check['cryptocurrency'], check.get('hold', check['amount']))
+    return check
+
+
+async def create_check(user: dict, amount: Amount, cryptocurrency: str, hold: Optional[Amount] = None) -> dict:
     unique_code = generate_unique_code()
     creation_date = datetime.now(timezone.utc)
 
@@ -19,23 +28,34 @@ async def create_check(user: dict, amount: Decimal, cryptocurrency: str) -> dict
 
     check = {
         "user_id": user.get('user_id'),
-        "amount": str(amount),
+        "amount": amount,
         "cryptocurrency": cryptocurrency,
         "creation_date": creation_date,
         "status": status,
-        "code": unique_code
+        "code": unique_code,
+        # сколько заморожено на кошельке под чек вместе с комиссией сети, снимается при истечении
+        "hold": amount if hold is None else hold,
     }
 
     await DB.checks.insert_one(check)
     return check
 
 async def get_check_by_code(code: str):
-    return await DB.checks.find_one({"code": code})
+    return _decode(await DB.checks.find_one({"code": code}))
 
 async def get_checks_by_user(user_id: str):
     cursor = DB.checks.find({"user_id": user_id})
-    return await cursor.to_list(length=None)
+    return [_decode(check) for check in await cursor.to_list(length=None)]
 
 async def delete_check_by_code(code: str):
     result = await DB.checks.delete_one({"code": code})
-    return result.deleted_count
\ No newline at end of file
+    return result.deleted_count
+
+async def expire_check(before: datetime):
+    """Атомарно помечает один просроченный чек, чтобы холд по нему снял ровно один процесс"""
+    return _decode(
+        await DB.checks.find_one_and_update(
+            {"status": CheckStatus.NEW, "creation_date": {"$lt": before}},
+            {"$set": {"status": CheckStatus.EXPIRED}},
+        )
+    )
@@ -1,4 +1,23 @@
+from bson.codec_options import CodecOptions, TypeEncoder, TypeRegistry
+from bson.decimal128 import Decimal128
 from motor import motor_asyncio
 
+from money import Amount
+
+
+class AmountEncoder(TypeEncoder):
+    """
+    Amount хранится как точный Decimal128 в монетах сети: int64 не вмещает суммы в wei,
+    а $inc и сравнения в запросах работают с Decimal128 без потерь.
+    Обратно в Amount значения переводит Amount.of, потому что валюта лежит в соседнем поле.
+    """
+    python_type = Amount
+
+    def transform_python(self, value: Amount) -> Decimal128:
+        return Decimal128(value.to_decimal())
+
+
+CODEC_OPTIONS = CodecOptions(type_registry=TypeRegistry([AmountEncoder()]))
+
 client = motor_asyncio.AsyncIOMotorClient('mongodb://localhost:27017')
-DB = client.crypted
\ No newline at end of file
+DB = client.get_database('crypted', codec_options=CODEC_OPTIONS)
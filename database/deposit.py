@@ -0,0 +1,48 @@
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Dict, Optional
+from database.db import DB
+from money import Amount
+
+
+class DepositStatus:
+    PENDING = 'pending'
+    CONFIRMED = 'confirmed'
+
+
+async def get_deposit_addresses(crypto: str) -> Dict[str, int]:
+    field = f'profile.wallet.{crypto}.address'
+    cursor = DB.users.find({field: {'$exists': True}}, {'user_id': 1, field: 1})
+    return {user['profile']['wallet'][crypto]['address']: user['user_id'] async for user in cursor}
+
+async def get_block_cursor(crypto: str) -> Optional[int]:
+    cursor = await DB.block_cursors.find_one({'crypto': crypto})
+    return cursor['block'] if cursor else None
+
+async def set_block_cursor(crypto: str, block: int):
+    await DB.block_cursors.update_one({'crypto': crypto}, {'$set': {'block': block}}, upsert=True)
+
+async def save_deposit(crypto: str, txid: str, block: int, address: str, amount: Decimal, user_id: int) -> bool:
+    """Сохраняет найденный депозит, повторная обработка того же блока его не задваивает"""
+    result = await DB.deposits.update_one(
+        {'crypto': crypto, 'txid': txid, 'address': address},
+        {
+            '$setOnInsert': {
+                'user_id': user_id,
+                'amount': Amount.of(crypto, amount),
+                'block': block,
+                'confirmations': 0,
+                'status': DepositStatus.PENDING,
+                'creation_date': datetime.now(timezone.utc),
+            }
+        },
+        upsert=True,
+    )
+    return result.upserted_id is not None
+
+async def get_pending_deposits(crypto: str) -> list:
+    cursor = DB.deposits.find({'crypto': crypto, 'status': DepositStatus.PENDING})
+    return await cursor.to_list(length=None)
+
+async def update_deposit(deposit_id, **fields):
+    await DB.deposits.update_one({'_id': deposit_id}, {'$set': fields})
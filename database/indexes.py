@@ -0,0 +1,147 @@
+import logging
+from typing import Dict, List, Tuple
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from database.db import DB
+from settings.common import CRYPTOS
+
+
+class IndexAuditError(Exception):
+    pass
+
+
+# индексы под все горячие запросы из database/* и юнитов
+INDEXES: Dict[str, List[IndexModel]] = {
+    'users': [
+        IndexModel([('user_id', ASCENDING)], unique=True),
+        *[
+            IndexModel([(f'profile.wallet.{crypto}.address', ASCENDING)], sparse=True)
+            for crypto in CRYPTOS
+        ],
+        # запросы на обновление балансов от всех процессов
+        IndexModel([('balance_refresh_requested_at', ASCENDING)], sparse=True),
+    ],
+    'states': [IndexModel([('user_id', ASCENDING)], unique=True)],
+    'responses': [IndexModel([('trigger', ASCENDING)], unique=True)],
+    'keyboards': [IndexModel([('keyboard_id', ASCENDING)], unique=True)],
+    'bills': [
+        IndexModel([('code', ASCENDING)], unique=True),
+        IndexModel([('user_id', ASCENDING)]),
+        IndexModel([('status', ASCENDING), ('creation_date', ASCENDING)]),
+    ],
+    'checks': [
+        IndexModel([('code', ASCENDING)], unique=True),
+        IndexModel([('user_id', ASCENDING)]),
+        IndexModel([('status', ASCENDING), ('creation_date', ASCENDING)]),
+    ],
+    'network_fees': [IndexModel([('crypto', ASCENDING)], unique=True)],
+    'deposits': [
+        IndexModel([('crypto', ASCENDING), ('txid', ASCENDING), ('address', ASCENDING)], unique=True),
+        IndexModel([('crypto', ASCENDING), ('status', ASCENDING)]),
+    ],
+    'block_cursors': [IndexModel([('crypto', ASCENDING)], unique=True)],
+    'balances': [
+        IndexModel([('user_id', ASCENDING), ('crypto', ASCENDING)], unique=True),
+        # кандидаты на сбор на горячий кошелек - крупные балансы адресов сети
+        IndexModel([('crypto', ASCENDING), ('chain', ASCENDING)]),
+    ],
+    'sweeps': [IndexModel([('crypto', ASCENDING), ('status', ASCENDING)])],
+    'ledger': [
+        IndexModel([('user_id', ASCENDING), ('crypto', ASCENDING)]),
+        # одна запись на внешнюю ссылку (депозит, чек, транзакцию) - повтор не задваивает движение
+        IndexModel(
+            [('ref', ASCENDING), ('kind', ASCENDING)], unique=True, partialFilterExpression={'ref': {'$exists': True}}
+        ),
+    ],
+    'withdrawals': [
+        IndexModel([('key', ASCENDING)], unique=True),
+        IndexModel([('crypto', ASCENDING), ('status', ASCENDING), ('next_attempt_at', ASCENDING)]),
+    ],
+    'nonces': [IndexModel([('address', ASCENDING)], unique=True)],
+    'address_pool': [
+        IndexModel([('crypto', ASCENDING), ('index', ASCENDING)], unique=True),
+        IndexModel([('crypto', ASCENDING), ('address', ASCENDING)], unique=True),
+        # свободные адреса выбираются по user_id: None в порядке номеров
+        IndexModel([('crypto', ASCENDING), ('user_id', ASCENDING), ('index', ASCENDING)]),
+    ],
+    'address_pool_cursors': [IndexModel([('crypto', ASCENDING)], unique=True)],
+    'rate_ticks': [
+        IndexModel([('symbol', ASCENDING), ('start', ASCENDING)], unique=True),
+        IndexModel([('expire_at', ASCENDING)], expireAfterSeconds=0),
+    ],
+    'rate_candles': [
+        IndexModel([('symbol', ASCENDING), ('interval', ASCENDING), ('start', ASCENDING)], unique=True),
+        IndexModel([('expire_at', ASCENDING)], expireAfterSeconds=0),
+    ],
+}
+
+# формы запросов, которые выполняются на каждое сообщение или в фоновых задачах
+QUERY_SHAPES: List[Tuple[str, dict]] = [
+    ('users', {'user_id': 0}),
+    *[('users', {f'profile.wallet.{crypto}.address': ''}) for crypto in CRYPTOS],
+    ('users', {'balance_refresh_requested_at': {'$lte': 0}}),
+    ('states', {'user_id': 0}),
+    ('responses', {'trigger': ''}),
+    ('keyboards', {'keyboard_id': ''}),
+    ('bills', {'code': ''}),
+    ('bills', {'user_id': 0}),
+    ('checks', {'code': ''}),
+    ('checks', {'user_id': 0}),
+    ('bills', {'status': '', 'creation_date': {'$lt': 0}}),
+    ('checks', {'status': '', 'creation_date': {'$lt': 0}}),
+    ('network_fees', {'crypto': ''}),
+    ('deposits', {'crypto': '', 'status': ''}),
+    ('block_cursors', {'crypto': ''}),
+    ('balances', {'user_id': 0, 'crypto': ''}),
+    ('balances', {'crypto': '', 'user_id': {'$in': [0]}}),
+    ('balances', {'crypto': '', 'chain': {'$gte': 0}, 'user_id': {'$nin': [0]}}),
+    ('sweeps', {'crypto': '', 'status': {'$in': ['']}}),
+    ('nonces', {'address': ''}),
+    ('withdrawals', {'key': ''}),
+    ('withdrawals', {'crypto': '', 'status': {'$in': ['']}, 'next_attempt_at': {'$lte': 0}}),
+    ('withdrawals', {'crypto': '', 'status': '', 'next_attempt_at': None}),
+    ('address_pool', {'crypto': '', 'user_id': None}),
+    ('address_pool', {'crypto': '', 'user_id': 0}),
+    ('rate_candles', {'symbol': '', 'interval': '', 'start': {'$gte': 0}}),
+]
+
+
+async def ensure_indexes():
+    for collection, indexes in INDEXES.items():
+        try:
+            await DB[collection].create_indexes(indexes)
+        except OperationFailure as e:
+            # например, дубликаты в данных не дают построить уникальный индекс
+            logging.error(f'Failed to create indexes on {collection}: {e}')
+    logging.info(f'Indexes ensured for {len(INDEXES)} collections')
+
+
+def _stages(plan: dict):
+    yield plan.get('stage')
+    for key in ('inputStage', 'queryPlan'):
+        if key in plan:
+            yield from _stages(plan[key])
+    for child in plan.get('inputStages', []):
+        yield from _stages(child)
+
+
+async def audit_query_plans() -> List[Tuple[str, dict]]:
+    """Возвращает запросы, для которых планировщик выбрал полный просмотр коллекции"""
+    collscans = []
+    for collection, query in QUERY_SHAPES:
+        explain = await DB[collection].find(query).explain()
+        if 'COLLSCAN' in _stages(explain['queryPlanner']['winningPlan']):
+            collscans.append((collection, query))
+    return collscans
+
+
+async def bootstrap_indexes(mode: str = 'warn'):
+    await ensure_indexes()
+    if mode == 'off':
+        return
+    collscans = await audit_query_plans()
+    for collection, query in collscans:
+        logging.warning(f'Collection scan on {collection} for query {query}')
+    if collscans and mode == 'fail':
+        raise IndexAuditError(f'{len(collscans)} hot queries are not covered by indexes')
@@ -0,0 +1,25 @@
+from datetime import datetime, timedelta, timezone
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from database.db import DB
+
+
+async def acquire_lease(name: str, owner: str, ttl: float) -> bool:
+    """Берет или продлевает аренду, если она свободна, истекла или уже принадлежит owner"""
+    now = datetime.now(timezone.utc)
+    try:
+        lease = await DB.leases.find_one_and_update(
+            {'_id': name, '$or': [{'owner': owner}, {'expires_at': {'$lt': now}}]},
+            {'$set': {'owner': owner, 'expires_at': now + timedelta(seconds=ttl)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        # аренда жива и принадлежит другому процессу - upsert уперся в _id
+        return False
+    return lease is not None and lease['owner'] == owner
+
+
+async def release_lease(name: str, owner: str):
+    await DB.leases.delete_one({'_id': name, 'owner': owner})
@@ -0,0 +1,258 @@
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple
+from bson.decimal128 import Decimal128
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from database.db import DB
+from money import Amount
+
+
+class EntryKind:
+    HOLD = 'hold'
+    RELEASE = 'release'
+    DEBIT = 'debit'
+    HOT_DEBIT = 'hot_debit'
+    CREDIT = 'credit'
+    SWEEP = 'sweep'
+    SPEND = 'spend'
+
+
+# поля проекции: chain - баланс адреса пользователя в сети, held - заморожено,
+# swept - средства пользователя, переведенные на горячий кошелек, outgoing - отправлено с адреса,
+# но еще не видно в наблюдаемом балансе. Доступно: chain + swept - held - outgoing.
+# chain только наблюдается (observe), журнал его не меняет: иначе поступление, уже увиденное в сети, считалось бы дважды
+FIELDS = ('chain', 'held', 'swept', 'outgoing')
+
+# как запись журнала меняет проекцию: (chain, held, swept, outgoing)
+EFFECTS = {
+    EntryKind.HOLD: (0, 1, 0, 0),
+    EntryKind.RELEASE: (0, -1, 0, 0),
+    # списание уже замороженных средств: холд переходит в outgoing, пока наблюдение не покажет уход монет с адреса
+    EntryKind.DEBIT: (0, -1, 0, 1),
+    # выплата с горячего кошелька: адрес пользователя не меняется, уменьшаются переведенные на кошелек средства
+    EntryKind.HOT_DEBIT: (0, -1, -1, 0),
+    # поступление на адрес пользователя уже есть в наблюдаемом балансе, запись только фиксирует его в журнале
+    EntryKind.CREDIT: (0, 0, 0, 0),
+    # поступление на горячий кошелек; баланс адреса после сбора записывается той же операцией (sweep)
+    EntryKind.SWEEP: (0, 0, 1, 0),
+    # вывод подтвержден в сети; баланс адреса после списания записывается той же операцией (spend)
+    EntryKind.SPEND: (0, 0, 0, -1),
+}
+
+
+def to_amount(crypto: str, value) -> Decimal:
+    """Сумма в монетах сети, округленная до минимальной единицы"""
+    return Amount.of(crypto, value).to_decimal()
+
+
+def _from_bson(value) -> Decimal:
+    if isinstance(value, Decimal128):
+        return value.to_decimal()
+    return Decimal(str(value or 0))
+
+
+def _update(kind: str, amount: Decimal) -> dict:
+    inc = {
+        field: Decimal128(amount * sign)
+        for field, sign in zip(FIELDS, EFFECTS[kind])
+        if sign
+    }
+    # у новой проекции поля, которые не меняются этой записью, сразу нулевые, иначе $expr в reserve их не увидит
+    zeros = {field: Decimal128('0') for field in FIELDS if field not in inc}
+    return {'$inc': inc, '$setOnInsert': zeros} if zeros else {'$inc': inc}
+
+
+async def _apply(
+    user_id: int,
+    crypto: str,
+    kind: str,
+    value,
+    ref: Optional[str] = None,
+    condition: Optional[dict] = None,
+    observed=None,
+) -> bool:
+    """
+    Проекция меняется одним атомарным $inc (для холда - с условием на доступный остаток),
+    затем запись добавляется в журнал. Повтор с тем же ref откатывает проекцию обратным $inc.
+    Записи, которые проекцию не меняют (поступление), только добавляются в журнал.
+    observed - баланс адреса в сети, который записывается вместе с $inc; запись сбора снова открывает наблюдения.
+    """
+    amount = to_amount(crypto, value)
+    if amount <= 0:
+        raise ValueError(f'Ledger amount must be positive: {value}')
+    update = _update(kind, amount)
+    if observed is not None:
+        update['$setOnInsert'].pop('chain', None)
+        update['$set'] = {'chain': Decimal128(to_amount(crypto, observed))}
+        if kind == EntryKind.SWEEP:
+            update['$unset'] = {'sweeping': ''}
+    if update['$inc']:
+        query = {'user_id': user_id, 'crypto': crypto, **(condition or {})}
+        result = await DB.balances.update_one(query, update, upsert=condition is None)
+        if not result.matched_count and not result.upserted_id:
+            return False
+    entry = {
+        'user_id': user_id,
+        'crypto': crypto,
+        'kind': kind,
+        'amount': Decimal128(amount),
+        'created_at': datetime.now(timezone.utc),
+    }
+    if ref is not None:
+        entry['ref'] = ref
+    try:
+        await DB.ledger.insert_one(entry)
+    except DuplicateKeyError:
+        if update['$inc']:
+            await DB.balances.update_one(
+                {'user_id': user_id, 'crypto': crypto}, {'$inc': _update(kind, -amount)['$inc']}
+            )
+        return False
+    return True
+
+
+async def reserve(user_id: int, crypto: str, amount, ref: Optional[str] = None) -> bool:
+    """Замораживает сумму, если ее покрывает доступный баланс. False - средств не хватает"""
+    amount = to_amount(crypto, amount)
+    # у проекций, созданных до сбора и списаний, полей swept и outgoing нет
+    available = {
+        '$subtract': [
+            {'$add': ['$chain', {'$ifNull': ['$swept', 0]}]},
+            {'$add': ['$held', {'$ifNull': ['$outgoing', 0]}]},
+        ]
+    }
+    condition = {'$expr': {'$gte': [available, Decimal128(amount)]}}
+    return await _apply(user_id, crypto, EntryKind.HOLD, amount, ref=ref, condition=condition)
+
+
+async def release(user_id: int, crypto: str, amount, ref: Optional[str] = None) -> bool:
+    return await _apply(user_id, crypto, EntryKind.RELEASE, amount, ref=ref)
+
+
+async def debit(user_id: int, crypto: str, amount, ref: Optional[str] = None, hot: bool = False) -> bool:
+    """hot - вывод оплачен с горячего кошелька, а не с адреса пользователя"""
+    return await _apply(user_id, crypto, EntryKind.HOT_DEBIT if hot else EntryKind.DEBIT, amount, ref=ref)
+
+
+async def credit(user_id: int, crypto: str, amount, ref: Optional[str] = None) -> bool:
+    return await _apply(user_id, crypto, EntryKind.CREDIT, amount, ref=ref)
+
+
+async def sweep(user_id: int, crypto: str, amount, balance, ref: Optional[str] = None) -> bool:
+    """
+    Средства адреса пользователя поступили на горячий кошелек. balance - баланс адреса в сети после сбора:
+    он записывается в той же операции, что и swept, поэтому собранные средства не пропадают и не задваиваются
+    """
+    return await _apply(user_id, crypto, EntryKind.SWEEP, amount, ref=ref, observed=balance)
+
+
+async def spend(user_id: int, crypto: str, amount, balance, ref: Optional[str] = None) -> bool:
+    """
+    Вывод с адреса пользователя подтвержден. balance - баланс адреса в сети после списания:
+    до этой записи отправленная сумма вычитается через outgoing, и устаревшее наблюдение не вернет ее в доступный остаток
+    """
+    return await _apply(user_id, crypto, EntryKind.SPEND, amount, ref=ref, observed=balance)
+
+
+async def has_entry(ref: str, kind: str) -> bool:
+    return await DB.ledger.find_one({'ref': ref, 'kind': kind}, {'_id': 1}) is not None
+
+
+async def set_sweeping(crypto: str, user_ids: Iterable[int], sweeping: bool):
+    """
+    Пока сбор адреса не учтен в журнале, наблюдения не меняют chain: монеты уже ушли с адреса,
+    а в swept еще не записаны. Снимается вместе с записью сбора или при отмене сбора
+    """
+    update = {'$set': {'sweeping': True}} if sweeping else {'$unset': {'sweeping': ''}}
+    await DB.balances.update_many({'crypto': crypto, 'user_id': {'$in': list(user_ids)}}, update)
+
+
+async def get_balance(user_id: int, crypto: str) -> Tuple[Decimal, Decimal, Decimal, Decimal]:
+    """(баланс адреса в сети, заморожено, на горячем кошельке, отправлено с адреса)"""
+    projection = await DB.balances.find_one({'user_id': user_id, 'crypto': crypto}) or {}
+    return tuple(_from_bson(projection.get(field)) for field in FIELDS)
+
+
+async def get_available(crypto: str, user_ids: Iterable[int]) -> Dict[int, Decimal]:
+    """Доступные остатки проекций пользователей: chain + swept - held - outgoing"""
+    cursor = DB.balances.find(
+        {'crypto': crypto, 'user_id': {'$in': list(user_ids)}}, {'user_id': 1, **{field: 1 for field in FIELDS}}
+    )
+    return {
+        projection['user_id']: _from_bson(projection.get('chain'))
+        + _from_bson(projection.get('swept'))
+        - _from_bson(projection.get('held'))
+        - _from_bson(projection.get('outgoing'))
+        async for projection in cursor
+    }
+
+
+def _observe_update(crypto: str, balance) -> list:
+    # конвейер обновления: chain не меняется, пока у проекции идет сбор (set_sweeping)
+    zero = Decimal128('0')
+    return [
+        {
+            '$set': {
+                'chain': {
+                    '$cond': [{'$ifNull': ['$sweeping', False]}, '$chain', Decimal128(to_amount(crypto, balance))]
+                },
+                'held': {'$ifNull': ['$held', zero]},
+                'swept': {'$ifNull': ['$swept', zero]},
+                'outgoing': {'$ifNull': ['$outgoing', zero]},
+            }
+        }
+    ]
+
+
+def observe_operation(user_id: int, crypto: str, balance) -> UpdateOne:
+    """Баланс, прочитанный из сети, - это наблюдение, а не движение средств, поэтому в журнал не пишется"""
+    return UpdateOne({'user_id': user_id, 'crypto': crypto}, _observe_update(crypto, balance), upsert=True)
+
+
+async def observe(user_id: int, crypto: str, balance):
+    await DB.balances.update_one({'user_id': user_id, 'crypto': crypto}, _observe_update(crypto, balance), upsert=True)
+
+
+async def verify_ledger() -> List[dict]:
+    """
+    Проигрывает журнал и возвращает проекции, в которых held, swept или outgoing расходятся с суммой записей.
+    chain не проверяется: это наблюдение сети, а не сумма записей журнала.
+    """
+    replayed_fields = [(index, field) for index, field in enumerate(FIELDS) if field != 'chain']
+
+    def signed(index: int) -> dict:
+        return {
+            '$switch': {
+                'branches': [
+                    {'case': {'$eq': ['$kind', kind]}, 'then': {'$multiply': ['$amount', effect[index]]}}
+                    for kind, effect in EFFECTS.items()
+                    if effect[index]
+                ],
+                'default': 0,
+            }
+        }
+
+    group = {'_id': {'user_id': '$user_id', 'crypto': '$crypto'}}
+    group.update({field: {'$sum': signed(index)} for index, field in replayed_fields})
+    replayed = {
+        (row['_id']['user_id'], row['_id']['crypto']): row async for row in DB.ledger.aggregate([{'$group': group}])
+    }
+    mismatches = []
+    async for projection in DB.balances.find({}, {'user_id': 1, 'crypto': 1, **{field: 1 for field in FIELDS}}):
+        key = (projection['user_id'], projection['crypto'])
+        row = replayed.pop(key, {})
+        for _, field in replayed_fields:
+            expected, actual = _from_bson(row.get(field)), _from_bson(projection.get(field))
+            if expected != actual:
+                mismatches.append(
+                    {'user_id': key[0], 'crypto': key[1], 'field': field, 'expected': expected, 'actual': actual}
+                )
+    for (user_id, crypto), row in replayed.items():
+        for _, field in replayed_fields:
+            if _from_bson(row.get(field)):
+                mismatches.append(
+                    {'user_id': user_id, 'crypto': crypto, 'field': field, 'expected': row[field], 'actual': None}
+                )
+    return mismatches
@@ -0,0 +1,102 @@
+"""
+Перевод сохраненных сумм в Decimal128 с точностью монеты.
+Запуск: python -m database.migrations [--dry-run]
+"""
+import argparse
+import asyncio
+import logging
+from typing import Optional
+
+from bson.decimal128 import Decimal128
+from pymongo import UpdateOne
+
+from database.db import DB
+from database.ledger import reserve, observe
+from money import Amount
+from settings.common import CRYPTOS
+
+BATCH_SIZE = 500
+
+
+def _needs_migration(value) -> bool:
+    return value is not None and not isinstance(value, Decimal128)
+
+
+async def _write(collection, operations: list, dry_run: bool) -> int:
+    if operations and not dry_run:
+        await collection.bulk_write(operations, ordered=False)
+    return len(operations)
+
+
+async def migrate_collection(name: str, fields: tuple, crypto_field: Optional[str], dry_run: bool = False) -> int:
+    """Суммы документов коллекции, валюта которых лежит в поле crypto_field"""
+    collection = DB[name]
+    query = {'$or': [{field: {'$exists': True, '$not': {'$type': 'decimal'}}} for field in fields]}
+    migrated, operations = 0, []
+    async for document in collection.find(query):
+        crypto = document[crypto_field]
+        update = {
+            field: Amount.of(crypto, document[field])
+            for field in fields
+            if _needs_migration(document.get(field))
+        }
+        operations.append(UpdateOne({'_id': document['_id']}, {'$set': update}))
+        if len(operations) >= BATCH_SIZE:
+            migrated += await _write(collection, operations, dry_run)
+            operations = []
+    return migrated + await _write(collection, operations, dry_run)
+
+
+async def migrate_wallets(dry_run: bool = False) -> int:
+    """Балансы кошельков в Decimal128 и перенос старых строковых холдов в журнал"""
+    query = {
+        '$or': [
+            condition
+            for crypto in CRYPTOS
+            for condition in (
+                {f'profile.wallet.{crypto}.balance': {'$exists': True, '$not': {'$type': 'decimal'}}},
+                {f'profile.wallet.{crypto}.hold': {'$exists': True}},
+            )
+        ]
+    }
+    migrated, operations = 0, []
+    async for user in DB.users.find(query):
+        update, unset = {}, {}
+        for crypto, wallet in user.get('profile', {}).get('wallet', {}).items():
+            if crypto not in CRYPTOS:
+                continue
+            balance = wallet.get('balance')
+            if _needs_migration(balance):
+                update[f'profile.wallet.{crypto}.balance'] = Amount.of(crypto, balance)
+            if 'hold' in wallet:
+                unset[f'profile.wallet.{crypto}.hold'] = ''
+                hold = Amount.of(crypto, wallet['hold'])
+                if hold and not dry_run:
+                    # баланс кошелька уже за вычетом холда: возвращаем его в проекцию и замораживаем через журнал
+                    await observe(user['user_id'], crypto, Amount.of(crypto, balance) + hold)
+                    if not await reserve(user['user_id'], crypto, hold, ref=f"legacy-hold:{user['user_id']}:{crypto}"):
+                        logging.warning(f"Legacy hold of user {user['user_id']} in {crypto} was not imported")
+        changes = {operator: fields for operator, fields in (('$set', update), ('$unset', unset)) if fields}
+        if changes:
+            operations.append(UpdateOne({'_id': user['_id']}, changes))
+        if len(operations) >= BATCH_SIZE:
+            migrated += await _write(DB.users, operations, dry_run)
+            operations = []
+    return migrated + await _write(DB.users, operations, dry_run)
+
+
+async def migrate_amounts(dry_run: bool = False) -> dict:
+    return {
+        'checks': await migrate_collection('checks', ('amount', 'hold'), 'cryptocurrency', dry_run),
+        'bills': await migrate_collection('bills', ('amount',), 'cryptocurrency', dry_run),
+        'deposits': await migrate_collection('deposits', ('amount',), 'crypto', dry_run),
+        'users': await migrate_wallets(dry_run),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Migrate stored amounts to Decimal128')
+    parser.add_argument('--dry-run', action='store_true', help='only count documents to migrate')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    logging.info(f'Migrated documents: {asyncio.run(migrate_amounts(dry_run=args.dry_run))}')
@@ -0,0 +1,20 @@
+from pymongo import ReturnDocument
+
+from database.db import DB
+
+
+async def sync_nonce(address: str, chain_nonce: int):
+    """Подтягивает счетчик к nonce из сети, если сеть ушла вперед (транзакции отправлены не через бота)"""
+    await DB.nonces.update_one({'address': address}, {'$max': {'next_nonce': chain_nonce}}, upsert=True)
+
+
+async def reset_nonce(address: str, chain_nonce: int):
+    await DB.nonces.update_one({'address': address}, {'$set': {'next_nonce': chain_nonce}}, upsert=True)
+
+
+async def allocate_nonce(address: str) -> int:
+    """Атомарно выдает следующий nonce адреса: параллельные выводы и процессы не получат один и тот же"""
+    counter = await DB.nonces.find_one_and_update(
+        {'address': address}, {'$inc': {'next_nonce': 1}}, return_document=ReturnDocument.BEFORE
+    )
+    return counter['next_nonce']
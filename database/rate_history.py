@@ -0,0 +1,133 @@
+from array import array
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Mapping, Optional, Tuple
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from database.db import DB
+from settings.common import RATE_HISTORY_SETTINGS
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# интервалы свечей в секундах
+INTERVALS = {
+    '1m': 60,
+    '1h': 3600,
+    '1d': 86400,
+}
+
+
+def _bucket_start(timestamp: float, seconds: int) -> datetime:
+    return EPOCH + timedelta(seconds=int(timestamp // seconds * seconds))
+
+
+class RateHistory:
+    """
+    История курсов. Тики копятся в массивах в памяти и пишутся пачкой в документы-корзины
+    (один документ на пару и час), свечи 1m/1h/1d обновляются атомарно на каждом тике.
+    Графики и диапазонные запросы читают только свечи.
+    """
+
+    def __init__(self, flush_size: int = 10, bucket_seconds: int = 3600, retention: Optional[Mapping] = None):
+        self.flush_size = flush_size
+        self.bucket_seconds = bucket_seconds
+        # сколько дней хранить тики и свечи каждого интервала, None - бессрочно
+        self.retention = retention or {}
+        self._times = array('d')
+        self._prices: Dict[str, array] = {}
+        # записи корзин, которые не удалось записать прошлым flush; повторяются следующим
+        self._pending: List[UpdateOne] = []
+
+    def _expire_at(self, kind: str, start: datetime) -> dict:
+        days = self.retention.get(kind)
+        return {'expire_at': start + timedelta(days=days)} if days else {}
+
+    def _tick_update(self, start: datetime, offsets: list, values: list) -> dict:
+        update = {'$push': {'t': {'$each': offsets}, 'p': {'$each': values}}, '$inc': {'n': len(values)}}
+        expire_at = self._expire_at('ticks', start)
+        if expire_at:
+            update['$setOnInsert'] = expire_at
+        return update
+
+    def _candle_operations(self, timestamp: float, prices: Mapping[str, float]) -> List[UpdateOne]:
+        operations = []
+        for interval, seconds in INTERVALS.items():
+            start = _bucket_start(timestamp, seconds)
+            for symbol, price in prices.items():
+                operations.append(
+                    UpdateOne(
+                        {'symbol': symbol, 'interval': interval, 'start': start},
+                        {
+                            '$setOnInsert': {'o': price, **self._expire_at(interval, start)},
+                            '$max': {'h': price},
+                            '$min': {'l': price},
+                            '$set': {'c': price},
+                            '$inc': {'n': 1},
+                        },
+                        upsert=True,
+                    )
+                )
+        return operations
+
+    async def record(self, prices: Mapping[str, float], timestamp: Optional[float] = None):
+        if not prices:
+            return
+        timestamp = timestamp or datetime.now(timezone.utc).timestamp()
+        await DB.rate_candles.bulk_write(self._candle_operations(timestamp, prices), ordered=False)
+
+        self._times.append(timestamp)
+        for symbol, price in prices.items():
+            # пара могла появиться позже остальных - выравниваем массив по длине времен
+            column = self._prices.setdefault(symbol, array('d', [float('nan')] * (len(self._times) - 1)))
+            column.append(price)
+        if len(self._times) >= self.flush_size:
+            await self.flush()
+
+    async def flush(self, app=None):
+        if not self._times and not self._pending:
+            return
+        # буферы забираются целиком: тики, пришедшие во время записи, копятся уже в новых
+        times, prices = self._times, self._prices
+        self._times, self._prices = array('d'), {}
+        buckets: Dict[Tuple[str, datetime], Tuple[list, list]] = {}
+        for index, timestamp in enumerate(times):
+            start = _bucket_start(timestamp, self.bucket_seconds)
+            for symbol, column in prices.items():
+                price = column[index] if index < len(column) else float('nan')
+                if price != price:  # nan - пары не было в этом тике
+                    continue
+                offsets, values = buckets.setdefault((symbol, start), ([], []))
+                offsets.append(round(timestamp - start.timestamp(), 3))
+                values.append(price)
+        operations = self._pending + [
+            UpdateOne({'symbol': symbol, 'start': start}, self._tick_update(start, offsets, values), upsert=True)
+            for (symbol, start), (offsets, values) in buckets.items()
+        ]
+        self._pending = []
+        if not operations:
+            return
+        try:
+            await DB.rate_ticks.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            # записи без ошибки уже применены, повторяются только упавшие - иначе тики задвоятся
+            self._pending = [operations[error['index']] for error in e.details.get('writeErrors', [])]
+            raise
+        except Exception:
+            self._pending = operations
+            raise
+
+    async def get_candles(self, symbol: str, interval: str, start: datetime, end: datetime) -> list:
+        if interval not in INTERVALS:
+            raise ValueError(f'Unknown interval: {interval}')
+        cursor = DB.rate_candles.find(
+            {'symbol': symbol, 'interval': interval, 'start': {'$gte': start, '$lt': end}},
+            {'_id': 0, 'start': 1, 'o': 1, 'h': 1, 'l': 1, 'c': 1, 'n': 1},
+        ).sort('start', 1)
+        return await cursor.to_list(length=None)
+
+    async def get_last_price(self, symbol: str) -> Optional[float]:
+        candle = await DB.rate_candles.find_one({'symbol': symbol, 'interval': '1m'}, sort=[('start', -1)])
+        return candle['c'] if candle else None
+
+
+rate_history = RateHistory(**RATE_HISTORY_SETTINGS)
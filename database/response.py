@@ -1,4 +1,8 @@
 from database.db import DB
 
 async def get_response(trigger):
-    return await DB.responses.find_one({'trigger': trigger})
\ No newline at end of file
+    return await DB.responses.find_one({'trigger': trigger})
+
+async def get_all_responses():
+    cursor = DB.responses.find({})
+    return await cursor.to_list(length=None)
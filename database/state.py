@@ -1,3 +1,6 @@
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Optional
 from database.db import DB
 
 class States:
@@ -5,15 +8,70 @@ class States:
     LAST_MESSAGE = 'last_message'
     LAST_TRIGGER = 'last_trigger'
 
+
+class StateSession:
+    """
+    Состояние пользователя в рамках одного апдейта: документ читается один раз,
+    изменения копятся в памяти и записываются одним $set только измененных ключей.
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.state = {}
+        self.changed = {}
+
+    async def load(self):
+        self.state = await DB.states.find_one({'user_id': self.user_id}) or {}
+
+    def get(self, key=None):
+        return self.state.get(key) if key else self.state
+
+    def set(self, key, value):
+        self.state[key] = value
+        self.changed[key] = value
+
+    async def flush(self):
+        if not self.changed:
+            return
+        changed, self.changed = self.changed, {}
+        await DB.states.update_one({'user_id': self.user_id}, {'$set': changed}, upsert=True)
+
+
+_session: ContextVar[Optional[StateSession]] = ContextVar('state_session', default=None)
+
+
+def _current_session(user_id) -> Optional[StateSession]:
+    session = _session.get()
+    return session if session and session.user_id == user_id else None
+
+
+@asynccontextmanager
+async def state_session(user_id):
+    session = StateSession(user_id=user_id)
+    await session.load()
+    token = _session.set(session)
+    try:
+        yield session
+    finally:
+        _session.reset(token)
+    # при ошибке обработчика состояние не пишется: частичные изменения шага оставили бы его наполовину примененным
+    await session.flush()
+
+
 async def get_state(user_id, key=None) -> dict:
+    session = _current_session(user_id)
+    if session:
+        return session.get(key)
     state = await DB.states.find_one({'user_id': user_id}) or {}
     return state.get(key) if key else state
 
 async def set_state(user_id, key, value):
-    state = await get_state(user_id=user_id)
-    state[key] = value
+    session = _current_session(user_id)
+    if session:
+        session.set(key, value)
+        return
     await DB.states.update_one(
         {'user_id': user_id},
-        {'$set': state},
+        {'$set': {key: value}},
         upsert=True
     )
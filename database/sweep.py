@@ -0,0 +1,62 @@
+from datetime import datetime, timezone
+from typing import Iterable, List
+from bson.decimal128 import Decimal128
+from pymongo import DESCENDING
+
+from database.db import DB
+from database.ledger import to_amount
+from money import Amount
+
+
+class SweepStatus:
+    PENDING = 'pending'
+    BROADCAST = 'broadcast'
+    CONFIRMED = 'confirmed'
+    FAILED = 'failed'
+
+
+# сборы, чьи адреса нельзя собирать повторно: транзакция еще не учтена в журнале
+ACTIVE_SWEEP_STATUSES = [SweepStatus.PENDING, SweepStatus.BROADCAST]
+
+
+def _decode(sweep: dict) -> dict:
+    sweep['amount'] = Amount.of(sweep['crypto'], sweep['amount'])
+    sweep['fee'] = Amount.of(sweep['crypto'], sweep['fee'])
+    return sweep
+
+
+async def get_active_sweeps(crypto: str, statuses: List[str] = ACTIVE_SWEEP_STATUSES) -> List[dict]:
+    cursor = DB.sweeps.find({'crypto': crypto, 'status': {'$in': statuses}})
+    return [_decode(sweep) for sweep in await cursor.to_list(length=None)]
+
+
+async def get_sweep_candidates(crypto: str, threshold, exclude: Iterable[int], limit: int) -> List[int]:
+    """Пользователи с наибольшими балансами адресов не ниже threshold, крупные первыми"""
+    query = {
+        'crypto': crypto,
+        'chain': {'$gte': Decimal128(to_amount(crypto, threshold))},
+        'user_id': {'$nin': list(exclude)},
+    }
+    cursor = DB.balances.find(query, {'user_id': 1}).sort('chain', DESCENDING).limit(limit)
+    return [projection['user_id'] async for projection in cursor]
+
+
+async def create_sweeps(sweeps: List[dict]) -> List[dict]:
+    """
+    Записывает сборы до подписи транзакции: если процесс упадет до сохранения транзакции, адреса останутся
+    в статусе pending без txid и не будут собраны второй раз до ручной сверки
+    """
+    now = datetime.now(timezone.utc)
+    for sweep in sweeps:
+        sweep.update(status=SweepStatus.PENDING, created_at=now)
+    await DB.sweeps.insert_many(sweeps)
+    return sweeps
+
+
+async def update_sweeps(sweeps: List[dict], **fields):
+    await DB.sweeps.update_many(
+        {'_id': {'$in': [sweep['_id'] for sweep in sweeps]}},
+        {'$set': {**fields, 'updated_at': datetime.now(timezone.utc)}},
+    )
+    for sweep in sweeps:
+        sweep.update(fields)
@@ -1,15 +1,14 @@
-from decimal import Decimal
+import asyncio
+from typing import List, Optional
 from aiogram.types import Update
+from address_pool import address_pool
 from database.db import DB
-from units.btc import BTCUnit
-from units.eth import ETHUnit
-from units.trx import TRXUnit
-from units.ton import TONUnit
-from settings.common import CRYPTO_SETTINGS, CRYPTOS
-from utils import ALL_UNITS
+from money import Amount
+from units.registry import registry
+from settings.common import CRYPTOS, ROOT_ID, SWEEP_SETTINGS
 
 async def create_user_dict(source, user_id, date):
-    wallet = {crypto: {'balance': 0, 'hold': 0} for crypto in CRYPTOS}
+    wallet = {crypto: {'balance': Amount(crypto)} for crypto in CRYPTOS}
     return {
         'user_id': user_id,
         'profile': {
@@ -24,11 +23,11 @@ async def create_user_dict(source, user_id, date):
         'updated_at': date
     }
 
-async def generate_crypto_data(unit_class, user_id):
-    unit = unit_class(network=CRYPTO_SETTINGS[unit_class.__name__[:-4]]['network'])
-    return await unit.generate_address(user_id)
+# поля профиля телеграма, которые обновляются, только если изменились
+PROFILE_FIELDS = ('username', 'first_name', 'last_name', 'language_code')
 
 async def update_or_create_user(update: Update):
+    """Создает пользователя при первом апдейте; обычные сообщения документ не переписывают"""
     if update.message:
         source = update.message
         date = source.date
@@ -39,32 +38,57 @@ async def update_or_create_user(update: Update):
         return
     user_id = source.from_user.id
 
-    # Получаем текущие данные пользователя из базы данных
     db_user = await get_user_by_id(user_id=user_id)
-
     if not db_user:
-        db_user = await create_user_dict(source, user_id, date)
+        # адреса выдаются позже, при первом пополнении или выводе в конкретной валюте
+        await DB.users.update_one(
+            {'user_id': user_id},
+            {'$setOnInsert': await create_user_dict(source, user_id, date)},
+            upsert=True,
+        )
+        return
 
-    crypto_units = ALL_UNITS
-    if not db_user.get('profile', {}).get('wallet'):
-        for unit_class in crypto_units:
-            address, private_key = await generate_crypto_data(unit_class, user_id)
-            db_user['profile']['wallet'][unit_class.__name__[:-4]].update({
-                'address': address,
-                'hold': 0,
-                'private_key': private_key if unit_class is not TRXUnit else private_key.hex()
-            })
+    changed = {
+        field: getattr(source.from_user, field)
+        for field in PROFILE_FIELDS
+        if db_user.get(field) != getattr(source.from_user, field)
+    }
+    if changed:
+        await DB.users.update_one({'user_id': user_id}, {'$set': {**changed, 'updated_at': date}})
 
-    for unit_class in crypto_units:
-        if not db_user.get('profile', {}).get('wallet', {}).get(unit_class.__name__[:-4], {}).get('hold'):
-            db_user['profile']['wallet'][unit_class.__name__[:-4]]['hold'] = 0
+async def _generate_wallet(user_id: int, crypto: str) -> dict:
+    # корневой кошелек BTC - мастер-ключ для деривации, его адреса в пул не попадают
+    address, private_key = await registry.get(crypto).generate_address(user_id)
+    return {'address': address, 'private_key': private_key if isinstance(private_key, str) else private_key.hex()}
 
-    # Сохраняем обновленные данные пользователя в базе данных
+async def provision_wallets(user: dict, cryptos: List[str]) -> dict:
+    """
+    Выдает адреса в тех валютах из cryptos, где их еще нет, параллельно для всех сетей.
+    Пишет только поля новых адресов и обновляет переданный документ пользователя.
+    """
+    user_id = user['user_id']
+    wallet = user['profile']['wallet']
+    missing = [crypto for crypto in cryptos if not wallet.get(crypto, {}).get('address')]
+    if not missing:
+        return wallet
+    if user_id == ROOT_ID:
+        generated = await asyncio.gather(*[_generate_wallet(user_id, crypto) for crypto in missing])
+        addresses = dict(zip(missing, generated))
+    else:
+        addresses = await address_pool.claim_wallet(user_id, missing)
     await DB.users.update_one(
         {'user_id': user_id},
-        {'$set': db_user},
-        upsert=True
+        {
+            '$set': {
+                f'profile.wallet.{crypto}.{field}': value
+                for crypto, address in addresses.items()
+                for field, value in address.items()
+            }
+        },
     )
+    for crypto, address in addresses.items():
+        wallet.setdefault(crypto, {'balance': Amount(crypto)}).update(address)
+    return wallet
 
 async def get_user(update: Update):
     if update.message:
@@ -90,10 +114,14 @@ async def save_user(user_id: int, user_data: dict):
 async def get_user_by_id(user_id: int):
     return await DB.users.find_one({'user_id': user_id})
 
-async def update_user_hold(user_id: int, crypto: str, amount: Decimal):
-    user = await get_user_by_id(user_id=user_id)
-    hold = user['profile']['wallet'][crypto]['hold']
-    return await DB.users.update_one(
-        {'user_id': user_id},
-        {'$set': {f'profile.wallet.{crypto}.hold': str(Decimal(f'{hold}') + amount)}}
-    )
\ No newline at end of file
+def is_hot_wallet(user_id: int, crypto: str) -> bool:
+    """В сетях со сбором адрес корневого пользователя - горячий кошелек: на нем средства всех пользователей"""
+    return user_id == ROOT_ID and crypto in SWEEP_SETTINGS['chains']
+
+async def get_hot_wallet(crypto: str) -> Optional[dict]:
+    """Корневой пользователь, чей адрес в сети crypto служит горячим кошельком; None - он еще не заведен"""
+    user = await get_user_by_id(ROOT_ID)
+    if user is None:
+        return None
+    await provision_wallets(user, [crypto])
+    return user
@@ -0,0 +1,123 @@
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from database.db import DB
+from money import Amount
+
+
+class WithdrawalStatus:
+    QUEUED = 'queued'
+    SIGNED = 'signed'
+    BROADCAST = 'broadcast'
+    CONFIRMED = 'confirmed'
+    FAILED = 'failed'
+
+
+# статусы, по которым воркеру еще есть что делать
+ACTIVE_STATUSES = [WithdrawalStatus.QUEUED, WithdrawalStatus.SIGNED, WithdrawalStatus.BROADCAST]
+
+
+def _decode(withdrawal: Optional[dict]) -> Optional[dict]:
+    if withdrawal:
+        withdrawal['amount'] = Amount.of(withdrawal['crypto'], withdrawal['amount'])
+        withdrawal['fee'] = Amount.of(withdrawal['crypto'], withdrawal['fee'])
+    return withdrawal
+
+
+async def get_withdrawal_by_key(key: str) -> Optional[dict]:
+    return _decode(await DB.withdrawals.find_one({'key': key}))
+
+
+async def create_withdrawal(
+    key: str, user_id: int, crypto: str, address: str, amount: Amount, fee: Amount
+) -> Optional[dict]:
+    """
+    Создает задание на вывод с ключом идемпотентности, None - задание с этим ключом уже есть.
+    Пока next_attempt_at пустой, воркеры его не берут: задание становится доступным после холда (activate_withdrawal).
+    """
+    withdrawal = {
+        'key': key,
+        'user_id': user_id,
+        'crypto': crypto,
+        'address': address,
+        'amount': amount,
+        'fee': fee,
+        'status': WithdrawalStatus.QUEUED,
+        'attempts': 0,
+        'next_attempt_at': None,
+        'creation_date': datetime.now(timezone.utc),
+    }
+    try:
+        await DB.withdrawals.insert_one(withdrawal)
+    except DuplicateKeyError:
+        return None
+    return withdrawal
+
+
+async def activate_withdrawal(withdrawal_id) -> bool:
+    """False - задания уже нет: его удалила уборка неактивных заданий (get_inactive_withdrawals)"""
+    result = await DB.withdrawals.update_one(
+        {'_id': withdrawal_id}, {'$set': {'next_attempt_at': datetime.now(timezone.utc)}}
+    )
+    return result.matched_count > 0
+
+
+async def delete_withdrawal(withdrawal_id):
+    # удаляется только задание, которое еще не отдано воркерам
+    await DB.withdrawals.delete_one({'_id': withdrawal_id, 'status': WithdrawalStatus.QUEUED, 'next_attempt_at': None})
+
+
+async def get_inactive_withdrawals(crypto: str, created_before: datetime, limit: int = 100) -> List[dict]:
+    """Задания, которые так и не стали доступны воркерам: обработка апдейта прервалась между созданием и холдом"""
+    cursor = DB.withdrawals.find(
+        {
+            'crypto': crypto,
+            'status': WithdrawalStatus.QUEUED,
+            'next_attempt_at': None,
+            'creation_date': {'$lt': created_before},
+        }
+    )
+    return [_decode(withdrawal) for withdrawal in await cursor.to_list(length=limit)]
+
+
+def _ready(crypto: str, statuses: List[str], now: datetime) -> dict:
+    return {
+        'crypto': crypto,
+        'status': {'$in': statuses},
+        'next_attempt_at': {'$lte': now},
+        '$or': [{'locked_until': None}, {'locked_until': {'$lt': now}}],
+    }
+
+
+async def lock_withdrawal(
+    crypto: str, owner: str, lock_timeout: float, statuses: List[str] = ACTIVE_STATUSES
+) -> Optional[dict]:
+    """Берет одно готовое к обработке задание сети; блокировка истекает, если воркер упал"""
+    now = datetime.now(timezone.utc)
+    return _decode(
+        await DB.withdrawals.find_one_and_update(
+            _ready(crypto, statuses, now),
+            {'$set': {'locked_by': owner, 'locked_until': now + timedelta(seconds=lock_timeout)}},
+            sort=[('next_attempt_at', ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+    )
+
+
+async def get_ready_withdrawals(crypto: str, statuses: List[str], limit: int) -> List[dict]:
+    """Готовые к обработке задания без блокировки - чтобы решить, пора ли собирать пачку"""
+    cursor = DB.withdrawals.find(_ready(crypto, statuses, datetime.now(timezone.utc)))
+    return [_decode(withdrawal) for withdrawal in await cursor.sort('next_attempt_at', ASCENDING).to_list(length=limit)]
+
+
+async def update_withdrawal(withdrawal: dict, owner: str, **fields) -> bool:
+    """Меняет задание, только пока блокировка принадлежит owner; False - задание перехватил другой воркер"""
+    result = await DB.withdrawals.update_one(
+        {'_id': withdrawal['_id'], 'locked_by': owner},
+        {'$set': {**fields, 'updated_at': datetime.now(timezone.utc)}},
+    )
+    if result.modified_count:
+        withdrawal.update(fields)
+    return bool(result.modified_count)
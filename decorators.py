@@ -1,25 +1,110 @@
+import asyncio
 import time
+from collections import OrderedDict
+from functools import wraps
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
 
+# все кэши процесса по имени, для статистики
+CACHES: Dict[str, 'AsyncTTLCache'] = {}
 
-def timed_cache(seconds):
+
+class AsyncTTLCache:
+    """LRU кэш с TTL на запись; одновременные промахи по одному ключу ждут один общий запрос"""
+
+    def __init__(self, name: str, ttl: float, maxsize: int = 1024):
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        CACHES[name] = self
+
+    def get(self, key: Hashable, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Optional[Hashable] = None):
+        if key is None:
+            self._data.clear()
+        else:
+            self._data.pop(key, None)
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable], cache_none: bool = False):
+        missing = object()
+        value = self.get(key, missing)
+        if value is not missing:
+            self.hits += 1
+            return value
+
+        task = self._inflight.get(key)
+        if task:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(loader())
+            self._inflight[key] = task
+
+            def _done(finished: asyncio.Task):
+                self._inflight.pop(key, None)
+                if finished.cancelled() or finished.exception():
+                    return
+                result = finished.result()
+                if result is not None or cache_none:
+                    self.set(key, result)
+
+            task.add_done_callback(_done)
+        # shield: отмена одного ожидающего не отменяет общий запрос для остальных
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'evictions': self.evictions,
+        }
+
+
+def _make_key(args: tuple, kwargs: dict) -> Hashable:
+    return args + tuple(sorted(kwargs.items())) if kwargs else args
+
+
+def async_cache(ttl: float, maxsize: int = 1024, key: Optional[Callable[..., Hashable]] = None, cache_none: bool = False):
+    """
+    Кэширует результат корутины по всем аргументам вызова (или по ключу из key).
+    Для методов key обязателен, если экземпляры создаются заново на каждый вызов.
+    """
     def decorator(func):
-        cache = {}
-        
+        cache = AsyncTTLCache(name=func.__qualname__, ttl=ttl, maxsize=maxsize)
+
+        @wraps(func)
         async def wrapped(*args, **kwargs):
-            # key = (args, tuple(kwargs.items()))
-            key = args[0].__class__.__name__
-            current_time = time.time()
-            
-            # Check if cache is valid
-            if key in cache:
-                value, timestamp = cache[key]
-                if current_time - timestamp < seconds:
-                    return value
-            
-            # Call the function and store the result in cache
-            result = await func(*args, **kwargs)
-            cache[key] = (result, current_time)
-            return result
-        
+            cache_key = key(*args, **kwargs) if key else _make_key(args, kwargs)
+            return await cache.get_or_load(cache_key, lambda: func(*args, **kwargs), cache_none=cache_none)
+
+        wrapped.cache = cache
         return wrapped
-    return decorator
\ No newline at end of file
+    return decorator
+
+
+def cache_stats() -> dict:
+    return {name: cache.stats() for name, cache in CACHES.items()}
@@ -0,0 +1,234 @@
+import json
+import logging
+import time
+from abc import ABC, abstractmethod
+from decimal import Decimal
+from gettext import gettext as _
+from typing import Dict, List, NamedTuple, Optional
+
+from aiogram import Bot
+from tronpy.keys import to_base58check_address
+
+from balances import balance_refresher
+from database.deposit import (
+    DepositStatus,
+    get_block_cursor,
+    get_deposit_addresses,
+    get_pending_deposits,
+    save_deposit,
+    set_block_cursor,
+    update_deposit,
+)
+from database.ledger import credit as ledger_credit
+from database.user import is_hot_wallet
+from money import Amount
+from settings.common import DEPOSIT_WATCHER_SETTINGS, ETH, TRX
+from telegram import send_message
+from units.registry import registry
+
+
+class Transfer(NamedTuple):
+    txid: str
+    block: int
+    to: str
+    amount: Decimal
+
+
+class BlockSource(ABC):
+    @abstractmethod
+    async def latest_block(self) -> int:
+        pass
+
+    @abstractmethod
+    async def get_transfers(self, number: int) -> List[Transfer]:
+        """Входящие переводы нативной монеты в блоке"""
+        pass
+
+    def normalize(self, address: str) -> str:
+        return address
+
+
+class EthBlockSource(BlockSource):
+    def __init__(self, unit):
+        self.unit = unit
+
+    async def latest_block(self) -> int:
+        return await self.unit.client.wait(self.unit.web3.eth.block_number)
+
+    async def get_transfers(self, number: int) -> List[Transfer]:
+        block = await self.unit.client.wait(self.unit.web3.eth.get_block(number, full_transactions=True))
+        return [
+            Transfer(txid=tx['hash'].hex(), block=number, to=tx['to'], amount=Decimal(tx['value']) / Decimal(10**18))
+            for tx in block['transactions']
+            if tx.get('to') and tx['value'] > 0
+        ]
+
+    def normalize(self, address: str) -> str:
+        # в блоках адреса в checksum-регистре, у пользователей - как сгенерировались
+        return address.lower()
+
+
+class TrxBlockSource(BlockSource):
+    def __init__(self, unit):
+        self.unit = unit
+
+    async def latest_block(self) -> int:
+        return await self.unit.client.call(self.unit.tron.get_latest_block_number)
+
+    async def get_transfers(self, number: int) -> List[Transfer]:
+        block = await self.unit.client.call(self.unit.tron.get_block, number)
+        transfers = []
+        for tx in block.get('transactions', []):
+            for contract in tx['raw_data'].get('contract', []):
+                if contract['type'] != 'TransferContract':
+                    continue
+                value = contract['parameter']['value']
+                transfers.append(
+                    Transfer(
+                        txid=tx['txID'],
+                        block=number,
+                        to=to_base58check_address(value['to_address']),
+                        amount=Decimal(value['amount']) / Decimal(10**6),
+                    )
+                )
+        return transfers
+
+
+class RecordedBlockSource(BlockSource):
+    """Локальная подмена ноды: отдает заранее записанные блоки, для тестов и отладки"""
+
+    def __init__(self, blocks: Dict[int, List[Transfer]], latest: Optional[int] = None):
+        self.blocks = blocks
+        self.latest = latest if latest is not None else max(blocks, default=0)
+
+    @classmethod
+    def from_file(cls, path: str) -> 'RecordedBlockSource':
+        with open(path) as file:
+            data = json.load(file)
+        blocks = {
+            int(number): [
+                Transfer(txid=tx['txid'], block=int(number), to=tx['to'], amount=Decimal(str(tx['amount'])))
+                for tx in transfers
+            ]
+            for number, transfers in data['blocks'].items()
+        }
+        return cls(blocks=blocks, latest=data.get('latest'))
+
+    async def latest_block(self) -> int:
+        return self.latest
+
+    async def get_transfers(self, number: int) -> List[Transfer]:
+        return self.blocks.get(number, [])
+
+
+class DepositWatcher:
+    """
+    Следит за новыми блоками сети и сверяет получателей переводов с адресами пользователей в памяти.
+    Позиция сканирования хранится в базе, после рестарта обход продолжается с нее.
+    """
+
+    def __init__(
+        self,
+        crypto: str,
+        source: BlockSource,
+        bot: Optional[Bot] = None,
+        confirmations: int = 12,
+        interval: float = 15,
+        max_blocks: int = 50,
+        reload_interval: float = 60,
+    ):
+        self.crypto = crypto
+        self.source = source
+        self.bot = bot
+        self.confirmations = confirmations
+        self.interval = interval
+        self.max_blocks = max_blocks
+        self.reload_interval = reload_interval
+        self.addresses: Dict[str, int] = {}
+        self._loaded_at = None
+
+    async def load_addresses(self, force: bool = False):
+        if not force and self._loaded_at and time.monotonic() - self._loaded_at < self.reload_interval:
+            return
+        addresses = await get_deposit_addresses(self.crypto)
+        # поступления на горячий кошелек - сборы с адресов пользователей, а не пополнения
+        self.addresses = {
+            self.source.normalize(address): user_id
+            for address, user_id in addresses.items()
+            if not is_hot_wallet(user_id, self.crypto)
+        }
+        self._loaded_at = time.monotonic()
+
+    async def scan(self, latest: int) -> int:
+        cursor = await get_block_cursor(self.crypto)
+        # при первом запуске история не сканируется, начинаем с текущего блока
+        start = cursor + 1 if cursor is not None else latest
+        end = min(latest, start + self.max_blocks - 1)
+        found = 0
+        for number in range(start, end + 1):
+            for transfer in await self.source.get_transfers(number):
+                user_id = self.addresses.get(self.source.normalize(transfer.to))
+                if user_id is None:
+                    continue
+                if await save_deposit(
+                    crypto=self.crypto,
+                    txid=transfer.txid,
+                    block=number,
+                    address=transfer.to,
+                    amount=transfer.amount,
+                    user_id=user_id,
+                ):
+                    found += 1
+            await set_block_cursor(self.crypto, number)
+        return found
+
+    async def confirm(self, latest: int) -> int:
+        confirmed = 0
+        for deposit in await get_pending_deposits(self.crypto):
+            confirmations = latest - deposit['block'] + 1
+            if confirmations >= self.confirmations:
+                # сначала журнал: запись идемпотентна по ref, и если статус не сохранится, следующий проход повторит ее
+                await self.credit(deposit)
+                await update_deposit(deposit['_id'], confirmations=confirmations, status=DepositStatus.CONFIRMED)
+                await self.notify(deposit)
+                confirmed += 1
+            elif confirmations != deposit.get('confirmations'):
+                await update_deposit(deposit['_id'], confirmations=confirmations)
+        return confirmed
+
+    async def credit(self, deposit: dict):
+        await ledger_credit(
+            user_id=deposit['user_id'], crypto=self.crypto, amount=deposit['amount'], ref=f"deposit:{deposit['_id']}"
+        )
+        await balance_refresher.touch(deposit['user_id'])
+
+    async def notify(self, deposit: dict):
+        if not self.bot:
+            return
+        text = _('Пополнение зачислено') + f"\n{Amount.of(self.crypto, deposit['amount']).format()} {self.crypto}"
+        try:
+            await send_message(bot=self.bot, chat_id=deposit['user_id'], text=text)
+        except Exception as e:
+            # зачисление уже учтено, недоставленное уведомление его не откатывает
+            logging.warning(f"[{self.crypto}] Deposit {deposit['_id']} notification failed: {e!r}")
+
+    async def poll(self):
+        await self.load_addresses()
+        latest = await self.source.latest_block()
+        found = await self.scan(latest)
+        confirmed = await self.confirm(latest)
+        if found or confirmed:
+            logging.info(f'[{self.crypto}] Deposits found: {found}, confirmed: {confirmed}')
+
+
+BLOCK_SOURCES = {
+    ETH: EthBlockSource,
+    TRX: TrxBlockSource,
+}
+
+
+def create_deposit_watchers(bot: Bot) -> List[DepositWatcher]:
+    return [
+        DepositWatcher(crypto=crypto, source=BLOCK_SOURCES[crypto](registry.get(crypto)), bot=bot, **settings)
+        for crypto, settings in DEPOSIT_WATCHER_SETTINGS.items()
+    ]
@@ -1,20 +1,18 @@
 import json
 import logging
-import importlib
 from datetime import datetime
 from typing import Callable, Awaitable, Any, Optional
 from aiogram import Bot
 from aiogram.client.default import Default
 from aiohttp import web
-from aiogram.types import Update, InlineKeyboardMarkup
+from aiogram.types import Update
 from gettext import gettext as _
 
-from triggers import Triggers, get_all_triggers
 from database.keyboard import get_keyboard
-from database.response import get_response
-from database.state import States, get_state, set_state
+from database.state import States, get_state, set_state, state_session
 from database.user import update_or_create_user
 from database.user import get_user
+from router import router
 from telegram import answer_callback_query, delete_last_message, send_message
 
 
@@ -42,8 +40,20 @@ class CustomDispatcher:
     def register_handler(self, update_type: Any, handler: Callable[[Update], Awaitable[None]]):
         self.handlers[update_type] = handler
 
+    @staticmethod
+    def get_update_user_id(data: dict) -> Optional[int]:
+        """Достает id пользователя из сырого апдейта, не разбирая его целиком"""
+        for key in ('message', 'callback_query', 'inline_query', 'chosen_inline_result'):
+            if data.get(key):
+                return data[key].get('from', {}).get('id')
+        return None
+
     async def handle_webhook(self, request: web.Request, bot):
         data = await request.json()
+        await self.handle_update(data, bot)
+        return web.Response(status=200)
+
+    async def handle_update(self, data: dict, bot: Bot):
         update = Update(**data)
 
         update_dict = update.model_dump()
@@ -54,7 +64,6 @@ class CustomDispatcher:
         logging.info(f'Process update: {formatted_json}')
 
         await self.process_update(update, bot)
-        return web.Response(status=200)
 
     async def set_webhook(self, bot, webhook_url):
         await bot.delete_webhook()
@@ -74,21 +83,15 @@ class CustomDispatcher:
 
 
 async def _handle_response(update: Update, bot: Bot, trigger: str, page: int = 1) -> dict:
-    async def _get_context(class_path) -> dict:
-        module_name, class_name = class_path.rsplit('.', 1)
-        module = importlib.import_module(module_name)
-        cls = getattr(module, class_name) if hasattr(module, class_name) else None
-        return await cls(user=user, page=page).ctx() if cls else {}
-
-    async def _get_reply_markup(class_path) -> Optional[InlineKeyboardMarkup]:
-        module_name, class_name = class_path.rsplit('.', 1)
-        module = importlib.import_module(module_name)
-        cls = getattr(module, class_name) if hasattr(module, class_name) else None
-        return await cls(user=user, page=page).rm() if cls else None
+    user = await get_user(update=update)
+    # все чтения и записи состояния за апдейт идут через одну сессию: одно чтение и одна запись в базу
+    async with state_session(user_id=user['user_id']):
+        await _respond(user=user, bot=bot, trigger=trigger, page=page)
+    return user
 
-    empty = _('Ответ не найден')
 
-    user = await get_user(update=update)
+async def _respond(user: dict, bot: Bot, trigger: str, page: int):
+    empty = _('Ответ не найден')
 
     last = await get_state(user_id=user['user_id'], key=States.LAST_MESSAGE)
     if last:
@@ -108,29 +111,22 @@ async def _handle_response(update: Update, bot: Bot, trigger: str, page: int = 1
 
     selected = new_selected
 
-    # Обработка произвольного ввода пользователя
-    all_triggers = get_all_triggers(Triggers)
-    if trigger not in all_triggers:
-        trigger = Triggers.USER_INPUT
+    route = await router.resolve(trigger)
 
-    response_data = await get_response(trigger=trigger)
+    if route:
+        context_instance = route.context_cls(user=user, page=page) if route.context_cls else None
+        context = await context_instance.ctx() if context_instance else {}
 
-    if response_data:
-        ctx_path = f"context.{response_data.get('context', 'base.DefaultContext')}"
-        context = await _get_context(ctx_path)
-
-        response_text = response_data.get('response', empty).format(**context)
-        keyboard_id = response_data.get('keyboard_id')
-        keyboard = await get_keyboard(keyboard_id, user) if keyboard_id else None
-        if not keyboard:
-            keyboard = await _get_reply_markup(ctx_path)
+        response_text = (route.response or empty).format(**context)
+        keyboard = await get_keyboard(route.keyboard_id, user) if route.keyboard_id else None
+        if not keyboard and context_instance:
+            keyboard = await context_instance.rm()
         message = await send_message(bot=bot, chat_id=user['user_id'], text=response_text, reply_markup=keyboard)
     else:
         message = await send_message(bot=bot, chat_id=user['user_id'], text=empty)
 
     if message:
         await set_state(user_id=user['user_id'], key=States.LAST_MESSAGE, value=message.message_id)
-    return user
 
 
 # Обработка сообщения
@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Dict, NamedTuple, Optional
+
+from database.db import DB
+from settings.common import CRYPTO_SETTINGS, FEE_ORACLE_SETTINGS
+from units.registry import registry
+
+
+class FeeEstimate(NamedTuple):
+    """Комиссия за один перевод в монетах сети"""
+    crypto: str
+    low: Decimal
+    medium: Decimal
+    high: Decimal
+    updated_at: float
+    stale: bool = False
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.updated_at
+
+    def get(self, priority: str = 'medium') -> Decimal:
+        return getattr(self, priority)
+
+
+class FeeOracle:
+    """
+    Оценки комиссий сетей в памяти процесса. Обновляются фоновой задачей,
+    валидаторы и экраны читают их без запросов в сеть и базу.
+    Если обновление не удалось, остается прошлая оценка с пометкой stale.
+    """
+
+    def __init__(self, interval: int = 120, max_age: int = 600):
+        self.interval = interval
+        self.max_age = max_age
+        self._estimates: Dict[str, FeeEstimate] = {}
+
+    def get(self, crypto: str) -> Optional[FeeEstimate]:
+        estimate = self._estimates.get(crypto)
+        if estimate is None:
+            return None
+        return estimate._replace(stale=estimate.age > self.max_age)
+
+    def all(self) -> Dict[str, FeeEstimate]:
+        return {crypto: self.get(crypto) for crypto in self._estimates}
+
+    async def refresh_crypto(self, crypto: str) -> FeeEstimate:
+        fees = await registry.get(crypto).estimate_fees()
+        estimate = FeeEstimate(crypto=crypto, updated_at=time.time(), **fees)
+        self._estimates[crypto] = estimate
+        await DB.network_fees.update_one(
+            {'crypto': crypto},
+            {
+                '$set': {
+                    'low': str(estimate.low),
+                    'medium': str(estimate.medium),
+                    'high': str(estimate.high),
+                    'updated_at': datetime.fromtimestamp(estimate.updated_at, timezone.utc),
+                }
+            },
+            upsert=True,
+        )
+        return estimate
+
+    async def load(self, crypto: str):
+        # последняя сохраненная оценка - чтобы после рестарта не остаться без комиссии, пока сеть недоступна
+        document = await DB.network_fees.find_one({'crypto': crypto})
+        if document and 'medium' in document:
+            updated_at = document['updated_at'].replace(tzinfo=timezone.utc).timestamp()
+            self._estimates[crypto] = FeeEstimate(
+                crypto=crypto,
+                low=Decimal(document['low']),
+                medium=Decimal(document['medium']),
+                high=Decimal(document['high']),
+                updated_at=updated_at,
+            )
+
+    async def refresh(self):
+        cryptos = list(CRYPTO_SETTINGS)
+        results = await asyncio.gather(*[self.refresh_crypto(crypto) for crypto in cryptos], return_exceptions=True)
+        for crypto, result in zip(cryptos, results):
+            if isinstance(result, Exception):
+                logging.error(f'[{crypto}] Failed to refresh network fees: {result!r}')
+                if crypto not in self._estimates:
+                    await self.load(crypto)
+
+    def stats(self) -> dict:
+        return {
+            crypto: {'medium': str(estimate.medium), 'age': round(estimate.age), 'stale': estimate.stale}
+            for crypto, estimate in self.all().items()
+        }
+
+
+fee_oracle = FeeOracle(**FEE_ORACLE_SETTINGS)
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from settings.common import HTTP_CLIENT_SETTINGS
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class HostStats:
+    __slots__ = ('requests', 'errors', 'retries', 'latency_total', 'latency_max')
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'retries': self.retries,
+            'latency_avg': round(self.latency_total / self.requests, 4) if self.requests else 0,
+            'latency_max': round(self.latency_max, 4),
+        }
+
+
+class HttpClient:
+    """
+    Общая http сессия приложения: пул keep-alive соединений на хост, кэш DNS,
+    таймауты и повторы с экспоненциальной задержкой и джиттером.
+    """
+
+    def __init__(
+        self,
+        timeout: float = 10,
+        retries: int = 2,
+        backoff: float = 0.3,
+        limit: int = 100,
+        limit_per_host: int = 16,
+        dns_ttl: int = 300,
+        keepalive: float = 30,
+    ):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_ttl = dns_ttl
+        self.keepalive = keepalive
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._stats: Dict[str, HostStats] = {}
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.dns_ttl,
+                keepalive_timeout=self.keepalive,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self._session
+
+    def setup(self, app):
+        app.on_cleanup.append(self.close)
+
+    async def close(self, app=None):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def _delay(self, attempt: int) -> float:
+        # full jitter: клиенты не повторяют запросы синхронно после общего сбоя
+        return random.uniform(0, self.backoff * 2 ** attempt)
+
+    async def request(self, method: str, url: str, retries: Optional[int] = None, **kwargs):
+        host = urlsplit(url).netloc
+        stats = self._stats.setdefault(host, HostStats())
+        retries = self.retries if retries is None else retries
+        attempt = 0
+        while True:
+            started_at = time.monotonic()
+            stats.requests += 1
+            try:
+                async with self.session.request(method, url, **kwargs) as response:
+                    if response.status in RETRY_STATUSES and attempt < retries:
+                        raise aiohttp.ClientResponseError(
+                            response.request_info, response.history, status=response.status
+                        )
+                    response.raise_for_status()
+                    return await response.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                stats.errors += 1
+                retriable = not isinstance(error, aiohttp.ClientResponseError) or error.status in RETRY_STATUSES
+                if not retriable or attempt >= retries:
+                    logging.error(f'HTTP {method} {host} failed: {error!r}')
+                    raise
+                stats.retries += 1
+            finally:
+                latency = time.monotonic() - started_at
+                stats.latency_total += latency
+                stats.latency_max = max(stats.latency_max, latency)
+            await asyncio.sleep(self._delay(attempt))
+            attempt += 1
+
+    async def get_json(self, url: str, params: Optional[dict] = None, **kwargs):
+        return await self.request('GET', url, params=params, **kwargs)
+
+    async def post_json(self, url: str, json=None, **kwargs):
+        return await self.request('POST', url, json=json, **kwargs)
+
+    def stats(self) -> dict:
+        return {host: stats.as_dict() for host, stats in self._stats.items()}
+
+
+http_client = HttpClient(**HTTP_CLIENT_SETTINGS)
@@ -1,13 +1,44 @@
 import asyncio
+import json
 import logging
+from datetime import datetime, timedelta, timezone
 from traceback import print_tb
 from aiohttp import web
 from aiogram import Bot, types
-from database.db import DB
+from address_pool import address_pool
+from balances import balance_refresher
+from database.bill import expire_bills
+from database.check import expire_check
+from database.indexes import bootstrap_indexes
+from database.rate_history import rate_history
+from database.ledger import release, verify_ledger
+from decorators import cache_stats
+from deposits import create_deposit_watchers
+from fees import fee_oracle
+from http_client import http_client
 from dispatcher import CustomDispatcher, handle_callback_query, handle_message
 from rates import CryptoRatesUpdater
-from settings.common import BOT_TOKEN, BASE_URL, CRYPTO_SETTINGS
-from utils import ALL_UNITS
+from router import router
+from scheduler import scheduler
+from settings.common import (
+    BILL_LIFETIME,
+    BOT_TOKEN,
+    BASE_URL,
+    CHECK_LIFETIME,
+    EXPIRY_SWEEP_INTERVAL,
+    LEDGER_VERIFY_INTERVAL,
+    MONGO_INDEX_AUDIT,
+    RATES_UPDATE_INTERVAL,
+    WEBHOOK_MODE,
+    WEBHOOK_QUEUE_SIZE,
+    WEBHOOK_WORKERS,
+)
+from units.clients import shutdown_chain_clients
+from units.registry import registry
+from sweeper import sweeper
+from update_queue import UpdateQueue
+from validators.address import validation_stats
+from withdrawals import create_withdrawal_worker
 
 logging.basicConfig(level=logging.INFO)
 
@@ -17,41 +48,143 @@ dispatcher = CustomDispatcher()
 dispatcher.register_handler(types.message.Message, handle_message)
 dispatcher.register_handler(types.callback_query.CallbackQuery, handle_callback_query)
 
+
+async def handle_update(data: dict):
+    await dispatcher.handle_update(data, bot=bot)
+
+update_queue = UpdateQueue(handler=handle_update, workers=WEBHOOK_WORKERS, max_size=WEBHOOK_QUEUE_SIZE)
+
 class WebHookView(web.View):
     async def post(self):
         bot_token = self.request.match_info.get('bot_token')
         if bot_token != BOT_TOKEN:
             return web.Response(status=403)
+        if WEBHOOK_MODE == 'queue':
+            try:
+                data = await self.request.json()
+            except json.JSONDecodeError:
+                # битое тело не станет валидным при повторной доставке
+                return web.Response(status=400)
+            if not isinstance(data, dict):
+                return web.Response(status=400)
+            if not update_queue.put(dispatcher.get_update_user_id(data), data):
+                # очередь переполнена - пусть телеграм повторит доставку позже
+                return web.Response(status=503)
+            return web.Response(status=200)
         try:
             await dispatcher.handle_webhook(self.request, bot=bot)
+        except json.JSONDecodeError:
+            return web.Response(status=400)
         except Exception as global_error:
             logging.error(global_error)
             print_tb(global_error.__traceback__)
             logging.error('Error while processing webhook')
         return web.Response(status=200)
 
+class StatsView(web.View):
+    async def get(self):
+        bot_token = self.request.match_info.get('bot_token')
+        if bot_token != BOT_TOKEN:
+            return web.Response(status=403)
+        return web.json_response({
+            'update_queue': update_queue.stats(),
+            'caches': cache_stats(),
+            'http': http_client.stats(),
+            'rates': updater.aggregator.stats(),
+            'jobs': scheduler.stats(),
+            'address_pool': address_pool.stats(),
+            'withdrawals': withdrawal_worker.stats(),
+            'sweeps': sweeper.stats(),
+            'address_validation': validation_stats(),
+            'fees': fee_oracle.stats(),
+        })
+
+class HealthView(web.View):
+    async def get(self):
+        bot_token = self.request.match_info.get('bot_token')
+        if bot_token != BOT_TOKEN:
+            return web.Response(status=403)
+        units = await registry.health()
+        status = 200 if all(result['ok'] for result in units.values()) else 503
+        return web.json_response({'units': units}, status=status)
+
 async def set_webhook(app):
     await bot.delete_webhook()
     webhook_url = f'{BASE_URL}/{BOT_TOKEN}/'
     await bot.set_webhook(webhook_url)
     logging.info(f'Webhook set to {webhook_url}')
     
-async def get_network_fees(app):
-    def _get_crypto(unit):
-        return unit.__name__[:-4]
-    for unit in ALL_UNITS:
-        if _get_crypto(unit) in CRYPTO_SETTINGS:
-            network = CRYPTO_SETTINGS[_get_crypto(unit)]['network']
-            network_fee = await unit(network=network).get_network_fee()
-            await DB.network_fees.update_one({'crypto': _get_crypto(unit)}, {'$set': {'network_fee': str(network_fee)}}, upsert=True)
+async def create_indexes(app):
+    await bootstrap_indexes(mode=MONGO_INDEX_AUDIT)
+
+async def sweep_expired():
+    now = datetime.now(timezone.utc)
+    bills = await expire_bills(before=now - timedelta(hours=BILL_LIFETIME))
+    checks = 0
+    while True:
+        check = await expire_check(before=now - timedelta(hours=CHECK_LIFETIME))
+        if check is None:
+            break
+        await release(
+            user_id=check['user_id'],
+            crypto=check['cryptocurrency'],
+            amount=check['hold'],
+            ref=f"check:{check['code']}",
+        )
+        checks += 1
+    if bills or checks:
+        logging.info(f'Expired bills: {bills}, checks: {checks}')
+
+async def check_ledger():
+    for mismatch in await verify_ledger():
+        logging.error(f'Ledger projection mismatch: {mismatch}')
 
 app = web.Application()
-updater = CryptoRatesUpdater(update_interval=60)
+updater = CryptoRatesUpdater(update_interval=RATES_UPDATE_INTERVAL)
+
+scheduler.add('rates', updater.tick, interval=updater.update_interval, timeout=30)
+# оценки комиссий живут в памяти каждого процесса, поэтому обновляются везде, а не только у лидера
+scheduler.add('network_fees', fee_oracle.refresh, interval=fee_oracle.interval, timeout=60, leader=False)
+scheduler.add('balances', balance_refresher.refresh, interval=balance_refresher.interval, timeout=120)
+scheduler.add('expiry_sweep', sweep_expired, interval=EXPIRY_SWEEP_INTERVAL, timeout=120, delay=30)
+scheduler.add('address_pool', address_pool.refill, interval=address_pool.interval, timeout=300)
+scheduler.add('ledger_verify', check_ledger, interval=LEDGER_VERIFY_INTERVAL, timeout=300, delay=60)
+scheduler.add('sweep', sweeper.run, interval=sweeper.interval, timeout=300, delay=60)
+withdrawal_worker = create_withdrawal_worker(bot)
+# задания блокируются в базе поштучно, поэтому очередь разбирают все процессы, а не только лидер
+scheduler.add(
+    'withdrawals',
+    withdrawal_worker.poll,
+    interval=withdrawal_worker.interval,
+    timeout=withdrawal_worker.lock_timeout,
+    leader=False,
+)
+for deposit_watcher in create_deposit_watchers(bot):
+    scheduler.add(
+        f'deposits:{deposit_watcher.crypto}',
+        deposit_watcher.poll,
+        interval=deposit_watcher.interval,
+        timeout=deposit_watcher.interval * 4,
+    )
 
 app.router.add_view('/{bot_token}/', WebHookView)
+app.router.add_view('/{bot_token}/stats/', StatsView)
+app.router.add_view('/{bot_token}/health/', HealthView)
+app.on_startup.append(create_indexes)
+app.on_startup.append(registry.start)
 app.on_startup.append(set_webhook)
-app.on_startup.append(get_network_fees)
-# app.on_startup.append(updater.start)
+app.on_startup.append(router.build)
+app.on_startup.append(router.start_watching)
+app.on_cleanup.append(router.stop_watching)
+app.on_startup.append(scheduler.start)
+app.on_cleanup.append(scheduler.stop)
+if WEBHOOK_MODE == 'queue':
+    app.on_startup.append(update_queue.start)
+    app.on_cleanup.append(update_queue.stop)
+app.on_cleanup.append(registry.stop)
+app.on_cleanup.append(rate_history.flush)
+http_client.setup(app)
+app.on_cleanup.append(shutdown_chain_clients)
 
 
 if __name__ == '__main__':
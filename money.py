@@ -0,0 +1,137 @@
+from decimal import Decimal, DecimalException, InvalidOperation, ROUND_HALF_EVEN
+from functools import total_ordering
+
+from settings.common import CRYPTO_DECIMALS
+
+# сколько знаков показывать пользователю, если меньше, чем у минимальной единицы
+DISPLAY_DECIMALS = {
+    'BTC': 8,
+    'ETH': 6,
+    'TRX': 6,
+    'TON': 7,
+    'USDT': 2,
+}
+DEFAULT_SCALE = 2
+
+
+def scale_of(crypto: str) -> int:
+    return CRYPTO_DECIMALS.get(crypto, DEFAULT_SCALE)
+
+
+def _round_half_even(units: int, drop: int) -> int:
+    """Целочисленное деление на 10**drop с банковским округлением"""
+    if drop <= 0:
+        return units
+    quotient, remainder = divmod(units, 10**drop)
+    half = 5 * 10 ** (drop - 1)
+    if remainder > half or (remainder == half and quotient % 2):
+        quotient += 1
+    return quotient
+
+
+@total_ordering
+class Amount:
+    """
+    Сумма в монетах сети с фиксированной точкой: целое число минимальных единиц
+    (сатоши, wei, sun, нано-тон) и масштаб монеты. Арифметика и форматирование - на целых числах.
+    """
+    __slots__ = ('crypto', 'units')
+
+    def __init__(self, crypto: str, units: int = 0):
+        self.crypto = crypto
+        self.units = int(units)
+
+    @classmethod
+    def from_decimal(cls, crypto: str, value: Decimal) -> 'Amount':
+        if not value.is_finite():
+            raise InvalidOperation(f'Amount must be finite: {value}')
+        units = value.scaleb(scale_of(crypto)).to_integral_value(rounding=ROUND_HALF_EVEN)
+        return cls(crypto, int(units))
+
+    @classmethod
+    def parse(cls, crypto: str, value: str) -> 'Amount':
+        """Ввод пользователя; InvalidOperation, если это не число или число вне допустимого диапазона"""
+        try:
+            return cls.from_decimal(crypto, Decimal(value.strip().replace(',', '.')))
+        except DecimalException as e:
+            # показатель степени за пределами контекста (9e999999) - это Overflow, а не InvalidOperation
+            raise InvalidOperation(f'Invalid amount: {value}') from e
+
+    @classmethod
+    def of(cls, crypto: str, value) -> 'Amount':
+        """Сумма в монетах из любого представления, которое встречается в базе и коде"""
+        if isinstance(value, Amount):
+            if value.crypto != crypto:
+                raise ValueError(f'Amount in {value.crypto} used as {crypto}')
+            return value
+        if value is None:
+            return cls(crypto)
+        if hasattr(value, 'to_decimal'):  # Decimal128
+            value = value.to_decimal()
+        if not isinstance(value, Decimal):
+            value = Decimal(str(value))
+        return cls.from_decimal(crypto, value)
+
+    @property
+    def scale(self) -> int:
+        return scale_of(self.crypto)
+
+    def to_decimal(self) -> Decimal:
+        return Decimal(self.units).scaleb(-self.scale)
+
+    def _check(self, other) -> 'Amount':
+        if not isinstance(other, Amount):
+            return NotImplemented
+        if other.crypto != self.crypto:
+            raise ValueError(f'Cannot combine {self.crypto} and {other.crypto}')
+        return other
+
+    def __add__(self, other):
+        other = self._check(other)
+        if other is NotImplemented:
+            return other
+        return Amount(self.crypto, self.units + other.units)
+
+    def __sub__(self, other):
+        other = self._check(other)
+        if other is NotImplemented:
+            return other
+        return Amount(self.crypto, self.units - other.units)
+
+    def __neg__(self):
+        return Amount(self.crypto, -self.units)
+
+    def __eq__(self, other):
+        if not isinstance(other, Amount):
+            return NotImplemented
+        return self.crypto == other.crypto and self.units == other.units
+
+    def __lt__(self, other):
+        other = self._check(other)
+        if other is NotImplemented:
+            return other
+        return self.units < other.units
+
+    def __hash__(self):
+        return hash((self.crypto, self.units))
+
+    def __bool__(self):
+        return self.units != 0
+
+    def format(self, places: int = None) -> str:
+        """Округляет до places знаков (по умолчанию - до отображаемых для монеты) и убирает хвостовые нули"""
+        scale = self.scale
+        places = min(scale, DISPLAY_DECIMALS.get(self.crypto, scale) if places is None else places)
+        units = _round_half_even(abs(self.units), scale - places)
+        whole, fraction = divmod(units, 10**places)
+        sign = '-' if self.units < 0 and units else ''
+        if not fraction:
+            return f'{sign}{whole}'
+        return f'{sign}{whole}.{fraction:0{places}d}'.rstrip('0')
+
+    def __str__(self):
+        # без округления - строка точно восстанавливается в ту же сумму
+        return self.format(places=self.scale)
+
+    def __repr__(self):
+        return f'Amount({self.crypto!r}, {self.units})'
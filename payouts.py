@@ -0,0 +1,189 @@
+import logging
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from database.withdrawal import WithdrawalStatus, get_ready_withdrawals, lock_withdrawal, update_withdrawal
+from money import Amount
+from units.btc import DUST_LIMIT, INPUT_SIZE, OUTPUT_SIZE, TX_OVERHEAD_SIZE, Utxo
+from units.registry import registry
+
+
+def tx_size(inputs: int, outputs: int) -> int:
+    return TX_OVERHEAD_SIZE + INPUT_SIZE * inputs + OUTPUT_SIZE * outputs
+
+
+class PayoutBatcher:
+    """
+    Собирает выводы BTC из очереди в одну транзакцию с несколькими выходами. Пачка уходит, когда
+    набралось max_size выводов или самый старый ждет дольше window секунд. Каждый отправитель
+    тратит свои выходы, получает свою сдачу и платит комиссию за свои байты и долю общих,
+    поэтому чужие средства в пачке не смешиваются. Если сеть собирается на горячий кошелек,
+    отправитель у всей пачки один.
+    """
+
+    def __init__(self, worker, crypto: str, window: float = 300, max_size: int = 20, priority: str = 'medium'):
+        self.worker = worker
+        self.crypto = crypto
+        self.window = window
+        self.max_size = max_size
+        self.priority = priority
+        self._batches = 0
+        self._payouts = 0
+        self._fees = 0
+        self._savings = 0
+        self._last: Optional[dict] = None
+
+    async def due(self) -> bool:
+        ready = await get_ready_withdrawals(self.crypto, [WithdrawalStatus.QUEUED], self.max_size)
+        if not ready:
+            return False
+        oldest = ready[0]['next_attempt_at'].replace(tzinfo=timezone.utc)
+        return len(ready) >= self.max_size or datetime.now(timezone.utc) - oldest >= timedelta(seconds=self.window)
+
+    async def poll(self):
+        if not await self.due():
+            return
+        withdrawals = []
+        for _ in range(self.max_size):
+            withdrawal = await lock_withdrawal(
+                self.crypto, self.worker.owner, self.worker.lock_timeout, statuses=[WithdrawalStatus.QUEUED]
+            )
+            if withdrawal is None:
+                break
+            withdrawals.append(withdrawal)
+        if withdrawals:
+            await self.send(withdrawals)
+
+    async def _senders(self, withdrawals: List[dict]) -> Dict[str, dict]:
+        """Выводы по адресам отправителей вместе с ключом и непотраченными выходами"""
+        unit = registry.get(self.crypto)
+        senders = {}
+        for withdrawal in withdrawals:
+            user, withdrawal['hot'] = await self.worker.payer(withdrawal)
+            wallet = user['profile']['wallet'][self.crypto]
+            if wallet['address'] not in senders:
+                senders[wallet['address']] = {
+                    'key': wallet['private_key'],
+                    'utxos': sorted(await unit.list_unspent(wallet['address']), key=lambda utxo: -utxo.value),
+                    'withdrawals': [],
+                }
+            senders[wallet['address']]['withdrawals'].append(withdrawal)
+        return senders
+
+    @staticmethod
+    def _select(utxos: List[Utxo], payouts: int, total: int, shared: int, fee_per_byte: int) -> Optional[Tuple]:
+        """Крупные выходы первыми, пока не покрыты выплаты и комиссия отправителя; (входы, комиссия, сдача)"""
+        selected = []
+        for utxo in utxos:
+            selected.append(utxo)
+            funds = sum(item.value for item in selected)
+            fee = (INPUT_SIZE * len(selected) + OUTPUT_SIZE * (payouts + 1)) * fee_per_byte + shared
+            if funds >= total + fee:
+                change = funds - total - fee
+                if change < DUST_LIMIT:
+                    # сдача меньше порога не выплачивается отдельным выходом и уходит в комиссию
+                    return selected, fee + change, 0
+                return selected, fee, change
+        return None
+
+    async def send(self, withdrawals: List[dict]):
+        unit = registry.get(self.crypto)
+        try:
+            fee_per_byte = await unit.fee_per_byte(self.priority)
+            senders = await self._senders(withdrawals)
+        except Exception as e:
+            logging.error(f'[{self.crypto}] Failed to prepare payout batch: {e!r}')
+            for withdrawal in withdrawals:
+                await self.worker.retry(withdrawal, error=repr(e))
+            return
+        selections = {}
+        while senders:
+            # общие байты транзакции делятся между отправителями, которые действительно попали в пачку
+            shared = TX_OVERHEAD_SIZE * fee_per_byte // len(senders) + 1
+            selections = {
+                address: self._select(
+                    sender['utxos'],
+                    len(sender['withdrawals']),
+                    sum(withdrawal['amount'].units for withdrawal in sender['withdrawals']),
+                    shared,
+                    fee_per_byte,
+                )
+                for address, sender in senders.items()
+            }
+            short = [address for address, selection in selections.items() if selection is None]
+            if not short:
+                break
+            for address in short:
+                # не хватает подтвержденных выходов - выводы отправителя ждут следующей пачки
+                for withdrawal in senders.pop(address)['withdrawals']:
+                    await self.worker.retry(withdrawal, error='insufficient confirmed outputs')
+        if not senders:
+            return
+
+        inputs, outputs, keys, included, fee = [], [], {}, [], 0
+        for address, sender in senders.items():
+            selected, sender_fee, change = selections[address]
+            inputs.extend(selected)
+            outputs.extend((withdrawal['address'], withdrawal['amount'].units) for withdrawal in sender['withdrawals'])
+            if change:
+                outputs.append((address, change))
+            keys[address] = sender['key']
+            included.extend(sender['withdrawals'])
+            fee += sender_fee
+
+        batch_id = uuid.uuid4().hex
+        try:
+            signed = await unit.sign_batch(inputs, outputs, fee, keys)
+        except Exception as e:
+            # до подписи в сеть ничего не ушло, выводы можно завершить с разморозкой
+            logging.error(f'[{self.crypto}] Payout batch {batch_id} of {len(included)} failed: {e!r}')
+            for withdrawal in included:
+                await self.worker.fail(withdrawal, repr(e))
+            return
+        # подписанная пачка сохраняется до отправки: после падения или таймаута уйдет та же транзакция
+        for withdrawal in included:
+            await update_withdrawal(
+                withdrawal,
+                self.worker.owner,
+                status=WithdrawalStatus.SIGNED,
+                txid=signed.txid,
+                raw=signed.raw,
+                batch=batch_id,
+                hot=withdrawal['hot'],
+            )
+        try:
+            txid = await unit.broadcast(signed.raw)
+        except Exception as e:
+            # сеть могла принять пачку до ошибки: холды не снимаются, воркер повторит отправку той же транзакции
+            logging.error(f'[{self.crypto}] Payout batch {signed.txid} was not broadcast: {e!r}')
+            for withdrawal in included:
+                await self.worker.retry(withdrawal, error=repr(e))
+            return
+        for withdrawal in included:
+            await self.worker.mark_broadcast(withdrawal, txid)
+        self.record(included, fee, txid, fee_per_byte)
+
+    def record(self, withdrawals: List[dict], fee: int, txid: str, fee_per_byte: int):
+        # экономия - против отдельной транзакции на каждый вывод (один вход, выплата и сдача)
+        separate = tx_size(1, 2) * fee_per_byte * len(withdrawals)
+        savings = separate - fee
+        self._batches += 1
+        self._payouts += len(withdrawals)
+        self._fees += fee
+        self._savings += savings
+        self._last = {'txid': txid, 'size': len(withdrawals), 'fee': fee, 'savings': savings}
+        logging.info(
+            f'[{self.crypto}] Payout batch {txid}: {len(withdrawals)} withdrawals, '
+            f'fee {Amount(self.crypto, fee).format()}, saved {Amount(self.crypto, savings).format()}'
+        )
+
+    def stats(self) -> dict:
+        return {
+            'batches': self._batches,
+            'payouts': self._payouts,
+            'fees': str(Amount(self.crypto, self._fees)),
+            'savings': str(Amount(self.crypto, self._savings)),
+            'last': self._last,
+        }
@@ -1,44 +1,316 @@
 import logging
-import aiohttp
 import asyncio
-from database.db import DB
-from typing import Dict
-from settings.common import CRYPTO_COMPARE_API_KEY, CRYPTOS
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from statistics import median
+from types import MappingProxyType
+from typing import Dict, FrozenSet, List, Mapping, NamedTuple, Optional, Sequence
+from conversion import ConversionMatrix
+from database.rate_history import rate_history
+from database.rates import get_all_rates, update_or_create_rates
+from http_client import http_client
+from settings.common import (
+    COINGECKO_API_KEY,
+    CRYPTO_COMPARE_API_KEY,
+    CRYPTOS,
+    FIAT_CURRENCIES,
+    RATES_PROVIDERS_SETTINGS,
+    RATES_SNAPSHOT_MAX_AGE,
+)
+
+
+class RatesSnapshot(NamedTuple):
+    """
+    Неизменяемый снимок курсов: {крипта: цена в USD, фиат: фиат за 1 USD}.
+    Рендеры читают его из памяти процесса, в базу курсы только сохраняются.
+    В stale - символы, которые не удалось обновить на последнем тике (в rates их прошлое значение).
+    """
+    version: int
+    updated_at: datetime
+    loaded_at: float
+    rates: Mapping[str, float]
+    matrix: ConversionMatrix
+    stale: FrozenSet[str] = frozenset()
+
+
+_snapshot: Optional[RatesSnapshot] = None
+
+
+def set_rates_snapshot(
+    rates: Dict[str, float], updated_at: Optional[datetime] = None, stale: FrozenSet[str] = frozenset()
+) -> RatesSnapshot:
+    global _snapshot
+    _snapshot = RatesSnapshot(
+        version=_snapshot.version + 1 if _snapshot else 1,
+        updated_at=updated_at or datetime.now(timezone.utc),
+        loaded_at=time.monotonic(),
+        rates=MappingProxyType(dict(rates)),
+        matrix=ConversionMatrix(rates, cryptos=CRYPTOS, fiats=FIAT_CURRENCIES),
+        stale=frozenset(stale),
+    )
+    return _snapshot
+
+
+async def get_rates_snapshot() -> RatesSnapshot:
+    # в базу ходим только на холодном старте или если курсы давно не обновлялись в этом процессе
+    if _snapshot is None or time.monotonic() - _snapshot.loaded_at > RATES_SNAPSHOT_MAX_AGE:
+        rates = dict(await get_all_rates() or {})
+        rates.pop('_id', None)
+        updated_at = rates.pop('updated_at', None)
+        if rates or _snapshot is None:
+            set_rates_snapshot(rates, updated_at=updated_at)
+        else:
+            set_rates_snapshot(_snapshot.rates, updated_at=_snapshot.updated_at)
+    return _snapshot
+
+
+class ProviderStats:
+    __slots__ = ('requests', 'successes', 'errors', 'timeouts', 'cancelled', 'latency_total', 'latency_max', 'last_error')
+
+    def __init__(self):
+        self.requests = 0
+        self.successes = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.cancelled = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.last_error: Optional[str] = None
+
+    @property
+    def failure_rate(self) -> float:
+        failures = self.errors + self.timeouts
+        return failures / (failures + self.successes) if failures else 0
+
+    @property
+    def latency_avg(self) -> float:
+        return self.latency_total / self.successes if self.successes else 0
+
+    def as_dict(self) -> dict:
+        return {
+            'requests': self.requests,
+            'successes': self.successes,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'cancelled': self.cancelled,
+            'latency_avg': round(self.latency_avg, 4),
+            'latency_max': round(self.latency_max, 4),
+            'last_error': self.last_error,
+        }
+
+
+class RatesProvider(ABC):
+    """
+    Источник курсов. fetch возвращает {крипта: цена в USD, фиат: фиат за 1 USD},
+    символы, которых нет в ответе, просто пропускаются.
+    """
+    name = 'base'
+
+    def __init__(self, timeout: float = 3):
+        self.timeout = timeout
+        self.stats = ProviderStats()
+
+    @abstractmethod
+    async def fetch(self, cryptos: Sequence[str], fiats: Sequence[str]) -> Dict[str, float]:
+        pass
+
+
+class CryptoCompareProvider(RatesProvider):
+    name = 'cryptocompare'
+    api_url = 'https://min-api.cryptocompare.com/data/pricemulti'
+
+    def __init__(self, timeout: float = 3, api_key: Optional[str] = CRYPTO_COMPARE_API_KEY):
+        super().__init__(timeout)
+        self.api_key = api_key
+
+    async def fetch(self, cryptos: Sequence[str], fiats: Sequence[str]) -> Dict[str, float]:
+        # один запрос на все пары: крипта -> USD и USD -> каждый фиат
+        params = {'fsyms': ','.join([*cryptos, 'USD']), 'tsyms': ','.join(fiats)}
+        if self.api_key:
+            params['api_key'] = self.api_key
+        # повторы не нужны - вместо них запрос уходит к другому источнику
+        data = await http_client.get_json(self.api_url, params=params, retries=0)
+        rates = {crypto: data[crypto]['USD'] for crypto in cryptos if 'USD' in data.get(crypto, {})}
+        rates.update({fiat: data['USD'][fiat] for fiat in fiats if fiat in data.get('USD', {})})
+        return rates
+
+
+class CoinGeckoProvider(RatesProvider):
+    name = 'coingecko'
+    api_url = 'https://api.coingecko.com/api/v3/simple/price'
+    ids = {
+        'BTC': 'bitcoin',
+        'ETH': 'ethereum',
+        'TRX': 'tron',
+        'TON': 'the-open-network',
+    }
+
+    def __init__(self, timeout: float = 3, api_key: Optional[str] = COINGECKO_API_KEY):
+        super().__init__(timeout)
+        self.api_key = api_key
+
+    async def fetch(self, cryptos: Sequence[str], fiats: Sequence[str]) -> Dict[str, float]:
+        ids = {self.ids[crypto]: crypto for crypto in cryptos if crypto in self.ids}
+        params = {'ids': ','.join(ids), 'vs_currencies': ','.join(fiat.lower() for fiat in fiats)}
+        if self.api_key:
+            params['x_cg_demo_api_key'] = self.api_key
+        data = await http_client.get_json(self.api_url, params=params, retries=0)
+        prices = {ids[coin_id]: values for coin_id, values in data.items() if coin_id in ids}
+        rates = {crypto: values['usd'] for crypto, values in prices.items() if values.get('usd')}
+        # курс фиата к доллару отдельно не отдается - выводим его через цены монет
+        for fiat in fiats:
+            ratios = [
+                values[fiat.lower()] / values['usd']
+                for values in prices.values()
+                if values.get('usd') and values.get(fiat.lower())
+            ]
+            if ratios:
+                rates[fiat] = median(ratios)
+        return rates
+
+
+PROVIDERS = {provider.name: provider for provider in (CryptoCompareProvider, CoinGeckoProvider)}
+
+
+class AggregatedRates(NamedTuple):
+    rates: Dict[str, float]
+    stale: FrozenSet[str]
+    sources: List[str]
+
+
+class RatesAggregator:
+    """
+    Опрашивает источники с хеджированием: первым идет самый здоровый, следующий запускается,
+    если за hedge_delay нет кворума или предыдущий упал. Как только набран кворум ответов,
+    остальные запросы отменяются, поэтому тик ждет самый быстрый здоровый источник, а не самый медленный.
+    Значение каждого символа - медиана по полученным ответам.
+    """
+
+    def __init__(
+        self,
+        providers: Sequence[RatesProvider],
+        quorum: int = 1,
+        hedge_delay: float = 0.5,
+        deadline: float = 5,
+    ):
+        self.providers = list(providers)
+        self.quorum = max(1, min(quorum, len(self.providers)))
+        self.hedge_delay = hedge_delay
+        self.deadline = deadline
+
+    @classmethod
+    def from_settings(cls, settings: Mapping = RATES_PROVIDERS_SETTINGS) -> 'RatesAggregator':
+        providers = [PROVIDERS[name](timeout=settings['provider_timeout']) for name in settings['providers']]
+        return cls(providers, quorum=settings['quorum'], hedge_delay=settings['hedge_delay'], deadline=settings['deadline'])
+
+    def _ordered(self) -> List[RatesProvider]:
+        # сначала те, что реже падают, среди равных - более быстрые
+        return sorted(self.providers, key=lambda provider: (provider.stats.failure_rate, provider.stats.latency_avg))
+
+    async def _fetch_one(self, provider: RatesProvider, cryptos: Sequence[str], fiats: Sequence[str]):
+        stats = provider.stats
+        stats.requests += 1
+        started_at = time.monotonic()
+        try:
+            rates = await asyncio.wait_for(provider.fetch(cryptos, fiats), provider.timeout)
+        except asyncio.CancelledError:
+            stats.cancelled += 1
+            raise
+        except asyncio.TimeoutError:
+            stats.timeouts += 1
+            stats.last_error = 'timeout'
+            logging.warning(f'Rates provider {provider.name} timed out after {provider.timeout}s')
+            return None
+        except Exception as e:
+            stats.errors += 1
+            stats.last_error = repr(e)
+            logging.warning(f'Rates provider {provider.name} failed: {e!r}')
+            return None
+        latency = time.monotonic() - started_at
+        stats.successes += 1
+        stats.latency_total += latency
+        stats.latency_max = max(stats.latency_max, latency)
+        symbols = {*cryptos, *fiats}
+        return {symbol: float(value) for symbol, value in rates.items() if symbol in symbols and value and value > 0}
+
+    async def fetch(self, cryptos: Sequence[str], fiats: Sequence[str]) -> AggregatedRates:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadline
+        queue = self._ordered()
+        running: Dict[asyncio.Future, RatesProvider] = {}
+        pending = set()
+        results: List[Dict[str, float]] = []
+        sources: List[str] = []
+        try:
+            while queue or pending:
+                if queue:
+                    provider = queue.pop(0)
+                    task = asyncio.ensure_future(self._fetch_one(provider, cryptos, fiats))
+                    running[task] = provider
+                    pending.add(task)
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                if queue:
+                    timeout = min(timeout, self.hedge_delay)
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.result():
+                        results.append(task.result())
+                        sources.append(running[task].name)
+                if len(results) >= self.quorum:
+                    break
+        finally:
+            for task in pending:
+                task.cancel()
+
+        rates, stale = {}, set()
+        for symbol in (*cryptos, *fiats):
+            values = [result[symbol] for result in results if symbol in result]
+            if values:
+                rates[symbol] = median(values)
+            else:
+                stale.add(symbol)
+        return AggregatedRates(rates=rates, stale=frozenset(stale), sources=sources)
+
+    def stats(self) -> dict:
+        return {provider.name: provider.stats.as_dict() for provider in self.providers}
+
 
 class CryptoRatesUpdater:
-    def __init__(self, update_interval: int = 60, api_key: str = CRYPTO_COMPARE_API_KEY):
+    def __init__(self, update_interval: int = 60, aggregator: Optional[RatesAggregator] = None):
         self.update_interval = update_interval
-        self.api_key = api_key
-        self.api_url = 'https://min-api.cryptocompare.com/data/price'
+        self.aggregator = aggregator or RatesAggregator.from_settings()
         self.cryptos = CRYPTOS
+        self.fiats = FIAT_CURRENCIES
 
-    async def fetch_rate(self, session: aiohttp.ClientSession, crypto: str) -> float:
-        params = {
-            'fsym': crypto,
-            'tsyms': 'USD',
-            'api_key': self.api_key
+    async def tick(self):
+        logging.info('Updating rates...')
+        result = await self.aggregator.fetch(self.cryptos, self.fiats)
+        logging.info(f'{result.rates} from {result.sources}')
+        # необновленные символы остаются со старым значением и явно помечаются устаревшими
+        previous = dict(_snapshot.rates) if _snapshot else {}
+        rates = {**previous, **result.rates}
+        if result.stale:
+            logging.warning(f'Stale rates: {sorted(result.stale)}')
+        if not result.rates:
+            if _snapshot:
+                set_rates_snapshot(previous, updated_at=_snapshot.updated_at, stale=result.stale)
+            return
+        snapshot = set_rates_snapshot(rates, stale=result.stale)
+        await self.update_or_create_rates({**rates, 'updated_at': snapshot.updated_at})
+        # нулевая цена - пары нет в ответе, в свечи ее не пишем, как и устаревшие пары
+        prices = {
+            f'{crypto}/{fiat}': float(snapshot.matrix.price(crypto, fiat))
+            for crypto in self.cryptos
+            for fiat in self.fiats
+            if crypto not in result.stale and fiat not in result.stale
         }
-        async with session.get(self.api_url, params=params) as response:
-            data = await response.json()
-            return data['USD']
-
-    async def fetch_all_rates(self) -> Dict[str, float]:
-        async with aiohttp.ClientSession() as session:
-            tasks = [self.fetch_rate(session, crypto) for crypto in self.cryptos]
-            rates = await asyncio.gather(*tasks)
-            return dict(zip(self.cryptos, rates))
-
-    async def update_rates(self):
-        while True:
-            logging.info('Updating rates...')
-            rates = await self.fetch_all_rates()
-            rates = {**rates, 'RUB': 69.1}  # todo: hardcoded rub rates
-            logging.info(rates)
-            await self.update_or_create_rates(rates)
-            await asyncio.sleep(self.update_interval)
+        await rate_history.record(
+            {symbol: price for symbol, price in prices.items() if price > 0},
+            timestamp=snapshot.updated_at.timestamp(),
+        )
 
     async def update_or_create_rates(self, rates: Dict[str, float]):
-        await DB.rates.update_one({}, {'$set': rates}, upsert=True)
-
-    async def start(self, app):
-        await self.update_rates()
\ No newline at end of file
+        await update_or_create_rates(rates)
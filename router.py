@@ -0,0 +1,108 @@
+import asyncio
+import importlib
+import logging
+from typing import Dict, NamedTuple, Optional, Type
+
+from database.db import DB
+from database.response import get_all_responses
+from triggers import ALL_TRIGGERS, Triggers
+
+DEFAULT_CONTEXT = 'base.DefaultContext'
+
+# экраны, которые целиком рендерятся кодом и работают без записи в коллекции responses;
+# запись в базе с тем же триггером имеет приоритет
+BUILTIN_ROUTES = {
+    Triggers.FEES: {'response': '{text}', 'context': 'wallet.FeesContext'},
+}
+
+
+class Route(NamedTuple):
+    trigger: str
+    response: str
+    keyboard_id: Optional[str]
+    context_cls: Optional[Type]
+
+
+class TriggerRouter:
+    """
+    Таблица маршрутизации триггеров: триггер -> класс контекста, шаблон ответа и id клавиатуры.
+    Собирается один раз при старте из коллекции responses, чтобы не делать импорт контекстов
+    и запрос в базу на каждый апдейт.
+    """
+
+    def __init__(self):
+        self.triggers = ALL_TRIGGERS
+        self.routes: Dict[str, Route] = {}
+        self._built = False
+        self._watcher = None
+
+    @staticmethod
+    def _resolve_context(path: str) -> Optional[Type]:
+        module_name, class_name = f'context.{path}'.rsplit('.', 1)
+        try:
+            module = importlib.import_module(module_name)
+        except ImportError:
+            logging.error(f'Context module not found: {module_name}')
+            return None
+        return getattr(module, class_name, None)
+
+    async def build(self, app=None):
+        routes = {}
+        builtin = [{'trigger': trigger, **data} for trigger, data in BUILTIN_ROUTES.items()]
+        for response_data in builtin + list(await get_all_responses()):
+            trigger = response_data.get('trigger')
+            routes[trigger] = Route(
+                trigger=trigger,
+                response=response_data.get('response'),
+                keyboard_id=response_data.get('keyboard_id'),
+                context_cls=self._resolve_context(response_data.get('context', DEFAULT_CONTEXT)),
+            )
+        self.routes = routes
+        self._built = True
+        logging.info(f'Router built with {len(routes)} routes')
+
+    async def rebuild(self):
+        await self.build()
+
+    def normalize(self, trigger: str) -> str:
+        # Обработка произвольного ввода пользователя
+        return trigger if trigger in self.triggers else Triggers.USER_INPUT
+
+    async def resolve(self, trigger: str) -> Optional[Route]:
+        if not self._built:
+            await self.build()
+        return self.routes.get(self.normalize(trigger))
+
+    async def _watch(self, retry_delay: float = 1, max_delay: float = 300):
+        """
+        Пересобирает таблицу при изменениях responses. Обрыв потока (выборы primary, сеть) наблюдение не отключает:
+        поток открывается заново с растущей паузой, а таблица пересобирается, чтобы не потерять изменения
+        за время обрыва. Останавливается только отменой задачи.
+        """
+        delay = retry_delay
+        reconnected = False
+        while True:
+            try:
+                async with DB.responses.watch() as stream:
+                    delay = retry_delay
+                    if reconnected:
+                        await self.rebuild()
+                    async for _ in stream:
+                        await self.rebuild()
+            except Exception as error:
+                # change streams доступны только на replica set, на одиночном сервере поток не откроется
+                logging.warning(f'Responses watcher failed, retrying in {delay}s: {error!r}')
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, max_delay)
+            reconnected = True
+
+    async def start_watching(self, app=None):
+        self._watcher = asyncio.create_task(self._watch())
+
+    async def stop_watching(self, app=None):
+        if self._watcher:
+            self._watcher.cancel()
+            await asyncio.gather(self._watcher, return_exceptions=True)
+
+
+router = TriggerRouter()
@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import os
+import random
+import socket
+import time
+from traceback import print_tb
+from typing import Awaitable, Callable, Dict, Optional
+
+from database.lease import acquire_lease, release_lease
+from settings.common import SCHEDULER_SETTINGS
+
+
+class Job:
+    __slots__ = (
+        'name', 'func', 'interval', 'jitter', 'timeout', 'leader', 'delay',
+        'running', 'runs', 'failures', 'timeouts', 'skipped', 'last_duration', 'last_run',
+    )
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[], Awaitable],
+        interval: float,
+        jitter: float = 0.1,
+        timeout: Optional[float] = None,
+        leader: bool = True,
+        delay: float = 0,
+    ):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        # доля интервала, на которую случайно сдвигается следующий запуск
+        self.jitter = jitter
+        self.timeout = timeout
+        # True - задачу выполняет только один процесс, держащий аренду в базе
+        self.leader = leader
+        self.delay = delay
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.skipped = 0
+        self.last_duration = 0.0
+        self.last_run: Optional[float] = None
+
+    @property
+    def lease_ttl(self) -> float:
+        # аренда переживает один пропущенный запуск, но не дольше, чем нужно для перехвата
+        return self.interval * 2 + (self.timeout or self.interval)
+
+    def next_delay(self, elapsed: float) -> float:
+        interval = self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+        return max(0.0, interval - elapsed)
+
+    def as_dict(self) -> dict:
+        return {
+            'interval': self.interval,
+            'running': self.running,
+            'runs': self.runs,
+            'failures': self.failures,
+            'timeouts': self.timeouts,
+            'skipped': self.skipped,
+            'last_duration': round(self.last_duration, 4),
+            'last_run': self.last_run,
+        }
+
+
+class Scheduler:
+    """
+    Периодические фоновые задачи процесса. Запуски одной задачи не перекрываются,
+    каждый ограничен таймаутом, интервал размывается джиттером.
+    Задачи с leader=True между процессами делит аренда в коллекции leases.
+    """
+
+    def __init__(self, owner: Optional[str] = None, leader_election: bool = True):
+        self.owner = owner or f'{socket.gethostname()}:{os.getpid()}'
+        self.leader_election = leader_election
+        self.jobs: Dict[str, Job] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def add(self, name: str, func: Callable[[], Awaitable], interval: float, **kwargs) -> Job:
+        if name in self.jobs:
+            raise ValueError(f'Job {name} is already scheduled')
+        job = self.jobs[name] = Job(name, func, interval, **kwargs)
+        return job
+
+    async def _is_leader(self, job: Job) -> bool:
+        if not job.leader or not self.leader_election:
+            return True
+        try:
+            return await acquire_lease(f'job:{job.name}', self.owner, job.lease_ttl)
+        except Exception as e:
+            logging.error(f'Failed to acquire lease for job {job.name}: {e!r}')
+            return False
+
+    async def run_job(self, job: Job) -> bool:
+        """Один запуск задачи, False - если она уже выполняется или аренда у другого процесса"""
+        if job.running:
+            job.skipped += 1
+            return False
+        job.running = True
+        try:
+            if not await self._is_leader(job):
+                job.skipped += 1
+                return False
+            started_at = time.monotonic()
+            job.last_run = time.time()
+            job.runs += 1
+            try:
+                await asyncio.wait_for(job.func(), job.timeout)
+            except asyncio.TimeoutError:
+                job.timeouts += 1
+                logging.error(f'Job {job.name} timed out after {job.timeout}s')
+            except Exception as e:
+                job.failures += 1
+                logging.error(f'Error in job {job.name}: {e}')
+                print_tb(e.__traceback__)
+            finally:
+                job.last_duration = time.monotonic() - started_at
+            return True
+        finally:
+            job.running = False
+
+    async def _loop(self, job: Job):
+        await asyncio.sleep(job.delay)
+        while True:
+            started_at = time.monotonic()
+            await self.run_job(job)
+            await asyncio.sleep(job.next_delay(time.monotonic() - started_at))
+
+    async def start(self, app=None):
+        for name, job in self.jobs.items():
+            self._tasks[name] = asyncio.create_task(self._loop(job), name=f'job:{name}')
+
+    async def stop(self, app=None):
+        tasks, self._tasks = list(self._tasks.values()), {}
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self.leader_election:
+            # отдаем аренды сразу, чтобы другой процесс не ждал их истечения
+            for job in self.jobs.values():
+                if job.leader:
+                    try:
+                        await release_lease(f'job:{job.name}', self.owner)
+                    except Exception as e:
+                        logging.error(f'Failed to release lease for job {job.name}: {e!r}')
+
+    def stats(self) -> dict:
+        return {name: job.as_dict() for name, job in self.jobs.items()}
+
+
+scheduler = Scheduler(**SCHEDULER_SETTINGS)
@@ -4,11 +4,21 @@ from settings.local import *
 BOT_TOKEN = os.getenv('CRYPTED_TOKEN')
 BASE_PROTO = 'https'
 BASE_URL = f'{BASE_PROTO}://{BASE_HOST}'
+
+# проверка планов запросов при старте: 'off', 'warn' - предупреждение в логах, 'fail' - приложение не стартует
+MONGO_INDEX_AUDIT = os.getenv('MONGO_INDEX_AUDIT', 'warn')
+
+# webhook: 'queue' - сразу отвечаем телеграму и обрабатываем апдейт в пуле воркеров, 'sync' - обрабатываем в запросе
+WEBHOOK_MODE = os.getenv('CRYPTED_WEBHOOK_MODE', 'queue')
+WEBHOOK_WORKERS = int(os.getenv('CRYPTED_WEBHOOK_WORKERS', 8))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('CRYPTED_WEBHOOK_QUEUE_SIZE', 10000))
 CRYPTOS = ['BTC', 'TRX', 'TON', 'ETH']
 BTC = CRYPTOS[0]
 TRX = CRYPTOS[1]
 TON = CRYPTOS[2]
 ETH = CRYPTOS[3]
+# знаков после запятой у минимальной единицы монеты (сатоши, sun, нано-тон, wei)
+CRYPTO_DECIMALS = {BTC: 8, TRX: 6, TON: 9, ETH: 18}
 
 CRYPTO_SETTINGS = {
     BTC: {
@@ -29,5 +39,177 @@ CRYPTO_SETTINGS = {
     }
 }
 
+# клиенты блокчейнов: таймаут запроса в секундах, лимит одновременных запросов, размер пула потоков
+# для синхронных библиотек и размер пула http соединений к ноде
+CHAIN_CLIENT_SETTINGS = {
+    BTC: {
+        'timeout': int(os.getenv('BTC_CLIENT_TIMEOUT', 15)),
+        'concurrency': 4,
+        'threads': 4,
+        'pool_size': int(os.getenv('BTC_POOL_SIZE', 4)),
+    },
+    TRX: {
+        'timeout': int(os.getenv('TRX_CLIENT_TIMEOUT', 10)),
+        'concurrency': 8,
+        'threads': 8,
+        'pool_size': int(os.getenv('TRX_POOL_SIZE', 8)),
+    },
+    TON: {
+        'timeout': int(os.getenv('TON_CLIENT_TIMEOUT', 10)),
+        'concurrency': 8,
+        'threads': 1,
+        'pool_size': int(os.getenv('TON_POOL_SIZE', 8)),
+    },
+    ETH: {
+        'timeout': int(os.getenv('ETH_CLIENT_TIMEOUT', 10)),
+        'concurrency': 16,
+        'threads': 1,
+        'pool_size': int(os.getenv('ETH_POOL_SIZE', 16)),
+    },
+}
+
+# общая http сессия приложения (курсы, toncenter и другие http api)
+HTTP_CLIENT_SETTINGS = {
+    'timeout': int(os.getenv('HTTP_CLIENT_TIMEOUT', 10)),
+    'retries': int(os.getenv('HTTP_CLIENT_RETRIES', 2)),
+    'backoff': 0.3,
+    'limit': 100,
+    'limit_per_host': int(os.getenv('HTTP_CLIENT_LIMIT_PER_HOST', 16)),
+    'dns_ttl': 300,
+    'keepalive': 30,
+}
+
+# фоновое обновление балансов: период, через сколько секунд баланс считается устаревшим,
+# сколько пользователей обновлять за проход и размер батч-запроса к провайдеру для каждой сети
+BALANCE_REFRESH_SETTINGS = {
+    'interval': int(os.getenv('BALANCE_REFRESH_INTERVAL', 30)),
+    'stale_after': int(os.getenv('BALANCE_STALE_AFTER', 120)),
+    'limit': int(os.getenv('BALANCE_REFRESH_LIMIT', 1000)),
+    'batch_size': {BTC: 3, TRX: 20, TON: 100, ETH: 100},
+}
+
+# отслеживание депозитов по новым блокам: сколько подтверждений ждать, период опроса,
+# сколько блоков обрабатывать за проход и как часто перечитывать адреса пользователей
+DEPOSIT_WATCHER_SETTINGS = {
+    ETH: {'confirmations': 12, 'interval': 15, 'max_blocks': 50, 'reload_interval': 60},
+    TRX: {'confirmations': 19, 'interval': 6, 'max_blocks': 100, 'reload_interval': 60},
+}
+
+# фоновые задачи: интервалы в секундах; leader_election - делить задачи между процессами арендой в базе
+SCHEDULER_SETTINGS = {
+    'leader_election': os.getenv('SCHEDULER_LEADER_ELECTION', 'true').lower() == 'true',
+}
+EXPIRY_SWEEP_INTERVAL = int(os.getenv('EXPIRY_SWEEP_INTERVAL', 600))
+LEDGER_VERIFY_INTERVAL = int(os.getenv('LEDGER_VERIFY_INTERVAL', 3600))
+# через сколько часов неоплаченный счет и необналиченный чек считаются просроченными
+BILL_LIFETIME = int(os.getenv('BILL_LIFETIME', 72))
+CHECK_LIFETIME = int(os.getenv('CHECK_LIFETIME', 720))
+
+# комиссии сети: как часто обновлять оценки и через сколько секунд считать их устаревшими,
+# множители приоритетов для сетей, которые отдают одну цену газа
+FEE_ORACLE_SETTINGS = {
+    'interval': int(os.getenv('FEE_ORACLE_INTERVAL', 120)),
+    'max_age': int(os.getenv('FEE_ORACLE_MAX_AGE', 600)),
+}
+FEE_PRIORITY_MULTIPLIERS = {'low': 0.9, 'medium': 1, 'high': 1.25}
+
 # rates
-CRYPTO_COMPARE_API_KEY = os.getenv('CRYPTO_COMPARE_API_KEY')
\ No newline at end of file
+CRYPTO_COMPARE_API_KEY = os.getenv('CRYPTO_COMPARE_API_KEY')
+COINGECKO_API_KEY = os.getenv('COINGECKO_API_KEY')
+# источники курсов в порядке предпочтения; quorum - сколько ответов нужно до медианы,
+# hedge_delay - через сколько секунд без кворума спрашивать следующий источник
+RATES_PROVIDERS_SETTINGS = {
+    'providers': os.getenv('RATES_PROVIDERS', 'cryptocompare,coingecko').split(','),
+    'quorum': int(os.getenv('RATES_QUORUM', 1)),
+    'hedge_delay': float(os.getenv('RATES_HEDGE_DELAY', 0.5)),
+    'provider_timeout': float(os.getenv('RATES_PROVIDER_TIMEOUT', 3)),
+    'deadline': float(os.getenv('RATES_DEADLINE', 5)),
+}
+FIAT_CURRENCIES = ['USD', 'RUB']
+# история курсов: сколько тиков копить в памяти до записи, размер корзины тиков в секундах
+# и сколько дней хранить тики и свечи (None - бессрочно)
+RATE_HISTORY_SETTINGS = {
+    'flush_size': 10,
+    'bucket_seconds': 3600,
+    'retention': {'ticks': 2, '1m': 7, '1h': 365, '1d': None},
+}
+# через сколько секунд процесс без своего обновления курсов перечитывает их из базы
+RATES_SNAPSHOT_MAX_AGE = int(os.getenv('RATES_SNAPSHOT_MAX_AGE', 120))
+RATES_UPDATE_INTERVAL = int(os.getenv('RATES_UPDATE_INTERVAL', 60))
+# пул заранее сгенерированных адресов: при скольких свободных адресах сети пул пополняется,
+# до скольких и как часто проверять; secret - ключ HMAC, из которого выводятся ключи адресов пула
+ADDRESS_POOL_SETTINGS = {
+    'low_water': int(os.getenv('ADDRESS_POOL_LOW_WATER', 50)),
+    'target': int(os.getenv('ADDRESS_POOL_TARGET', 200)),
+    'interval': int(os.getenv('ADDRESS_POOL_INTERVAL', 60)),
+}
+ADDRESS_POOL_SECRET = os.getenv('ADDRESS_POOL_SECRET')
+
+# очередь выводов: период опроса, на сколько секунд воркер блокирует задание, сколько попыток подписи и отправки
+# и пауза между ними; через сколько секунд без подтверждения заменять транзакцию с повышенной комиссией
+# и сколько раз; для каждой сети - сколько выводов отправлять одновременно и сколько подтверждений ждать
+WITHDRAWAL_SETTINGS = {
+    'interval': int(os.getenv('WITHDRAWAL_INTERVAL', 5)),
+    'lock_timeout': int(os.getenv('WITHDRAWAL_LOCK_TIMEOUT', 120)),
+    'max_attempts': int(os.getenv('WITHDRAWAL_MAX_ATTEMPTS', 5)),
+    'retry_delay': int(os.getenv('WITHDRAWAL_RETRY_DELAY', 30)),
+    'bump_after': int(os.getenv('WITHDRAWAL_BUMP_AFTER', 600)),
+    'max_bumps': int(os.getenv('WITHDRAWAL_MAX_BUMPS', 3)),
+    # задание без холда или не активированное после холда разбирается через столько секунд
+    'reap_after': int(os.getenv('WITHDRAWAL_REAP_AFTER', 300)),
+    'chains': {
+        BTC: {'concurrency': 2, 'confirmations': 1},
+        ETH: {'concurrency': 8, 'confirmations': 12},
+        TRX: {'concurrency': 4, 'confirmations': 19},
+        TON: {'concurrency': 2, 'confirmations': 1},
+    },
+}
+
+# EIP-1559 комиссии ETH: сколько секунд держать оценку по eth_feeHistory, за сколько блоков ее считать
+# и какие перцентили чаевых валидатору брать для приоритетов low/medium/high;
+# bump - во сколько раз поднимать комиссию при замене зависшей транзакции (сеть требует не меньше +10%)
+ETH_GAS_SETTINGS = {
+    'ttl': int(os.getenv('ETH_GAS_TTL', 15)),
+    'blocks': int(os.getenv('ETH_GAS_BLOCKS', 20)),
+    'percentiles': {'low': 10, 'medium': 50, 'high': 90},
+    'bump': 1.125,
+}
+
+# пачки выводов: в каких сетях новые выводы объединяются в одну транзакцию с несколькими выходами,
+# сколько секунд копить пачку, ее максимальный размер и приоритет комиссии
+PAYOUT_BATCH_SETTINGS = {
+    BTC: {
+        'window': int(os.getenv('BTC_PAYOUT_WINDOW', 300)),
+        'max_size': int(os.getenv('BTC_PAYOUT_MAX_SIZE', 20)),
+        'priority': os.getenv('BTC_PAYOUT_PRIORITY', 'medium'),
+    },
+}
+
+# сбор депозитов на горячий кошелек (адрес корневого пользователя), с которого затем идут выводы этих сетей:
+# период проверки; для сети - с какого баланса адрес собирается, какую долю суммы может съесть комиссия
+# (при дорогой сети сбор откладывается), приоритет комиссии и сколько адресов собирать за проход
+SWEEP_SETTINGS = {
+    'interval': int(os.getenv('SWEEP_INTERVAL', 600)),
+    # сбор, о котором сеть не знает дольше этого срока, отменяется
+    'expire_after': int(os.getenv('SWEEP_EXPIRE_AFTER', 3600)),
+    'chains': {
+        BTC: {
+            'threshold': os.getenv('BTC_SWEEP_THRESHOLD', '0.001'),
+            'max_fee_ratio': float(os.getenv('BTC_SWEEP_MAX_FEE_RATIO', 0.02)),
+            'priority': 'low',
+            'limit': int(os.getenv('BTC_SWEEP_LIMIT', 50)),
+        },
+        ETH: {
+            'threshold': os.getenv('ETH_SWEEP_THRESHOLD', '0.02'),
+            'max_fee_ratio': float(os.getenv('ETH_SWEEP_MAX_FEE_RATIO', 0.02)),
+            'priority': 'low',
+            'limit': int(os.getenv('ETH_SWEEP_LIMIT', 20)),
+        },
+        TRX: {
+            'threshold': os.getenv('TRX_SWEEP_THRESHOLD', '50'),
+            'max_fee_ratio': float(os.getenv('TRX_SWEEP_MAX_FEE_RATIO', 0.02)),
+            'priority': 'low',
+            'limit': int(os.getenv('TRX_SWEEP_LIMIT', 20)),
+        },
+    },
+}
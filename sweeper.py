@@ -0,0 +1,224 @@
+import asyncio
+import logging
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from balances import balance_refresher
+from database.ledger import set_sweeping, sweep as ledger_sweep
+from database.sweep import SweepStatus, create_sweeps, get_active_sweeps, get_sweep_candidates, update_sweeps
+from database.user import get_hot_wallet, get_user_by_id
+from money import Amount
+from settings.common import ROOT_ID, SWEEP_SETTINGS
+from units.base import StaleTransaction
+from units.btc import DUST_LIMIT, INPUT_SIZE, OUTPUT_SIZE, TX_OVERHEAD_SIZE
+from units.registry import registry
+
+
+class Sweeper:
+    """
+    Собирает депозиты с адресов пользователей на горячий кошелек, чтобы выводы шли с одного адреса.
+    BTC собирается одной транзакцией из выходов многих адресов, ETH и TRX - переводом с каждого адреса.
+    Адрес собирается, только если комиссия не больше max_fee_ratio от суммы, иначе сбор ждет дешевой сети.
+    Комиссию сбора платит платформа: в журнал пользователю записывается все, что ушло с его адреса.
+    Транзакция сохраняется в сборе до отправки: если отправка не удалась, следующий проход повторит
+    ту же транзакцию или учтет ее, когда она окажется в блоке.
+    """
+
+    def __init__(self, interval: int = 600, expire_after: int = 3600, chains: Optional[Dict[str, dict]] = None):
+        self.interval = interval
+        # через сколько секунд сбор, о котором сеть не знает, считается выпавшим или истекшим
+        self.expire_after = expire_after
+        self.chains = chains or {}
+        self._stats = {crypto: {'sweeps': 0, 'swept': 0, 'fees': 0, 'deferred': 0} for crypto in self.chains}
+
+    async def run(self):
+        results = await asyncio.gather(*[self.run_crypto(crypto) for crypto in self.chains], return_exceptions=True)
+        for crypto, result in zip(self.chains, results):
+            if isinstance(result, Exception):
+                logging.error(f'[{crypto}] Sweep failed: {result!r}')
+
+    async def run_crypto(self, crypto: str):
+        await self.confirm(crypto)
+        settings = self.chains[crypto]
+        hot_wallet = await get_hot_wallet(crypto)
+        if hot_wallet is None:
+            logging.warning(f'[{crypto}] Hot wallet user {ROOT_ID} does not exist, nothing to sweep into')
+            return
+        active = await get_active_sweeps(crypto)
+        exclude = {ROOT_ID, *(sweep['user_id'] for sweep in active)}
+        user_ids = await get_sweep_candidates(crypto, settings['threshold'], exclude, settings['limit'])
+        users = [user for user in [await get_user_by_id(user_id) for user_id in user_ids] if user]
+        if not users:
+            return
+        to_address = hot_wallet['profile']['wallet'][crypto]['address']
+        unit = registry.get(crypto)
+        # сети с транзакциями из нескольких входов собираются одной транзакцией
+        if hasattr(unit, 'sign_batch'):
+            await self.sweep_batch(crypto, users, to_address)
+        else:
+            for user in users:
+                await self.sweep_address(crypto, user, to_address)
+
+    def cheap(self, crypto: str, fee: int, value: int) -> bool:
+        if fee < value * self.chains[crypto]['max_fee_ratio']:
+            return True
+        self._stats[crypto]['deferred'] += 1
+        return False
+
+    async def sweep_address(self, crypto: str, user: dict, to_address: str):
+        unit = registry.get(crypto)
+        priority = self.chains[crypto]['priority']
+        wallet = user['profile']['wallet'][crypto]
+        balance = await unit.get_balance(wallet['address'])
+        if balance is None:
+            return
+        fee = await unit.transfer_fee(priority)
+        if not self.cheap(crypto, fee.units, balance.units):
+            return
+        amount = balance - fee
+        sweeps = await create_sweeps(
+            [{'crypto': crypto, 'user_id': user['user_id'], 'address': wallet['address'], 'amount': amount, 'fee': fee}]
+        )
+        await set_sweeping(crypto, [user['user_id']], True)
+        try:
+            signed = await unit.sign_coins(user, to_address, amount, priority=priority)
+        except Exception as e:
+            logging.error(f"[{crypto}] Sweep of {wallet['address']} failed: {e!r}")
+            await self.cancel(crypto, sweeps, repr(e))
+            return
+        await update_sweeps(sweeps, txid=signed.txid, raw=signed.raw)
+        await self.broadcast(crypto, sweeps)
+
+    async def sweep_batch(self, crypto: str, users: List[dict], to_address: str):
+        unit = registry.get(crypto)
+        fee_per_byte = await unit.fee_per_byte(self.chains[crypto]['priority'])
+        senders = []
+        for user in users:
+            wallet = user['profile']['wallet'][crypto]
+            utxos = await unit.list_unspent(wallet['address'])
+            value = sum(utxo.value for utxo in utxos)
+            # свои входы адрес оправдывает сам, общие байты транзакции делятся ниже
+            if utxos and self.cheap(crypto, INPUT_SIZE * len(utxos) * fee_per_byte, value):
+                senders.append((user, wallet, utxos, value))
+        if not senders:
+            return
+        shared = (TX_OVERHEAD_SIZE + OUTPUT_SIZE) * fee_per_byte // len(senders) + 1
+        fees = [INPUT_SIZE * len(utxos) * fee_per_byte + shared for _, _, utxos, _ in senders]
+        total = sum(value for *_, value in senders) - sum(fees)
+        if total < DUST_LIMIT:
+            return
+
+        batch_id = uuid.uuid4().hex
+        sweeps = await create_sweeps(
+            [
+                {
+                    'crypto': crypto,
+                    'user_id': user['user_id'],
+                    'address': wallet['address'],
+                    'amount': Amount(crypto, value - fee),
+                    'fee': Amount(crypto, fee),
+                    'batch': batch_id,
+                }
+                for (user, wallet, _, value), fee in zip(senders, fees)
+            ]
+        )
+        await set_sweeping(crypto, [sweep['user_id'] for sweep in sweeps], True)
+        inputs = [utxo for _, _, utxos, _ in senders for utxo in utxos]
+        keys = {wallet['address']: wallet['private_key'] for _, wallet, _, _ in senders}
+        try:
+            signed = await unit.sign_batch(inputs, [(to_address, total)], sum(fees), keys)
+        except Exception as e:
+            logging.error(f'[{crypto}] Sweep batch {batch_id} of {len(senders)} addresses failed: {e!r}')
+            await self.cancel(crypto, sweeps, repr(e))
+            return
+        await update_sweeps(sweeps, txid=signed.txid, raw=signed.raw)
+        if await self.broadcast(crypto, sweeps):
+            logging.info(
+                f'[{crypto}] Sweep batch {signed.txid}: {len(senders)} addresses, {Amount(crypto, total).format()}'
+            )
+
+    async def broadcast(self, crypto: str, sweeps: List[dict]) -> bool:
+        """Отправка подписанного сбора; при ошибке сбор остается pending и повторяется следующим проходом"""
+        try:
+            await registry.get(crypto).broadcast(sweeps[0]['raw'])
+        except StaleTransaction:
+            # nonce занят другой транзакцией, а сбор в блок не попал - он уже не состоится
+            await self.cancel(crypto, sweeps, 'stale')
+            return False
+        except Exception as e:
+            # сеть могла принять транзакцию до ошибки: ее судьбу решит confirm
+            logging.error(f"[{crypto}] Sweep {sweeps[0]['txid']} was not broadcast: {e!r}")
+            await update_sweeps(sweeps, error=repr(e))
+            return False
+        await update_sweeps(sweeps, status=SweepStatus.BROADCAST)
+        return True
+
+    async def cancel(self, crypto: str, sweeps: List[dict], error: str):
+        """Сбор точно не ушел в сеть: адреса снова наблюдаются и могут собираться"""
+        await update_sweeps(sweeps, status=SweepStatus.FAILED, error=error)
+        await set_sweeping(crypto, [sweep['user_id'] for sweep in sweeps], False)
+
+    async def confirm(self, crypto: str):
+        """
+        Сбор попадает в журнал, как только транзакция в блоке, вместе с балансом адреса после сбора.
+        Неотправленные сборы отправляются повторно той же транзакцией, а сборы, которых сеть
+        так и не узнала за expire_after, отменяются.
+        """
+        unit = registry.get(crypto)
+        transactions: Dict[str, List[dict]] = defaultdict(list)
+        for sweep in await get_active_sweeps(crypto):
+            # сбор без транзакции прервался до подписи и ждет ручной сверки
+            if sweep.get('txid'):
+                transactions[sweep['txid']].append(sweep)
+        for txid, sweeps in transactions.items():
+            if not await unit.get_confirmations(txid):
+                if self.expired(sweeps[0]) and await unit.is_known(txid) is False:
+                    # транзакция выпала из мемпула или истекла: nonce освобождается, адреса снова наблюдаются
+                    await unit.discard(sweeps[0]['raw'])
+                    await self.cancel(crypto, sweeps, 'dropped')
+                elif sweeps[0]['status'] == SweepStatus.PENDING:
+                    await self.broadcast(crypto, sweeps)
+                continue
+            balances = await unit.fetch_balances([sweep['address'] for sweep in sweeps])
+            for sweep in sweeps:
+                if sweep['address'] in balances:
+                    await self.settle(crypto, sweep, balances[sweep['address']])
+
+    def expired(self, sweep: dict) -> bool:
+        age = datetime.now(timezone.utc) - sweep['created_at'].replace(tzinfo=timezone.utc)
+        return age > timedelta(seconds=self.expire_after)
+
+    async def settle(self, crypto: str, sweep: dict, balance: Amount):
+        unit = registry.get(crypto)
+        # у переводов с адреса комиссия известна только после блока, у пачки - задана при отправке
+        fee = await unit.get_transaction_fee(sweep['txid']) if 'batch' not in sweep else None
+        fee = fee if fee is not None else sweep['fee']
+        await ledger_sweep(
+            user_id=sweep['user_id'],
+            crypto=crypto,
+            amount=sweep['amount'] + fee,
+            balance=balance,
+            ref=f"sweep:{sweep['_id']}",
+        )
+        await update_sweeps([sweep], status=SweepStatus.CONFIRMED, fee=fee)
+        await balance_refresher.touch(sweep['user_id'])
+        stats = self._stats[crypto]
+        stats['sweeps'] += 1
+        stats['swept'] += sweep['amount'].units
+        stats['fees'] += fee.units
+
+    def stats(self) -> dict:
+        return {
+            crypto: {
+                'sweeps': stats['sweeps'],
+                'swept': str(Amount(crypto, stats['swept'])),
+                'fees': str(Amount(crypto, stats['fees'])),
+                'deferred': stats['deferred'],
+            }
+            for crypto, stats in self._stats.items()
+        }
+
+
+sweeper = Sweeper(**SWEEP_SETTINGS)
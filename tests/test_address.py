@@ -0,0 +1,60 @@
+import unittest
+from tests.base import BaseCryptedTestCase
+from validators.address import validate_address, validate_addresses, validation_stats
+
+
+class TestAddressValidation(BaseCryptedTestCase):
+
+    def test_btc_base58_and_segwit(self):
+        for address in (
+            '1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa',
+            '3J98t1WpEZ73CNmQviecrnyiWrnqRhWNLy',
+            'bc1qw508d6qejxtdg4y5r3zarvary0c5xw7kv8f3t4',
+            'BC1QW508D6QEJXTDG4Y5R3ZARVARY0C5XW7KV8F3T4',
+            'bc1p0xlxvlhemja6c4dqv22uapctqupfhlxm9h8z3k2e72q4k9hcz7vqzk5jj0',
+        ):
+            self.assertTrue(validate_address('BTC', address), address)
+        for address in (
+            '1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNb',
+            # неверная контрольная сумма, bech32 вместо bech32m для taproot, смешанный регистр
+            'bc1qw508d6qejxtdg4y5r3zarvary0c5xw7kv8f3t5',
+            'bc1pw508d6qejxtdg4y5r3zarvary0c5xw7kt5nd6y',
+            'bc1qw508d6qejxtdg4y5r3zarvary0c5xw7KV8F3T4',
+            'tb1qrp33g0q5c5txsp9arysrx4k6zdkfs4nce4xj0gdcccefvpysxf3q0sl5k7',
+        ):
+            self.assertFalse(validate_address('BTC', address), address)
+        self.assertTrue(
+            validate_address('BTC', 'tb1qrp33g0q5c5txsp9arysrx4k6zdkfs4nce4xj0gdcccefvpysxf3q0sl5k7', 'testnet')
+        )
+
+    def test_eth_checksum(self):
+        self.assertTrue(validate_address('ETH', '0x5aAeb6053F3E94C9b9A09f33669435E7Ef1BeAed'))
+        self.assertTrue(validate_address('ETH', '0xfb6916095ca1df60bb79ce92ce3ea74c37c5d359'))
+        self.assertFalse(validate_address('ETH', '0x5aaeb6053F3E94C9b9A09f33669435E7Ef1BeAed'))
+        self.assertFalse(validate_address('ETH', '5aAeb6053F3E94C9b9A09f33669435E7Ef1BeAed'))
+
+    def test_trx(self):
+        self.assertTrue(validate_address('TRX', 'TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6t'))
+        self.assertFalse(validate_address('TRX', 'TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6u'))
+        # base58check адрес BTC с другой версией
+        self.assertFalse(validate_address('TRX', '1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa'))
+
+    def test_ton_raw_and_user_friendly(self):
+        self.assertTrue(validate_address('TON', '0:' + 'ab' * 32))
+        self.assertTrue(validate_address('TON', '-1:' + 'AB' * 32))
+        self.assertTrue(validate_address('TON', 'EQDtFpEwcFAEcRe5mLVh2N6C0x-_hJEM7W61_JLnSF74p4q2'))
+        self.assertTrue(validate_address('TON', 'EQDtFpEwcFAEcRe5mLVh2N6C0x+/hJEM7W61/JLnSF74p4q2'))
+        self.assertFalse(validate_address('TON', 'EQDtFpEwcFAEcRe5mLVh2N6C0x-_hJEM7W61_JLnSF74p4q3'))
+        self.assertFalse(validate_address('TON', '1:' + 'ab' * 32))
+        self.assertFalse(validate_address('TON', 'anything'))
+
+    def test_batch_and_memo(self):
+        before = validation_stats()['hits']
+        result = validate_addresses('TRX', ['TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6t', 'x' * 500, ''])
+        self.assertEqual(list(result.values()), [True, False, False])
+        validate_address('TRX', 'TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6t')
+        self.assertGreater(validation_stats()['hits'], before)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+from tests.base import BaseCryptedTestCase
+from address_pool import AddressPool
+
+
+class TestAddressPool(BaseCryptedTestCase):
+
+    def setUp(self):
+        self.unit = MagicMock()
+        self.unit.derive_address = AsyncMock(side_effect=lambda index: (f'addr{index}', f'key{index}'))
+        self.unit.generate_address = AsyncMock(return_value=('legacy', 'legacy-key'))
+        self.registry = patch('address_pool.registry').start()
+        self.registry.get.return_value = self.unit
+        self.count_free = patch('address_pool.count_free_addresses', new_callable=AsyncMock).start()
+        self.reserve = patch('address_pool.reserve_indexes', new_callable=AsyncMock).start()
+        self.add = patch('address_pool.add_addresses', new_callable=AsyncMock).start()
+        self.claim = patch('address_pool.claim_address', new_callable=AsyncMock).start()
+        self.addCleanup(patch.stopall)
+
+    async def test_refill_tops_up_below_low_water(self):
+        pool = AddressPool(low_water=5, target=8)
+        self.count_free.return_value = 3
+        self.reserve.return_value = range(10, 15)
+        self.add.return_value = 5
+
+        added = await pool.refill_crypto('ETH')
+
+        self.assertEqual(added, 5)
+        self.reserve.assert_awaited_once_with('ETH', 5)
+        addresses = self.add.call_args.args[1]
+        self.assertEqual([address['index'] for address in addresses], [10, 11, 12, 13, 14])
+        self.assertEqual(addresses[0], {'index': 10, 'address': 'addr10', 'private_key': 'key10'})
+        self.assertEqual(pool.stats()['free'], {'ETH': 8})
+
+    async def test_refill_skips_above_low_water(self):
+        pool = AddressPool(low_water=5, target=8)
+        self.count_free.return_value = 5
+        self.assertEqual(await pool.refill_crypto('ETH'), 0)
+        self.unit.derive_address.assert_not_awaited()
+
+    async def test_claim_wallet(self):
+        pool = AddressPool()
+        self.claim.side_effect = [{'address': 'a1', 'private_key': 'k1'}, None]
+
+        wallet = await pool.claim_wallet(123, ['ETH', 'TRX'])
+
+        self.assertEqual(wallet['ETH'], {'address': 'a1', 'private_key': 'k1'})
+        # пустой пул не оставляет пользователя без адреса
+        self.assertEqual(wallet['TRX'], {'address': 'legacy', 'private_key': 'legacy-key'})
+        self.unit.generate_address.assert_awaited_once_with(123)
+        self.assertEqual(pool.stats()['fallbacks'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
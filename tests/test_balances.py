@@ -0,0 +1,62 @@
+import unittest
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, MagicMock, patch
+from tests.base import BaseCryptedTestCase
+from balances import BalanceRefresher
+from settings.common import ROOT_ID
+
+
+class TestBalanceRefresher(BaseCryptedTestCase):
+
+    def setUp(self):
+        self.db = patch('balances.DB').start()
+        self.db.users.update_one = AsyncMock()
+        self.db.users.update_many = AsyncMock()
+        cursor = MagicMock()
+        cursor.limit.return_value.to_list = AsyncMock(return_value=[])
+        self.db.users.find.return_value = cursor
+        self.addCleanup(patch.stopall)
+        self.refresher = BalanceRefresher()
+
+    async def test_touch_is_stored_in_db(self):
+        # запрос переживает процесс: его видит лидер, который выполняет проход
+        await self.refresher.touch(1)
+        query, update = self.db.users.update_one.await_args.args
+        self.assertEqual(query, {'user_id': 1})
+        self.assertIn('balance_refresh_requested_at', update['$set'])
+
+    async def test_refresh_clears_only_requests_seen_by_the_pass(self):
+        with patch('balances.CRYPTOS', ['BTC']):
+            await self.refresher.refresh()
+        # никто не обновлен - запросы остаются
+        self.db.users.update_many.assert_not_awaited()
+
+        self.refresher.refresh_crypto = AsyncMock(return_value=({2, 3}, {2}))
+        with patch('balances.CRYPTOS', ['BTC']):
+            await self.refresher.refresh()
+        # у 3 упал батч: его запрос ждет следующего прохода
+        query, update = self.db.users.update_many.await_args.args
+        self.assertEqual(query['user_id'], {'$in': [2]})
+        self.assertIn('$lte', query['balance_refresh_requested_at'])
+        self.assertEqual(update, {'$unset': {'balance_refresh_requested_at': ''}})
+
+    async def test_requests_cut_off_by_limit_are_kept(self):
+        self.refresher.limit = 3
+        results = {'BTC': ({2, 3, 5}, {2, 3, 5}), 'ETH': ({2, 4}, {2, 4})}
+        self.refresher.refresh_crypto = AsyncMock(side_effect=lambda crypto, started: results[crypto])
+        with patch('balances.CRYPTOS', ['BTC', 'ETH']):
+            await self.refresher.refresh()
+        # BTC уперся в limit: 4 мог не попасть в выборку, его запрос остается
+        query = self.db.users.update_many.await_args.args[0]
+        self.assertEqual(set(query['user_id']['$in']), {2, 3, 5})
+
+    async def test_hot_wallet_is_not_observed(self):
+        await self.refresher.refresh_crypto('BTC', datetime.now(timezone.utc))
+        self.assertEqual(self.db.users.find.call_args.args[0]['user_id'], {'$ne': ROOT_ID})
+        # в сетях без сбора адрес корневого пользователя - обычный кошелек
+        await self.refresher.refresh_crypto('TON', datetime.now(timezone.utc))
+        self.assertNotIn('user_id', self.db.users.find.call_args.args[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
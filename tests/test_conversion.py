@@ -0,0 +1,31 @@
+import unittest
+from decimal import Decimal
+from conversion import ConversionMatrix
+
+
+class TestConversionMatrix(unittest.TestCase):
+
+    def setUp(self):
+        rates = {'BTC': 60000.5, 'ETH': 3000, 'USD': 1, 'RUB': 90.25}
+        self.matrix = ConversionMatrix(rates, cryptos=['BTC', 'ETH', 'TON'], fiats=['USD', 'RUB'])
+
+    def test_convert(self):
+        self.assertEqual(self.matrix.convert('0.001', 'BTC', 'USD'), Decimal('60.00'))
+        self.assertEqual(self.matrix.convert(Decimal('0.5'), 'ETH', 'RUB'), Decimal('135375.00'))
+        self.assertEqual(self.matrix.convert_minor('0.001', 'BTC', 'USD'), 6000)
+
+    def test_float_amount_is_exact(self):
+        self.assertEqual(self.matrix.convert(0.1, 'ETH', 'USD'), Decimal('300.00'))
+
+    def test_unknown_rate_is_zero(self):
+        self.assertEqual(self.matrix.convert(10, 'TON', 'USD'), Decimal('0.00'))
+        self.assertEqual(self.matrix.convert(10, 'BTC', 'EUR'), Decimal('0.00'))
+
+    def test_convert_many(self):
+        balances = {'BTC': Decimal('0.001'), 'ETH': 0.1, 'TON': 5}
+        self.assertEqual(self.matrix.convert_many([(1, 'ETH'), (2, 'ETH')], 'USD'), [Decimal('3000.00'), Decimal('6000.00')])
+        self.assertEqual(self.matrix.convert_wallet(balances, 'USD')['ETH'], Decimal('300.00'))
+
+
+if __name__ == '__main__':
+    unittest.main()
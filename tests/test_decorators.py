@@ -0,0 +1,73 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+from tests.base import BaseCryptedTestCase
+from decorators import AsyncTTLCache, async_cache
+
+
+class TestAsyncCache(BaseCryptedTestCase):
+
+    async def test_keyed_on_arguments(self):
+        calls = []
+
+        @async_cache(ttl=30)
+        async def get_balance(address):
+            calls.append(address)
+            return f'balance:{address}'
+
+        self.assertEqual(await get_balance('a'), 'balance:a')
+        self.assertEqual(await get_balance('b'), 'balance:b')
+        self.assertEqual(await get_balance('a'), 'balance:a')
+        self.assertEqual(calls, ['a', 'b'])
+        self.assertEqual(get_balance.cache.stats()['hits'], 1)
+
+    async def test_ttl(self):
+        cache = AsyncTTLCache(name='test_ttl', ttl=10)
+        with patch('decorators.time.monotonic', return_value=100):
+            cache.set('key', 1)
+        with patch('decorators.time.monotonic', return_value=105):
+            self.assertEqual(cache.get('key'), 1)
+        with patch('decorators.time.monotonic', return_value=111):
+            self.assertIsNone(cache.get('key'))
+
+    async def test_lru_eviction(self):
+        cache = AsyncTTLCache(name='test_lru', ttl=10, maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    async def test_single_flight(self):
+        calls = 0
+
+        @async_cache(ttl=30)
+        async def get_fee(crypto):
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return 42
+
+        results = await asyncio.gather(*[get_fee('BTC') for _ in range(10)])
+        self.assertEqual(results, [42] * 10)
+        self.assertEqual(calls, 1)
+        self.assertEqual(get_fee.cache.stats()['coalesced'], 9)
+
+    async def test_none_not_cached(self):
+        calls = 0
+
+        @async_cache(ttl=30)
+        async def failing():
+            nonlocal calls
+            calls += 1
+            return None
+
+        await failing()
+        await failing()
+        self.assertEqual(calls, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
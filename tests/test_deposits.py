@@ -0,0 +1,90 @@
+import unittest
+from decimal import Decimal
+from unittest.mock import patch, AsyncMock, MagicMock
+from tests.base import BaseCryptedTestCase
+from deposits import DepositWatcher, RecordedBlockSource, Transfer
+
+
+class TestDepositWatcher(BaseCryptedTestCase):
+
+    def setUp(self):
+        self.source = RecordedBlockSource(
+            blocks={
+                100: [Transfer(txid='tx1', block=100, to='0xUSER', amount=Decimal('0.5'))],
+                101: [Transfer(txid='tx2', block=101, to='0xstranger', amount=Decimal('1'))],
+                102: [Transfer(txid='tx3', block=102, to='0xuser', amount=Decimal('0.25'))],
+            },
+            latest=102,
+        )
+        self.source.normalize = str.lower
+        self.watcher = DepositWatcher(crypto='ETH', source=self.source, confirmations=2, max_blocks=10)
+        self.watcher.addresses = {'0xuser': 123}
+
+    @patch('deposits.set_block_cursor', new_callable=AsyncMock)
+    @patch('deposits.save_deposit', new_callable=AsyncMock)
+    @patch('deposits.get_block_cursor', new_callable=AsyncMock)
+    async def test_scan_resumes_from_cursor(self, mock_get_cursor, mock_save_deposit, mock_set_cursor):
+        mock_get_cursor.return_value = 99
+        mock_save_deposit.return_value = True
+
+        found = await self.watcher.scan(latest=102)
+
+        self.assertEqual(found, 2)
+        self.assertEqual([call.kwargs['txid'] for call in mock_save_deposit.call_args_list], ['tx1', 'tx3'])
+        self.assertEqual(mock_save_deposit.call_args_list[0].kwargs['user_id'], 123)
+        self.assertEqual(mock_set_cursor.call_args_list[-1].args, ('ETH', 102))
+
+    @patch('deposits.set_block_cursor', new_callable=AsyncMock)
+    @patch('deposits.save_deposit', new_callable=AsyncMock)
+    @patch('deposits.get_block_cursor', new_callable=AsyncMock)
+    async def test_first_run_starts_at_latest(self, mock_get_cursor, mock_save_deposit, mock_set_cursor):
+        mock_get_cursor.return_value = None
+        mock_save_deposit.return_value = True
+
+        found = await self.watcher.scan(latest=102)
+
+        self.assertEqual(found, 1)
+        mock_set_cursor.assert_awaited_once_with('ETH', 102)
+
+    @patch('deposits.ledger_credit', new_callable=AsyncMock)
+    @patch('deposits.balance_refresher', touch=AsyncMock())
+    @patch('deposits.update_deposit', new_callable=AsyncMock)
+    @patch('deposits.get_pending_deposits', new_callable=AsyncMock)
+    async def test_confirm(self, mock_pending, mock_update_deposit, mock_refresher, mock_credit):
+        mock_pending.return_value = [
+            {'_id': 1, 'block': 100, 'user_id': 123, 'amount': '0.5', 'confirmations': 0},
+            {'_id': 2, 'block': 102, 'user_id': 123, 'amount': '0.25', 'confirmations': 0},
+        ]
+
+        confirmed = await self.watcher.confirm(latest=102)
+
+        self.assertEqual(confirmed, 1)
+        mock_update_deposit.assert_any_await(1, confirmations=3, status='confirmed')
+        mock_update_deposit.assert_any_await(2, confirmations=1)
+        mock_refresher.touch.assert_awaited_once_with(123)
+        mock_credit.assert_awaited_once_with(user_id=123, crypto='ETH', amount='0.5', ref='deposit:1')
+
+    @patch('deposits.send_message', new_callable=AsyncMock, side_effect=TimeoutError())
+    @patch('deposits.ledger_credit', new_callable=AsyncMock, side_effect=RuntimeError())
+    @patch('deposits.balance_refresher', touch=AsyncMock())
+    @patch('deposits.update_deposit', new_callable=AsyncMock)
+    @patch('deposits.get_pending_deposits', new_callable=AsyncMock)
+    async def test_confirm_credits_before_status(
+        self, mock_pending, mock_update_deposit, mock_refresher, mock_credit, mock_send
+    ):
+        mock_pending.return_value = [{'_id': 1, 'block': 100, 'user_id': 123, 'amount': '0.5', 'confirmations': 0}]
+        # незачисленный депозит остается pending до следующего прохода
+        with self.assertRaises(RuntimeError):
+            await self.watcher.confirm(latest=102)
+        mock_update_deposit.assert_not_awaited()
+
+        # ошибка уведомления не мешает сохранить статус
+        mock_credit.side_effect = None
+        self.watcher.bot = MagicMock()
+        self.assertEqual(await self.watcher.confirm(latest=102), 1)
+        mock_update_deposit.assert_awaited_once_with(1, confirmations=3, status='confirmed')
+        mock_send.assert_awaited_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
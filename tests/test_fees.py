@@ -0,0 +1,46 @@
+import unittest
+from decimal import Decimal
+from unittest.mock import AsyncMock, MagicMock, patch
+from tests.base import BaseCryptedTestCase
+from fees import FeeOracle
+
+
+class TestFeeOracle(BaseCryptedTestCase):
+
+    def setUp(self):
+        self.unit = MagicMock()
+        self.unit.estimate_fees = AsyncMock(
+            return_value={'low': Decimal('0.0001'), 'medium': Decimal('0.0002'), 'high': Decimal('0.0004')}
+        )
+        self.registry = patch('fees.registry').start()
+        self.registry.get.return_value = self.unit
+        self.db = patch('fees.DB').start()
+        self.db.network_fees.update_one = AsyncMock()
+        self.db.network_fees.find_one = AsyncMock(return_value=None)
+        patch('fees.CRYPTO_SETTINGS', {'BTC': {}}).start()
+        self.addCleanup(patch.stopall)
+
+    async def test_refresh_serves_from_memory(self):
+        oracle = FeeOracle(max_age=600)
+        self.assertIsNone(oracle.get('BTC'))
+        await oracle.refresh()
+        estimate = oracle.get('BTC')
+        self.assertEqual(estimate.medium, Decimal('0.0002'))
+        self.assertEqual(estimate.get('high'), Decimal('0.0004'))
+        self.assertFalse(estimate.stale)
+        self.db.network_fees.update_one.assert_awaited_once()
+
+    async def test_failed_refresh_keeps_stale_estimate(self):
+        oracle = FeeOracle(max_age=600)
+        with patch('fees.time.time', return_value=1000):
+            await oracle.refresh()
+        self.unit.estimate_fees.side_effect = ConnectionError('node is down')
+        with patch('fees.time.time', return_value=2000):
+            await oracle.refresh()
+            estimate = oracle.get('BTC')
+        self.assertEqual(estimate.medium, Decimal('0.0002'))
+        self.assertTrue(estimate.stale)
+
+
+if __name__ == '__main__':
+    unittest.main()
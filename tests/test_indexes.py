@@ -0,0 +1,71 @@
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+from tests.base import BaseCryptedTestCase
+from database.indexes import QUERY_SHAPES, IndexAuditError, audit_query_plans, bootstrap_indexes
+
+IXSCAN = {'queryPlanner': {'winningPlan': {'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN'}}}}
+COLLSCAN = {'queryPlanner': {'winningPlan': {'stage': 'SORT', 'inputStage': {'stage': 'COLLSCAN'}}}}
+# план с $or: полный просмотр спрятан в одной из веток
+OR_COLLSCAN = {
+    'queryPlanner': {
+        'winningPlan': {
+            'stage': 'SUBPLAN',
+            'inputStage': {
+                'stage': 'OR',
+                'inputStages': [{'stage': 'IXSCAN'}, {'stage': 'FETCH', 'inputStage': {'stage': 'COLLSCAN'}}],
+            },
+        }
+    }
+}
+
+
+class TestIndexAudit(BaseCryptedTestCase):
+
+    def setUp(self):
+        self.db = patch('database.indexes.DB').start()
+        self.plans = {}
+        self.db.__getitem__.side_effect = self.collection
+        self.addCleanup(patch.stopall)
+
+    def collection(self, name):
+        collection = MagicMock()
+        collection.create_indexes = AsyncMock()
+
+        def find(query):
+            cursor = MagicMock()
+            cursor.explain = AsyncMock(return_value=self.plans.get((name, str(query)), IXSCAN))
+            return cursor
+
+        collection.find.side_effect = find
+        return collection
+
+    def scan(self, plan, index=0):
+        collection, query = QUERY_SHAPES[index]
+        self.plans[(collection, str(query))] = plan
+        return collection, query
+
+    async def test_only_collection_scans_are_reported(self):
+        first = self.scan(COLLSCAN, 0)
+        second = self.scan(OR_COLLSCAN, 1)
+        self.assertEqual(await audit_query_plans(), [first, second])
+
+    async def test_covered_queries_pass(self):
+        self.assertEqual(await audit_query_plans(), [])
+
+    async def test_modes(self):
+        self.scan(COLLSCAN)
+        with patch('database.indexes.audit_query_plans', wraps=audit_query_plans) as audit:
+            await bootstrap_indexes('off')
+            audit.assert_not_called()
+            # warn только пишет в лог
+            await bootstrap_indexes('warn')
+            audit.assert_awaited_once()
+            with self.assertRaises(IndexAuditError):
+                await bootstrap_indexes('fail')
+
+    async def test_fail_mode_passes_when_covered(self):
+        await bootstrap_indexes('fail')
+
+
+if __name__ == '__main__':
+    unittest.main()
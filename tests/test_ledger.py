@@ -0,0 +1,133 @@
+import unittest
+from decimal import Decimal
+from unittest.mock import AsyncMock, MagicMock, patch
+from bson.decimal128 import Decimal128
+from pymongo.errors import DuplicateKeyError
+from tests.base import BaseCryptedTestCase
+from database.ledger import observe_operation, reserve, release, credit, debit, spend, sweep, to_amount
+
+
+def evaluate(expression, document):
+    """Вычисление агрегатного выражения из reserve над документом так, как это делает MongoDB"""
+    if isinstance(expression, str) and expression.startswith('$'):
+        value = document.get(expression[1:])
+        return value.to_decimal() if isinstance(value, Decimal128) else value
+    if isinstance(expression, Decimal128):
+        return expression.to_decimal()
+    if not isinstance(expression, dict):
+        return Decimal(expression)
+    (operator, arguments), = expression.items()
+    values = [evaluate(argument, document) for argument in arguments]
+    if operator == '$ifNull':
+        return values[0] if values[0] is not None else values[1]
+    if operator == '$cond':
+        return values[1] if values[0] else values[2]
+    # арифметика с отсутствующим полем дает null, а null меньше любого числа
+    if None in values:
+        return False if operator == '$gte' else None
+    if operator == '$add':
+        return sum(values)
+    if operator == '$subtract':
+        return values[0] - values[1]
+    if operator == '$gte':
+        return values[0] >= values[1]
+    raise ValueError(operator)
+
+
+class TestLedger(BaseCryptedTestCase):
+
+    def setUp(self):
+        self.db = patch('database.ledger.DB').start()
+        self.db.balances.update_one = AsyncMock(return_value=MagicMock(matched_count=1, upserted_id=None))
+        self.db.ledger.insert_one = AsyncMock()
+        self.addCleanup(patch.stopall)
+
+    def test_to_amount(self):
+        self.assertEqual(to_amount('BTC', 0.1 + 0.2), Decimal('0.30000000'))
+        self.assertEqual(to_amount('ETH', '1'), Decimal('1.000000000000000000'))
+
+    async def test_reserve_is_one_conditional_inc(self):
+        self.assertTrue(await reserve(user_id=1, crypto='BTC', amount='0.5', ref='check:abc'))
+        query, update = self.db.balances.update_one.await_args.args
+        self.assertEqual(query['user_id'], 1)
+        self.assertIn('$expr', query)
+        self.assertEqual(update['$inc'], {'held': Decimal128('0.50000000')})
+        self.assertFalse(self.db.balances.update_one.await_args.kwargs['upsert'])
+        entry = self.db.ledger.insert_one.await_args.args[0]
+        self.assertEqual((entry['kind'], entry['ref']), ('hold', 'check:abc'))
+
+    async def test_reserve_without_funds(self):
+        self.db.balances.update_one.return_value = MagicMock(matched_count=0, upserted_id=None)
+        self.assertFalse(await reserve(user_id=1, crypto='BTC', amount='0.5'))
+        self.db.ledger.insert_one.assert_not_awaited()
+
+    async def test_reserve_condition_on_documents(self):
+        await reserve(user_id=1, crypto='BTC', amount='0.5')
+        condition = self.db.balances.update_one.await_args.args[0]['$expr']
+        documents = [
+            ({'chain': Decimal128('1'), 'held': Decimal128('0.4')}, True),
+            ({'chain': Decimal128('1'), 'held': Decimal128('0.6'), 'swept': Decimal128('0')}, False),
+            # средства на горячем кошельке входят в доступный остаток
+            ({'chain': Decimal128('0.2'), 'held': Decimal128('0'), 'swept': Decimal128('0.3')}, True),
+            ({'chain': Decimal128('0.1'), 'held': Decimal128('0.3'), 'swept': Decimal128('0')}, False),
+            # отправленное с адреса вычитается, пока наблюдение не покажет списание
+            ({'chain': Decimal128('1'), 'held': Decimal128('0'), 'outgoing': Decimal128('0.6')}, False),
+        ]
+        for document, expected in documents:
+            self.assertEqual(evaluate(condition, document), expected, document)
+
+    async def test_duplicate_ref_is_rolled_back(self):
+        self.db.ledger.insert_one.side_effect = DuplicateKeyError('dup')
+        self.assertFalse(await release(user_id=1, crypto='TRX', amount=5, ref='withdrawal:1'))
+        rollback = self.db.balances.update_one.await_args_list[-1].args[1]
+        self.assertEqual(rollback, {'$inc': {'held': Decimal128('5.000000')}})
+
+    async def test_credit_and_debit_do_not_touch_chain(self):
+        # баланс адреса в сети только наблюдается, поступление пишется лишь в журнал
+        self.assertTrue(await credit(user_id=1, crypto='TRX', amount=5, ref='deposit:1'))
+        self.db.balances.update_one.assert_not_awaited()
+        self.assertEqual(self.db.ledger.insert_one.await_args.args[0]['kind'], 'credit')
+        # отправленная сумма остается вычтенной, пока ее не покажет наблюдение
+        self.assertTrue(await debit(user_id=1, crypto='TRX', amount=4, ref='withdrawal:1'))
+        update = self.db.balances.update_one.await_args.args[1]
+        self.assertEqual(update['$inc'], {'held': Decimal128('-4.000000'), 'outgoing': Decimal128('4.000000')})
+
+    async def test_spend_records_observed_balance(self):
+        self.assertTrue(await spend(user_id=1, crypto='TRX', amount=4, balance=6, ref='withdrawal:1'))
+        update = self.db.balances.update_one.await_args.args[1]
+        self.assertEqual(update['$inc'], {'outgoing': Decimal128('-4.000000')})
+        self.assertEqual(update['$set'], {'chain': Decimal128('6.000000')})
+        # сбор адреса запись о выводе не завершает
+        self.assertNotIn('$unset', update)
+
+    async def test_release(self):
+        self.assertTrue(await release(user_id=1, crypto='TON', amount=Decimal('1.5')))
+        update = self.db.balances.update_one.await_args.args[1]
+        self.assertEqual(update['$inc'], {'held': Decimal128('-1.500000000')})
+        self.assertEqual(
+            update['$setOnInsert'],
+            {'chain': Decimal128('0'), 'swept': Decimal128('0'), 'outgoing': Decimal128('0')},
+        )
+
+    async def test_debit_and_sweep_move_hot_wallet_funds(self):
+        self.assertTrue(await sweep(user_id=1, crypto='TRX', amount=10, balance=1, ref='sweep:1'))
+        update = self.db.balances.update_one.await_args.args[1]
+        self.assertEqual(update['$inc'], {'swept': Decimal128('10.000000')})
+        # баланс адреса после сбора записывается той же операцией и снова открывает наблюдения
+        self.assertEqual(update['$set'], {'chain': Decimal128('1.000000')})
+        self.assertEqual(update['$unset'], {'sweeping': ''})
+        self.assertEqual(update['$setOnInsert'], {'held': Decimal128('0'), 'outgoing': Decimal128('0')})
+        self.assertTrue(await debit(user_id=1, crypto='TRX', amount=4, ref='withdrawal:1', hot=True))
+        update = self.db.balances.update_one.await_args.args[1]
+        self.assertEqual(update['$inc'], {'held': Decimal128('-4.000000'), 'swept': Decimal128('-4.000000')})
+        self.assertEqual(self.db.ledger.insert_one.await_args.args[0]['kind'], 'hot_debit')
+
+    def test_observation_is_ignored_while_sweeping(self):
+        chain = observe_operation(1, 'BTC', '0.2')._doc[0]['$set']['chain']
+        self.assertEqual(evaluate(chain, {'chain': Decimal128('1')}), Decimal('0.20000000'))
+        self.assertEqual(evaluate(chain, {}), Decimal('0.20000000'))
+        self.assertEqual(evaluate(chain, {'chain': Decimal128('1'), 'sweeping': True}), Decimal('1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+from decimal import Decimal, InvalidOperation
+from bson.decimal128 import Decimal128
+from money import Amount
+
+
+class TestAmount(unittest.TestCase):
+
+    def test_parse_and_units(self):
+        self.assertEqual(Amount.parse('BTC', '0.1').units, 10_000_000)
+        self.assertEqual(Amount.parse('ETH', '1,5').units, 15 * 10**17)
+        self.assertEqual(Amount.parse('TRX', '0.0000005').units, 0)
+        with self.assertRaises(InvalidOperation):
+            Amount.parse('BTC', 'abc')
+        with self.assertRaises(InvalidOperation):
+            Amount.parse('BTC', 'inf')
+        # переполнение показателя степени тоже ошибка ввода, а не падение валидатора
+        for value in ('9e999999', '-9e999999999999'):
+            with self.assertRaises(InvalidOperation):
+                Amount.parse('BTC', value)
+
+    def test_of_legacy_values(self):
+        self.assertEqual(Amount.of('BTC', '0.5'), Amount('BTC', 50_000_000))
+        self.assertEqual(Amount.of('BTC', 0.1 + 0.2), Amount('BTC', 30_000_000))
+        self.assertEqual(Amount.of('TON', Decimal128('1.5')), Amount('TON', 1_500_000_000))
+        self.assertEqual(Amount.of('TON', None), Amount('TON'))
+
+    def test_arithmetic_and_ordering(self):
+        value = Amount.parse('BTC', '0.1') + Amount.parse('BTC', '0.2')
+        self.assertEqual(value, Amount.parse('BTC', '0.3'))
+        self.assertTrue(Amount.parse('BTC', '0.1') < value <= Amount.parse('BTC', '0.3'))
+        with self.assertRaises(ValueError):
+            value + Amount('ETH', 1)
+
+    def test_format(self):
+        self.assertEqual(Amount('BTC', 50_000_000).format(), '0.5')
+        self.assertEqual(Amount('BTC', 0).format(), '0')
+        self.assertEqual(Amount('ETH', 1_234_567_890_123_456_789).format(), '1.234568')
+        self.assertEqual(Amount('ETH', 1_234_567_890_123_456_789).format(places=2), '1.23')
+        self.assertEqual(Amount('ETH', -10**18).format(), '-1')
+        self.assertEqual(str(Amount('ETH', 1)), '0.000000000000000001')
+        self.assertEqual(Amount.parse('ETH', str(Amount('ETH', 123))).units, 123)
+
+    def test_to_decimal(self):
+        self.assertEqual(Amount('TRX', 1_500_000).to_decimal(), Decimal('1.5'))
+
+
+if __name__ == '__main__':
+    unittest.main()
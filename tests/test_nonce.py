@@ -0,0 +1,49 @@
+import unittest
+from unittest.mock import AsyncMock, patch
+from tests.base import BaseCryptedTestCase
+from units.nonce import NonceManager
+
+
+class TestNonceManager(BaseCryptedTestCase):
+
+    def setUp(self):
+        self.counter = {'next_nonce': 0}
+
+        async def sync(address, chain_nonce):
+            self.counter['next_nonce'] = max(self.counter['next_nonce'], chain_nonce)
+
+        async def reset(address, chain_nonce):
+            self.counter['next_nonce'] = chain_nonce
+
+        async def allocate(address):
+            self.counter['next_nonce'] += 1
+            return self.counter['next_nonce'] - 1
+
+        patch('units.nonce.sync_nonce', side_effect=sync).start()
+        patch('units.nonce.reset_nonce', side_effect=reset).start()
+        patch('units.nonce.allocate_nonce', side_effect=allocate).start()
+        self.addCleanup(patch.stopall)
+
+    async def test_node_is_asked_only_once(self):
+        manager = NonceManager()
+        fetch = AsyncMock(return_value=7)
+
+        nonces = [await manager.allocate('0xABC', fetch) for _ in range(3)]
+
+        self.assertEqual(nonces, [7, 8, 9])
+        fetch.assert_awaited_once()
+
+    async def test_resync_closes_gap(self):
+        manager = NonceManager()
+        await manager.allocate('0xabc', AsyncMock(return_value=7))
+        await manager.allocate('0xabc', AsyncMock(return_value=7))
+
+        # второй nonce так и не дошел до сети
+        await manager.resync('0xabc', AsyncMock(return_value=8))
+
+        self.assertEqual(await manager.allocate('0xabc', AsyncMock()), 8)
+        self.assertEqual(manager.stats()['resyncs'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+from tests.base import BaseCryptedTestCase
+from database.withdrawal import WithdrawalStatus
+from money import Amount
+from payouts import PayoutBatcher, tx_size
+from units.base import SignedTransaction
+from units.btc import Utxo
+
+USERS = {
+    1: {'profile': {'wallet': {'BTC': {'address': 'alice', 'private_key': 'ka'}}}},
+    2: {'profile': {'wallet': {'BTC': {'address': 'bob', 'private_key': 'kb'}}}},
+}
+UTXOS = {
+    'alice': [Utxo('t1', 0, 1_000_000, 'alice')],
+    'bob': [Utxo('t2', 0, 3_000, 'bob')],
+}
+
+
+class TestPayoutBatcher(BaseCryptedTestCase):
+
+    def setUp(self):
+        self.unit = MagicMock()
+        self.unit.fee_per_byte = AsyncMock(return_value=10)
+        self.unit.list_unspent = AsyncMock(side_effect=lambda address: UTXOS[address])
+        self.unit.sign_batch = AsyncMock(return_value=SignedTransaction(txid='batchtx', raw='batchraw'))
+        self.unit.broadcast = AsyncMock(return_value='batchtx')
+        patch('payouts.registry').start().get.return_value = self.unit
+        self.update = patch('payouts.update_withdrawal', new_callable=AsyncMock).start()
+        self.addCleanup(patch.stopall)
+        self.worker = MagicMock(owner='me', mark_broadcast=AsyncMock(), retry=AsyncMock(), fail=AsyncMock())
+        self.worker.payer = AsyncMock(side_effect=lambda withdrawal: (USERS[withdrawal['user_id']], False))
+        self.batcher = PayoutBatcher(self.worker, crypto='BTC')
+
+    def withdrawal(self, key, user_id, units):
+        return {'key': key, 'user_id': user_id, 'address': f'to-{key}', 'amount': Amount('BTC', units)}
+
+    async def test_batch_keeps_change_per_sender(self):
+        first, second = self.withdrawal('a1', 1, 100_000), self.withdrawal('a2', 1, 200_000)
+        poor = self.withdrawal('b1', 2, 100_000)
+
+        await self.batcher.send([first, second, poor])
+
+        inputs, outputs, fee, keys = self.unit.sign_batch.call_args.args
+        self.assertEqual(inputs, UTXOS['alice'])
+        self.assertEqual(keys, {'alice': 'ka'})
+        change = 1_000_000 - 300_000 - fee
+        self.assertEqual(outputs, [('to-a1', 100_000), ('to-a2', 200_000), ('alice', change)])
+        self.assertEqual(fee, tx_size(1, 3) * 10 + 1)
+        # у второго отправителя не хватило выходов - его вывод ждет следующей пачки
+        self.worker.retry.assert_awaited_once_with(poor, error='insufficient confirmed outputs')
+        self.assertEqual(
+            [call.args for call in self.worker.mark_broadcast.await_args_list], [(first, 'batchtx'), (second, 'batchtx')]
+        )
+        stats = self.batcher.stats()
+        self.assertEqual(stats['last']['savings'], tx_size(1, 2) * 10 * 2 - fee)
+
+    async def test_failed_signing_fails_every_payout(self):
+        self.unit.sign_batch.side_effect = ValueError('rejected')
+        withdrawal = self.withdrawal('a1', 1, 100_000)
+
+        await self.batcher.send([withdrawal])
+
+        self.worker.fail.assert_awaited_once()
+        self.unit.broadcast.assert_not_awaited()
+        self.worker.mark_broadcast.assert_not_awaited()
+
+    async def test_failed_broadcast_keeps_payouts_signed(self):
+        # таймаут после того, как сеть приняла пачку: холды не снимаются
+        self.unit.broadcast.side_effect = TimeoutError()
+        withdrawal = self.withdrawal('a1', 1, 100_000)
+
+        await self.batcher.send([withdrawal])
+
+        fields = self.update.await_args.kwargs
+        self.assertEqual(
+            (fields['status'], fields['txid'], fields['raw']), (WithdrawalStatus.SIGNED, 'batchtx', 'batchraw')
+        )
+        self.worker.fail.assert_not_awaited()
+        self.worker.retry.assert_awaited_once()
+        self.worker.mark_broadcast.assert_not_awaited()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import unittest
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, patch
+from pymongo import UpdateOne
+from tests.base import BaseCryptedTestCase
+from database.rate_history import RateHistory
+
+# 2024-01-01 10:59:30 UTC: следующая минута попадает уже в другой час
+T0 = datetime(2024, 1, 1, 10, 59, 30, tzinfo=timezone.utc).timestamp()
+HOUR_10 = datetime(2024, 1, 1, 10, tzinfo=timezone.utc)
+HOUR_11 = datetime(2024, 1, 1, 11, tzinfo=timezone.utc)
+
+
+class TestRateHistory(BaseCryptedTestCase):
+
+    def setUp(self):
+        self.db = patch('database.rate_history.DB').start()
+        self.db.rate_candles.bulk_write = AsyncMock()
+        self.db.rate_ticks.bulk_write = AsyncMock()
+        self.addCleanup(patch.stopall)
+        self.history = RateHistory(flush_size=3, retention={'ticks': 7, '1m': 2})
+
+    def ticks(self) -> dict:
+        operations = self.db.rate_ticks.bulk_write.await_args.args[0]
+        return {(operation._filter['symbol'], operation._filter['start']): operation._doc for operation in operations}
+
+    async def test_ticks_are_buffered_until_flush_size(self):
+        await self.history.record({'BTC/USD': 100.0}, timestamp=T0)
+        await self.history.record({'BTC/USD': 101.0}, timestamp=T0 + 10)
+        self.db.rate_ticks.bulk_write.assert_not_awaited()
+        self.assertEqual(self.db.rate_candles.bulk_write.await_count, 2)
+
+        await self.history.record({'BTC/USD': 102.0}, timestamp=T0 + 20)
+        self.db.rate_ticks.bulk_write.assert_awaited_once()
+        self.assertEqual(len(self.history._times), 0)
+
+    async def test_flush_groups_ticks_into_hourly_buckets(self):
+        await self.history.record({'BTC/USD': 100.0}, timestamp=T0)
+        # ETH/USD появилась со второго тика
+        await self.history.record({'BTC/USD': 101.0, 'ETH/USD': 5.0}, timestamp=T0 + 40)
+        await self.history.flush()
+
+        ticks = self.ticks()
+        self.assertEqual(set(ticks), {('BTC/USD', HOUR_10), ('BTC/USD', HOUR_11), ('ETH/USD', HOUR_11)})
+        self.assertEqual(
+            ticks[('BTC/USD', HOUR_10)],
+            {
+                '$push': {'t': {'$each': [3570.0]}, 'p': {'$each': [100.0]}},
+                '$inc': {'n': 1},
+                '$setOnInsert': {'expire_at': datetime(2024, 1, 8, 10, tzinfo=timezone.utc)},
+            },
+        )
+        self.assertEqual(ticks[('ETH/USD', HOUR_11)]['$push'], {'t': {'$each': [10.0]}, 'p': {'$each': [5.0]}})
+
+    async def test_failed_flush_is_retried(self):
+        await self.history.record({'BTC/USD': 100.0}, timestamp=T0)
+        self.db.rate_ticks.bulk_write.side_effect = TimeoutError()
+        with self.assertRaises(TimeoutError):
+            await self.history.flush()
+
+        # тики не потеряны: следующий flush пишет их вместе с новыми
+        self.db.rate_ticks.bulk_write.side_effect = None
+        await self.history.record({'BTC/USD': 101.0}, timestamp=T0 + 40)
+        await self.history.flush()
+        operations = self.db.rate_ticks.bulk_write.await_args.args[0]
+        self.assertEqual([operation._doc['$push']['p']['$each'] for operation in operations], [[100.0], [101.0]])
+
+        await self.history.flush()
+        self.assertEqual(self.db.rate_ticks.bulk_write.await_count, 2)
+
+    async def test_empty_flush_does_not_write(self):
+        await self.history.flush()
+        self.db.rate_ticks.bulk_write.assert_not_awaited()
+
+    async def test_candles_are_upserted_per_interval(self):
+        await self.history.record({'BTC/USD': 100.0}, timestamp=T0)
+
+        operations = self.db.rate_candles.bulk_write.await_args.args[0]
+        self.assertEqual(len(operations), 3)
+        self.assertEqual(
+            operations[0],
+            UpdateOne(
+                {'symbol': 'BTC/USD', 'interval': '1m', 'start': datetime(2024, 1, 1, 10, 59, tzinfo=timezone.utc)},
+                {
+                    '$setOnInsert': {'o': 100.0, 'expire_at': datetime(2024, 1, 3, 10, 59, tzinfo=timezone.utc)},
+                    '$max': {'h': 100.0},
+                    '$min': {'l': 100.0},
+                    '$set': {'c': 100.0},
+                    '$inc': {'n': 1},
+                },
+                upsert=True,
+            ),
+        )
+        # у часовых и дневных свечей срок хранения не задан
+        self.assertEqual(operations[1]._filter['start'], HOUR_10)
+        self.assertEqual(operations[1]._doc['$setOnInsert'], {'o': 100.0})
+        self.assertEqual(operations[2]._filter['start'], datetime(2024, 1, 1, tzinfo=timezone.utc))
+
+
+if __name__ == '__main__':
+    unittest.main()
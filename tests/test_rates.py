@@ -0,0 +1,68 @@
+import asyncio
+import unittest
+from tests.base import BaseCryptedTestCase
+from rates import RatesAggregator, RatesProvider
+
+
+class StubProvider(RatesProvider):
+
+    def __init__(self, name, rates=None, delay=0, error=None, timeout=1):
+        super().__init__(timeout)
+        self.name = name
+        self.rates = rates or {}
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    async def fetch(self, cryptos, fiats):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return self.rates
+
+
+class TestRatesAggregator(BaseCryptedTestCase):
+
+    async def test_first_healthy_provider_wins(self):
+        fast = StubProvider('fast', {'BTC': 100, 'USD': 1})
+        slow = StubProvider('slow', {'BTC': 200, 'USD': 1}, delay=10)
+        aggregator = RatesAggregator([fast, slow], quorum=1, hedge_delay=0.05, deadline=1)
+        result = await aggregator.fetch(['BTC'], ['USD'])
+        self.assertEqual(result.rates, {'BTC': 100, 'USD': 1})
+        self.assertEqual(result.sources, ['fast'])
+        self.assertEqual(slow.calls, 0)
+
+    async def test_hedge_after_slow_provider(self):
+        slow = StubProvider('slow', {'BTC': 200}, delay=10)
+        fast = StubProvider('fast', {'BTC': 100})
+        aggregator = RatesAggregator([slow, fast], quorum=1, hedge_delay=0.05, deadline=1)
+        result = await asyncio.wait_for(aggregator.fetch(['BTC'], []), 0.5)
+        self.assertEqual(result.rates, {'BTC': 100})
+        await asyncio.sleep(0.01)
+        self.assertEqual(aggregator.stats()['slow']['cancelled'], 1)
+
+    async def test_median_and_stale(self):
+        providers = [
+            StubProvider('a', {'BTC': 100, 'RUB': 90}),
+            StubProvider('b', {'BTC': 110}),
+            StubProvider('c', {'BTC': 300, 'RUB': 92}),
+            StubProvider('broken', error=ValueError('bad json')),
+        ]
+        aggregator = RatesAggregator(providers, quorum=4, hedge_delay=0, deadline=1)
+        result = await aggregator.fetch(['BTC', 'ETH'], ['RUB'])
+        self.assertEqual(result.rates, {'BTC': 110, 'RUB': 91})
+        self.assertEqual(result.stale, frozenset({'ETH'}))
+        self.assertEqual(aggregator.stats()['broken']['errors'], 1)
+
+    async def test_timeout_marks_everything_stale(self):
+        provider = StubProvider('hanging', {'BTC': 100}, delay=10, timeout=0.05)
+        aggregator = RatesAggregator([provider], quorum=1, hedge_delay=0, deadline=1)
+        result = await aggregator.fetch(['BTC'], ['USD'])
+        self.assertEqual(result.rates, {})
+        self.assertEqual(result.stale, frozenset({'BTC', 'USD'}))
+        self.assertEqual(aggregator.stats()['hanging']['timeouts'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
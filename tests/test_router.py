@@ -0,0 +1,48 @@
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+from pymongo.errors import PyMongoError
+from tests.base import BaseCryptedTestCase
+from router import TriggerRouter
+
+
+class Stream:
+    """Change stream с одним изменением, после которого ждет следующих"""
+
+    def __init__(self, changed: asyncio.Event):
+        self.changed = changed
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def __aiter__(self):
+        yield {'operationType': 'update'}
+        self.changed.set()
+        await asyncio.Event().wait()
+
+
+class TestTriggerRouter(BaseCryptedTestCase):
+
+    @patch('router.asyncio.sleep', new_callable=AsyncMock)
+    @patch('router.DB')
+    async def test_watcher_reconnects_after_failure(self, mock_db, mock_sleep):
+        changed = asyncio.Event()
+        mock_db.responses.watch = MagicMock(side_effect=[PyMongoError('primary stepped down'), Stream(changed)])
+        router = TriggerRouter()
+        router.rebuild = AsyncMock()
+
+        await router.start_watching()
+        await asyncio.wait_for(changed.wait(), 1)
+        await router.stop_watching()
+
+        mock_sleep.assert_awaited_once_with(1)
+        # пересборка после переподключения и на изменение из потока
+        self.assertEqual(router.rebuild.await_count, 2)
+        self.assertTrue(router._watcher.cancelled())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, patch
+from tests.base import BaseCryptedTestCase
+from scheduler import Scheduler
+
+
+class TestScheduler(BaseCryptedTestCase):
+
+    async def test_runs_do_not_overlap(self):
+        scheduler = Scheduler(owner='test', leader_election=False)
+        started = asyncio.Event()
+        release = asyncio.Event()
+
+        async def slow():
+            started.set()
+            await release.wait()
+
+        job = scheduler.add('slow', slow, interval=60)
+        first = asyncio.create_task(scheduler.run_job(job))
+        await started.wait()
+        self.assertFalse(await scheduler.run_job(job))
+        release.set()
+        self.assertTrue(await first)
+        self.assertEqual((job.runs, job.skipped), (1, 1))
+
+    async def test_timeout_and_failure_are_counted(self):
+        scheduler = Scheduler(owner='test', leader_election=False)
+        hanging = scheduler.add('hanging', lambda: asyncio.sleep(10), interval=60, timeout=0.05)
+        broken = scheduler.add('broken', AsyncMock(side_effect=ValueError('boom')), interval=60)
+        await scheduler.run_job(hanging)
+        await scheduler.run_job(broken)
+        self.assertEqual(hanging.timeouts, 1)
+        self.assertEqual(broken.failures, 1)
+        self.assertFalse(hanging.running)
+
+    @patch('scheduler.acquire_lease', new_callable=AsyncMock)
+    async def test_only_leader_runs(self, mock_acquire_lease):
+        scheduler = Scheduler(owner='worker-2')
+        func = AsyncMock()
+        job = scheduler.add('rates', func, interval=60)
+        mock_acquire_lease.return_value = False
+        self.assertFalse(await scheduler.run_job(job))
+        mock_acquire_lease.return_value = True
+        self.assertTrue(await scheduler.run_job(job))
+        func.assert_awaited_once()
+        mock_acquire_lease.assert_awaited_with('job:rates', 'worker-2', job.lease_ttl)
+
+    def test_jitter(self):
+        scheduler = Scheduler(owner='test', leader_election=False)
+        job = scheduler.add('rates', AsyncMock(), interval=100, jitter=0.1)
+        for _ in range(20):
+            self.assertTrue(85 <= job.next_delay(elapsed=5) <= 105)
+        self.assertEqual(job.next_delay(elapsed=200), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
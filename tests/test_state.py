@@ -0,0 +1,65 @@
+import unittest
+from unittest.mock import AsyncMock, patch
+from tests.base import BaseCryptedTestCase
+from database.state import States, get_state, set_state, state_session
+
+
+class TestStateSession(BaseCryptedTestCase):
+
+    def setUp(self):
+        self.db = patch('database.state.DB').start()
+        self.db.states.find_one = AsyncMock(return_value={'user_id': 1, States.LAST_MESSAGE: 10, States.SELECTED: []})
+        self.db.states.update_one = AsyncMock()
+        self.addCleanup(patch.stopall)
+
+    async def test_state_is_loaded_once_per_session(self):
+        async with state_session(1):
+            self.assertEqual(await get_state(1, States.LAST_MESSAGE), 10)
+            self.assertEqual(await get_state(1, States.SELECTED), [])
+            self.assertEqual((await get_state(1))['user_id'], 1)
+        self.db.states.find_one.assert_awaited_once()
+
+    async def test_flush_writes_only_changed_keys_with_one_set(self):
+        async with state_session(1):
+            await set_state(1, States.SELECTED, ['wallet'])
+            await set_state(1, States.LAST_TRIGGER, 'wallet')
+            await set_state(1, States.SELECTED, ['wallet', 'BTC'])
+            # изменения видны внутри сессии до записи
+            self.assertEqual(await get_state(1, States.SELECTED), ['wallet', 'BTC'])
+            self.db.states.update_one.assert_not_awaited()
+
+        self.db.states.update_one.assert_awaited_once_with(
+            {'user_id': 1},
+            {'$set': {States.SELECTED: ['wallet', 'BTC'], States.LAST_TRIGGER: 'wallet'}},
+            upsert=True,
+        )
+
+    async def test_unchanged_session_does_not_write(self):
+        async with state_session(1):
+            await get_state(1, States.SELECTED)
+        self.db.states.update_one.assert_not_awaited()
+
+    async def test_session_is_discarded_on_exception(self):
+        with self.assertRaises(RuntimeError):
+            async with state_session(1):
+                await set_state(1, States.LAST_MESSAGE, 11)
+                raise RuntimeError('handler failed')
+        self.db.states.update_one.assert_not_awaited()
+
+    async def test_without_session_goes_to_db(self):
+        self.assertEqual(await get_state(1, States.LAST_MESSAGE), 10)
+        await set_state(1, States.LAST_MESSAGE, 12)
+        self.db.states.update_one.assert_awaited_once_with(
+            {'user_id': 1}, {'$set': {States.LAST_MESSAGE: 12}}, upsert=True
+        )
+
+        # сессия другого пользователя не перехватывает чужие чтения и записи
+        async with state_session(2):
+            await get_state(1, States.SELECTED)
+            await set_state(1, States.SELECTED, ['x'])
+        self.assertEqual(self.db.states.find_one.await_count, 3)
+        self.db.states.update_one.assert_awaited_with({'user_id': 1}, {'$set': {States.SELECTED: ['x']}}, upsert=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock, MagicMock, patch
+from tests.base import BaseCryptedTestCase
+from database.sweep import SweepStatus
+from money import Amount
+from sweeper import Sweeper
+from units.base import SignedTransaction, StaleTransaction
+from units.btc import Utxo
+
+HOT = {'user_id': 1, 'profile': {'wallet': {'BTC': {'address': 'hot'}, 'ETH': {'address': '0xhot'}}}}
+USERS = {
+    2: {'user_id': 2, 'profile': {'wallet': {'BTC': {'address': 'alice', 'private_key': 'ka'}, 'ETH': {'address': '0xa'}}}},
+    3: {'user_id': 3, 'profile': {'wallet': {'BTC': {'address': 'bob', 'private_key': 'kb'}}}},
+}
+UTXOS = {
+    'alice': [Utxo('t1', 0, 500_000, 'alice'), Utxo('t2', 1, 300_000, 'alice')],
+    'bob': [Utxo('t3', 0, 2_000, 'bob')],
+}
+
+
+async def fake_create(sweeps):
+    for index, sweep in enumerate(sweeps):
+        sweep.update(_id=index, status=SweepStatus.PENDING)
+    return sweeps
+
+
+async def fake_update(sweeps, **fields):
+    for sweep in sweeps:
+        sweep.update(fields)
+
+
+class TestSweeper(BaseCryptedTestCase):
+
+    def setUp(self):
+        self.unit = MagicMock()
+        patch('sweeper.registry').start().get.return_value = self.unit
+        patch('sweeper.get_hot_wallet', new_callable=AsyncMock, return_value=HOT).start()
+        patch('sweeper.get_user_by_id', new_callable=AsyncMock, side_effect=lambda user_id: USERS[user_id]).start()
+        self.active = patch('sweeper.get_active_sweeps', new_callable=AsyncMock, return_value=[]).start()
+        self.candidates = patch('sweeper.get_sweep_candidates', new_callable=AsyncMock).start()
+        self.create = patch('sweeper.create_sweeps', side_effect=fake_create).start()
+        patch('sweeper.update_sweeps', side_effect=fake_update).start()
+        patch('sweeper.balance_refresher', touch=AsyncMock()).start()
+        self.ledger = patch('sweeper.ledger_sweep', new_callable=AsyncMock).start()
+        self.sweeping = patch('sweeper.set_sweeping', new_callable=AsyncMock).start()
+        self.addCleanup(patch.stopall)
+        settings = {'threshold': '0', 'max_fee_ratio': 0.02, 'priority': 'low', 'limit': 10}
+        self.sweeper = Sweeper(chains={'BTC': settings, 'ETH': settings})
+
+    async def test_btc_addresses_are_swept_in_one_transaction(self):
+        self.candidates.return_value = [2, 3]
+        self.unit.fee_per_byte = AsyncMock(return_value=10)
+        self.unit.list_unspent = AsyncMock(side_effect=lambda address: UTXOS[address])
+        self.unit.sign_batch = AsyncMock(return_value=SignedTransaction(txid='sweeptx', raw='sweepraw'))
+        self.unit.broadcast = AsyncMock(return_value='sweeptx')
+
+        await self.sweeper.run_crypto('BTC')
+
+        # у bob комиссия за вход дороже доли от его суммы - адрес ждет следующего прохода
+        self.assertEqual(self.sweeper.stats()['BTC']['deferred'], 1)
+        inputs, outputs, fee, keys = self.unit.sign_batch.await_args.args
+        self.assertEqual([utxo.txid for utxo in inputs], ['t1', 't2'])
+        self.assertEqual(outputs, [('hot', 800_000 - fee)])
+        self.assertEqual(keys, {'alice': 'ka'})
+        [sweep] = self.create.call_args.args[0]
+        self.assertEqual((sweep['user_id'], sweep['amount'] + sweep['fee']), (2, Amount('BTC', 800_000)))
+        self.assertEqual((sweep['status'], sweep['txid']), (SweepStatus.BROADCAST, 'sweeptx'))
+        self.sweeping.assert_awaited_once_with('BTC', [2], True)
+
+    async def test_expensive_fee_defers_sweep(self):
+        self.candidates.return_value = [2]
+        self.unit.get_balance = AsyncMock(return_value=Amount('ETH', 1000))
+        self.unit.transfer_fee = AsyncMock(return_value=Amount('ETH', 100))
+        del self.unit.sign_batch
+
+        await self.sweeper.run_crypto('ETH')
+
+        self.unit.sign_coins.assert_not_called()
+        self.create.assert_not_called()
+
+    def sweep(self, **fields) -> dict:
+        return {
+            '_id': 'x',
+            'user_id': 2,
+            'address': '0xa',
+            'status': SweepStatus.BROADCAST,
+            'txid': '0xs',
+            'raw': '0xraw',
+            'amount': Amount('ETH', 900),
+            'fee': Amount('ETH', 100),
+            'created_at': datetime.now(timezone.utc),
+            **fields,
+        }
+
+    async def test_failed_broadcast_keeps_signed_sweep_pending(self):
+        self.candidates.return_value = [2]
+        self.unit.get_balance = AsyncMock(return_value=Amount('ETH', 10_000))
+        self.unit.transfer_fee = AsyncMock(return_value=Amount('ETH', 100))
+        self.unit.sign_coins = AsyncMock(return_value=SignedTransaction(txid='0xs', raw='0xraw'))
+        self.unit.broadcast = AsyncMock(side_effect=TimeoutError())
+        del self.unit.sign_batch
+
+        await self.sweeper.run_crypto('ETH')
+
+        [sweep] = self.create.call_args.args[0]
+        self.assertEqual((sweep['status'], sweep['txid'], sweep['raw']), (SweepStatus.PENDING, '0xs', '0xraw'))
+        # адрес остается исключенным из наблюдений, пока сбор не учтен или не отменен
+        self.sweeping.assert_awaited_once_with('ETH', [2], True)
+
+    async def test_pending_sweep_is_broadcast_again(self):
+        sweep = self.sweep(status=SweepStatus.PENDING)
+        self.active.return_value = [sweep]
+        self.unit.get_confirmations = AsyncMock(return_value=0)
+        self.unit.broadcast = AsyncMock(return_value='0xs')
+
+        await self.sweeper.confirm('ETH')
+
+        self.unit.broadcast.assert_awaited_once_with('0xraw')
+        self.assertEqual(sweep['status'], SweepStatus.BROADCAST)
+        self.ledger.assert_not_awaited()
+
+    async def test_stale_sweep_is_cancelled(self):
+        sweep = self.sweep(status=SweepStatus.PENDING)
+        self.active.return_value = [sweep]
+        self.unit.get_confirmations = AsyncMock(return_value=0)
+        self.unit.broadcast = AsyncMock(side_effect=StaleTransaction('nonce too low'))
+
+        await self.sweeper.confirm('ETH')
+
+        self.assertEqual(sweep['status'], SweepStatus.FAILED)
+        self.sweeping.assert_awaited_once_with('ETH', [2], False)
+
+    async def test_dropped_sweep_is_cancelled(self):
+        sweep = self.sweep(created_at=datetime.now(timezone.utc) - timedelta(hours=2))
+        self.active.return_value = [sweep]
+        self.unit.get_confirmations = AsyncMock(return_value=0)
+        self.unit.is_known = AsyncMock(return_value=False)
+        self.unit.discard = AsyncMock()
+
+        await self.sweeper.confirm('ETH')
+
+        self.unit.discard.assert_awaited_once_with('0xraw')
+        self.assertEqual((sweep['status'], sweep['error']), (SweepStatus.FAILED, 'dropped'))
+        self.sweeping.assert_awaited_once_with('ETH', [2], False)
+
+    async def test_recent_unknown_sweep_is_kept(self):
+        sweep = self.sweep()
+        self.active.return_value = [sweep]
+        self.unit.get_confirmations = AsyncMock(return_value=0)
+        self.unit.is_known = AsyncMock(return_value=False)
+
+        await self.sweeper.confirm('ETH')
+
+        self.assertEqual(sweep['status'], SweepStatus.BROADCAST)
+        self.sweeping.assert_not_awaited()
+
+    async def test_confirmed_sweep_is_credited_with_actual_fee(self):
+        sweep = self.sweep()
+        self.active.return_value = [sweep]
+        self.unit.get_confirmations = AsyncMock(return_value=1)
+        self.unit.get_transaction_fee = AsyncMock(return_value=Amount('ETH', 42))
+        self.unit.fetch_balances = AsyncMock(return_value={'0xa': Amount('ETH', 7)})
+
+        await self.sweeper.confirm('ETH')
+
+        self.ledger.assert_awaited_once_with(
+            user_id=2, crypto='ETH', amount=Amount('ETH', 942), balance=Amount('ETH', 7), ref='sweep:x'
+        )
+        self.assertEqual((sweep['status'], sweep['fee']), (SweepStatus.CONFIRMED, Amount('ETH', 42)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,8 +2,15 @@ from base64 import b64encode
 import unittest
 from unittest.mock import patch, AsyncMock
 from tests.base import BaseCryptedTestCase
+from money import Amount
+from units.btc import BTCUnit, Utxo, sha256d, tx_hash
 from units.ton import TONUnit
 
+# неподписанная транзакция: вход P2PKH и выход P2WPKH, в виде, который blockcypher отдает в tosign_tx
+PREV_SCRIPT = '1976a914' + 'bb' * 20 + '88ac'
+UNSIGNED_PREFIX = '0100000001' + 'aa' * 32 + '00000000'
+UNSIGNED_SUFFIX = 'ffffffff01e803000000000000160014' + 'cc' * 20 + '00000000'
+
 
 class TestTONUnit(BaseCryptedTestCase):
 
@@ -61,16 +68,14 @@ class TestTONUnit(BaseCryptedTestCase):
         self.assertEqual(keys['public'], 'fake_public_key')
         self.assertEqual(keys['secret'], 'fake_secret_key')
 
-    @patch('aiohttp.ClientSession.get')
+    @patch('http_client.HttpClient.get_json', new_callable=AsyncMock)
     @patch('database.db.DB.users.find_one', new_callable=AsyncMock)
-    async def test_get_balance(self, mock_find_one, mock_get):
+    async def test_get_balance(self, mock_find_one, mock_get_json):
         mock_find_one.return_value = {'user_id': 123}
-        mock_response = AsyncMock()
-        mock_response.json.return_value = {'ok': True, 'result': 1000000000}
-        mock_get.return_value.__aenter__.return_value = mock_response
+        mock_get_json.return_value = {'ok': True, 'result': 1000000000}
 
         balance = await self.ton_unit.get_balance('fake_address')
-        self.assertEqual(balance, 0.0)
+        self.assertEqual(balance, Amount('TON', 10**9))
 
     def test_estimate_transaction_size(self):
         size = self.ton_unit.estimate_transaction_size()
@@ -86,5 +91,45 @@ class TestTONUnit(BaseCryptedTestCase):
         self.assertIsNotNone(public)
         self.assertIsNotNone(secret)
 
+
+class TestBTCUnit(BaseCryptedTestCase):
+
+    @patch('units.btc.blockcypher.make_tx_signatures', return_value=['30' * 70])
+    @patch('http_client.HttpClient.post_json', new_callable=AsyncMock)
+    async def test_batch_is_signed_locally(self, mock_post_json, mock_signatures):
+        preimage = UNSIGNED_PREFIX + PREV_SCRIPT + UNSIGNED_SUFFIX + '01000000'
+        mock_post_json.return_value = {
+            'tx': {'inputs': [{'addresses': ['alice']}], 'outputs': [{'addresses': ['bob'], 'value': 1000}], 'fees': 10},
+            'tosign': [sha256d(bytes.fromhex(preimage)).hex()],
+            'tosign_tx': [preimage],
+        }
+        unit = BTCUnit(network='testnet')
+
+        signed = await unit.sign_batch([Utxo('aa' * 32, 0, 1010, 'alice')], [('bob', 1000)], 10, {'alice': '01' * 32})
+
+        # в отправку ничего не ушло: только сборка транзакции
+        self.assertEqual(mock_post_json.await_count, 1)
+        pubkey = mock_signatures.call_args.args[2][0]
+        script_sig = '47' + '30' * 70 + '01' + '21' + pubkey
+        self.assertEqual(signed.raw, UNSIGNED_PREFIX + '6a' + script_sig + UNSIGNED_SUFFIX)
+        self.assertEqual(signed.txid, tx_hash(signed.raw))
+
+    @patch('units.btc.DB')
+    async def test_master_key_is_provisioned_on_first_derivation(self, mock_db):
+        root = {'user_id': 1, 'profile': {'wallet': {'BTC': {'balance': 0}}}}
+        provisioned = {'user_id': 1, 'profile': {'wallet': {'BTC': {'address': 'root', 'private_key': 'master'}}}}
+        mock_db.users.find_one = AsyncMock(side_effect=[root, provisioned])
+        mock_db.users.update_one = AsyncMock()
+        unit = BTCUnit(network='testnet')
+        unit.generate_address = AsyncMock(return_value=('root', 'master'))
+
+        self.assertEqual(await unit._get_master_key(), 'master')
+
+        unit.generate_address.assert_awaited_once_with(1)
+        # ключ пишется, только если другой процесс не успел завести его раньше
+        query = mock_db.users.update_one.await_args.args[0]
+        self.assertEqual(query['profile.wallet.BTC.private_key'], {'$exists': False})
+
+
 if __name__ == '__main__':
     unittest.main()
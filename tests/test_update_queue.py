@@ -0,0 +1,52 @@
+import asyncio
+import unittest
+from tests.base import BaseCryptedTestCase
+from update_queue import UpdateQueue
+
+
+class TestUpdateQueue(BaseCryptedTestCase):
+
+    async def asyncSetUp(self):
+        self.processed = []
+        self.running = set()
+        self.overlaps = 0
+
+        async def handler(update):
+            if update['user_id'] in self.running:
+                self.overlaps += 1
+            self.running.add(update['user_id'])
+            await asyncio.sleep(update.get('delay', 0))
+            self.running.discard(update['user_id'])
+            self.processed.append((update['user_id'], update['n']))
+
+        self.queue = UpdateQueue(handler=handler, workers=4)
+        await self.queue.start()
+
+    async def test_per_user_order(self):
+        for n in range(5):
+            for user_id in (1, 2, 3):
+                self.queue.put(user_id, {'user_id': user_id, 'n': n, 'delay': 0.01 * (3 - n % 3)})
+        await self.queue.stop()
+
+        self.assertEqual(self.overlaps, 0)
+        for user_id in (1, 2, 3):
+            self.assertEqual([n for uid, n in self.processed if uid == user_id], list(range(5)))
+
+    async def test_stats(self):
+        self.queue.put(1, {'user_id': 1, 'n': 0})
+        self.assertEqual(self.queue.stats()['depth'], 1)
+        await self.queue.stop()
+        stats = self.queue.stats()
+        self.assertEqual(stats['depth'], 0)
+        self.assertEqual(stats['processed'], 1)
+
+    async def test_overflow(self):
+        self.queue.max_size = 1
+        self.assertTrue(self.queue.put(1, {'user_id': 1, 'n': 0}))
+        self.assertFalse(self.queue.put(2, {'user_id': 2, 'n': 0}))
+        await self.queue.stop()
+        self.assertEqual(self.queue.stats()['dropped'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
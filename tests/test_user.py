@@ -0,0 +1,49 @@
+import unittest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+from tests.base import BaseCryptedTestCase
+from database.user import provision_wallets, update_or_create_user
+
+
+class TestUserProvisioning(BaseCryptedTestCase):
+
+    def setUp(self):
+        self.db = patch('database.user.DB').start()
+        self.db.users.update_one = AsyncMock()
+        self.pool = patch('database.user.address_pool').start()
+        self.pool.claim_wallet = AsyncMock(return_value={'TON': {'address': 'ton1', 'private_key': 'k'}})
+        self.addCleanup(patch.stopall)
+
+    async def test_provision_only_missing(self):
+        user = {'user_id': 5, 'profile': {'wallet': {'TON': {'balance': 0}, 'ETH': {'address': 'eth1'}}}}
+
+        wallet = await provision_wallets(user, ['TON', 'ETH'])
+
+        self.pool.claim_wallet.assert_awaited_once_with(5, ['TON'])
+        self.assertEqual(wallet['TON']['address'], 'ton1')
+        update = self.db.users.update_one.call_args.args[1]
+        self.assertEqual(
+            update, {'$set': {'profile.wallet.TON.address': 'ton1', 'profile.wallet.TON.private_key': 'k'}}
+        )
+
+        self.db.users.update_one.reset_mock()
+        await provision_wallets(user, ['TON'])
+        self.db.users.update_one.assert_not_awaited()
+
+    @patch('database.user.get_user_by_id', new_callable=AsyncMock)
+    async def test_unchanged_user_is_not_rewritten(self, mock_get_user):
+        from_user = SimpleNamespace(id=5, username='u', first_name='F', last_name=None, language_code='ru')
+        mock_get_user.return_value = {'user_id': 5, 'username': 'u', 'first_name': 'F', 'last_name': None, 'language_code': 'ru'}
+        update = SimpleNamespace(message=SimpleNamespace(from_user=from_user, date=None), callback_query=None)
+
+        await update_or_create_user(update)
+        self.db.users.update_one.assert_not_awaited()
+
+        from_user.username = 'renamed'
+        await update_or_create_user(update)
+        self.assertEqual(self.db.users.update_one.call_args.args[1], {'$set': {'username': 'renamed', 'updated_at': None}})
+        self.pool.claim_wallet.assert_not_awaited()
+
+
+if __name__ == '__main__':
+    unittest.main()
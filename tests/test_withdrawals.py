@@ -0,0 +1,199 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock, MagicMock, patch
+from tests.base import BaseCryptedTestCase
+from database.withdrawal import WithdrawalStatus
+from money import Amount
+from units.base import SignedTransaction, StaleTransaction
+from withdrawals import WithdrawalWorker
+
+
+async def fake_update(withdrawal, owner, **fields):
+    withdrawal.update(fields)
+    return True
+
+
+class TestWithdrawalWorker(BaseCryptedTestCase):
+
+    def setUp(self):
+        self.unit = MagicMock()
+        self.unit.sign_coins = AsyncMock(return_value=SignedTransaction(txid='0xabc', raw='0xraw'))
+        self.unit.broadcast = AsyncMock(return_value='0xabc')
+        self.unit.get_confirmations = AsyncMock(return_value=0)
+        self.unit.is_known = AsyncMock(return_value=False)
+        self.unit.discard = AsyncMock()
+        self.unit.fetch_balances = AsyncMock(return_value={'0xfrom': Amount('ETH', 20)})
+        patch('withdrawals.registry').start().get.return_value = self.unit
+        patch('withdrawals.update_withdrawal', side_effect=fake_update).start()
+        user = {'user_id': 7, 'profile': {'wallet': {'ETH': {'address': '0xfrom'}}}}
+        patch('withdrawals.get_user_by_id', new_callable=AsyncMock, return_value=user).start()
+        patch('withdrawals.balance_refresher', touch=AsyncMock()).start()
+        self.debit = patch('withdrawals.debit', new_callable=AsyncMock).start()
+        self.release = patch('withdrawals.release', new_callable=AsyncMock).start()
+        self.spend = patch('withdrawals.ledger_spend', new_callable=AsyncMock).start()
+        self.addCleanup(patch.stopall)
+        self.worker = WithdrawalWorker(max_attempts=2, chains={'ETH': {'concurrency': 1, 'confirmations': 3}})
+
+    def withdrawal(self, **fields):
+        return {
+            '_id': 1,
+            'key': 'k',
+            'user_id': 7,
+            'crypto': 'ETH',
+            'address': '0xto',
+            'amount': Amount('ETH', 100),
+            'fee': Amount('ETH', 5),
+            'status': WithdrawalStatus.QUEUED,
+            'attempts': 0,
+            **fields,
+        }
+
+    async def test_queued_job_is_signed_broadcast_and_waits_for_confirmations(self):
+        withdrawal = self.withdrawal()
+
+        await self.worker.process(withdrawal)
+
+        self.assertEqual(withdrawal['status'], WithdrawalStatus.BROADCAST)
+        self.unit.broadcast.assert_awaited_once_with('0xraw')
+        self.debit.assert_awaited_once_with(
+            user_id=7, crypto='ETH', amount=Amount('ETH', 105), ref='withdrawal:k', hot=False
+        )
+
+        self.unit.get_confirmations.return_value = 3
+        await self.worker.process(withdrawal)
+        self.assertEqual(withdrawal['status'], WithdrawalStatus.CONFIRMED)
+        self.assertEqual(self.worker.stats()[WithdrawalStatus.CONFIRMED], 1)
+        # списание повторяется перед подтверждением и не задваивается благодаря ref
+        self.assertEqual(self.debit.await_count, 2)
+        self.assertEqual(self.debit.await_args_list[0], self.debit.await_args_list[1])
+        # отправленная сумма снимается с outgoing вместе с балансом адреса после списания
+        self.spend.assert_awaited_once_with(
+            user_id=7, crypto='ETH', amount=Amount('ETH', 105), balance=Amount('ETH', 20), ref='withdrawal:k'
+        )
+
+    async def test_swept_chain_pays_from_hot_wallet(self):
+        hot_wallet = {'user_id': 1, 'profile': {'wallet': {'ETH': {'address': '0xhot'}}}}
+        patch('withdrawals.get_hot_wallet', new_callable=AsyncMock, return_value=hot_wallet).start()
+        self.worker.hot = {'ETH'}
+        withdrawal = self.withdrawal()
+
+        await self.worker.process(withdrawal)
+
+        self.assertIs(self.unit.sign_coins.await_args.args[0], hot_wallet)
+        self.assertTrue(withdrawal['hot'])
+        self.assertTrue(self.debit.await_args.kwargs['hot'])
+
+    async def test_signed_job_rebroadcasts_same_transaction(self):
+        withdrawal = self.withdrawal(status=WithdrawalStatus.SIGNED, txid='0xabc', raw='0xraw')
+        await self.worker.process(withdrawal)
+        self.unit.sign_coins.assert_not_awaited()
+        self.unit.broadcast.assert_awaited_once_with('0xraw')
+
+    async def test_failed_broadcast_releases_hold_after_max_attempts(self):
+        self.unit.broadcast.side_effect = ConnectionError('node is down')
+        withdrawal = self.withdrawal()
+
+        await self.worker.process(withdrawal)
+        self.assertEqual(withdrawal['status'], WithdrawalStatus.SIGNED)
+        self.assertEqual(withdrawal['attempts'], 1)
+        self.release.assert_not_awaited()
+
+        await self.worker.process(withdrawal)
+        self.assertEqual(withdrawal['status'], WithdrawalStatus.FAILED)
+        self.release.assert_awaited_once_with(user_id=7, crypto='ETH', amount=Amount('ETH', 105), ref='withdrawal:k')
+        self.debit.assert_not_awaited()
+        # nonce неотправленной транзакции освобождается
+        self.unit.discard.assert_awaited_once_with('0xraw')
+
+    async def test_transaction_in_mempool_is_not_released(self):
+        self.unit.broadcast.side_effect = ConnectionError('timeout after the node accepted it')
+        self.unit.is_known.return_value = True
+        withdrawal = self.withdrawal(status=WithdrawalStatus.SIGNED, txid='0xabc', raw='0xraw', attempts=1)
+
+        await self.worker.process(withdrawal)
+
+        self.assertEqual(withdrawal['status'], WithdrawalStatus.BROADCAST)
+        self.release.assert_not_awaited()
+        self.debit.assert_awaited_once()
+
+    async def test_unverifiable_transaction_is_left_for_reconciliation(self):
+        self.unit.broadcast.side_effect = ConnectionError('node is down')
+        self.unit.is_known.return_value = None
+        withdrawal = self.withdrawal(status=WithdrawalStatus.SIGNED, txid='0xabc', raw='0xraw', attempts=1)
+
+        await self.worker.process(withdrawal)
+
+        self.assertEqual(withdrawal['status'], WithdrawalStatus.FAILED)
+        self.release.assert_not_awaited()
+
+    async def test_one_shot_chain_fails_without_retry(self):
+        self.unit.sign_coins.return_value = None
+        self.unit.send_coins = AsyncMock(return_value=None)
+        withdrawal = self.withdrawal()
+
+        await self.worker.process(withdrawal)
+
+        self.assertEqual(withdrawal['status'], WithdrawalStatus.FAILED)
+        self.unit.send_coins.assert_awaited_once()
+        self.release.assert_awaited_once()
+
+    async def test_one_shot_exception_keeps_hold(self):
+        # исключение из send_coins - не отказ сети: монеты могли уйти
+        self.unit.sign_coins.return_value = None
+        self.unit.send_coins = AsyncMock(side_effect=TimeoutError())
+        withdrawal = self.withdrawal()
+
+        await self.worker.process(withdrawal)
+
+        self.assertEqual(withdrawal['status'], WithdrawalStatus.FAILED)
+        self.release.assert_not_awaited()
+
+    async def test_stale_transaction_is_signed_again(self):
+        self.unit.broadcast.side_effect = StaleTransaction('nonce too low')
+        withdrawal = self.withdrawal(status=WithdrawalStatus.SIGNED, txid='0xabc', raw='0xraw')
+
+        await self.worker.process(withdrawal)
+
+        self.assertEqual(withdrawal['status'], WithdrawalStatus.QUEUED)
+        self.assertIsNone(withdrawal['raw'])
+        self.debit.assert_not_awaited()
+
+    async def test_stuck_transaction_is_replaced(self):
+        self.unit.bump = AsyncMock(return_value=SignedTransaction(txid='0xdef', raw='0xbumped'))
+        broadcast_at = datetime.now(timezone.utc) - timedelta(hours=1)
+        withdrawal = self.withdrawal(status=WithdrawalStatus.BROADCAST, txid='0xabc', raw='0xraw', broadcast_at=broadcast_at)
+
+        await self.worker.process(withdrawal)
+
+        self.unit.broadcast.assert_awaited_once_with('0xbumped')
+        self.assertEqual((withdrawal['txid'], withdrawal['replaced'], withdrawal['bumps']), ('0xdef', ['0xabc'], 1))
+        # комиссия замены с адреса пользователя ограничена замороженной под нее суммой
+        self.assertEqual(self.unit.bump.await_args.kwargs['max_fee'], Amount('ETH', 5))
+
+        # в блок попала исходная транзакция
+        self.unit.get_confirmations.side_effect = lambda txid: 3 if txid == '0xabc' else 0
+        await self.worker.process(withdrawal)
+        self.assertEqual((withdrawal['status'], withdrawal['txid']), (WithdrawalStatus.CONFIRMED, '0xabc'))
+
+
+class TestWithdrawalReaper(BaseCryptedTestCase):
+
+    def setUp(self):
+        jobs = [{'_id': 1, 'key': 'held', 'crypto': 'ETH'}, {'_id': 2, 'key': 'lost', 'crypto': 'ETH'}]
+        patch('withdrawals.get_inactive_withdrawals', new_callable=AsyncMock, return_value=jobs).start()
+        held = lambda ref, kind: ref == 'withdrawal:held'
+        patch('withdrawals.has_entry', new_callable=AsyncMock, side_effect=held).start()
+        self.activate = patch('withdrawals.activate_withdrawal', new_callable=AsyncMock).start()
+        self.delete = patch('withdrawals.delete_withdrawal', new_callable=AsyncMock).start()
+        self.addCleanup(patch.stopall)
+        self.worker = WithdrawalWorker(chains={'ETH': {}})
+
+    async def test_inactive_jobs_are_activated_or_deleted_by_hold(self):
+        await self.worker.reap('ETH')
+        # задание с холдом уходит воркерам, без холда - удаляется: средства пользователя не заморожены
+        self.activate.assert_awaited_once_with(1)
+        self.delete.assert_awaited_once_with(2)
+
+
+if __name__ == '__main__':
+    unittest.main()
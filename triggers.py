@@ -23,6 +23,7 @@ class WalletTriggers(CheckTriggers, BillTriggers):
     WALLET = 'wallet'
     REPLENISH = 'replenish'
     WITHDRAW = 'withdraw'
+    FEES = 'fees'
 
 class Triggers(BaseTriggers, WalletTriggers):
     WALLET = 'wallet'
@@ -38,4 +39,8 @@ def get_all_triggers(cls):
         for key, value in vars(base_class).items():
             if not key.startswith('__') and not callable(value):
                 triggers.append(value)
-    return triggers
\ No newline at end of file
+    return triggers
+
+
+# все триггеры бота, вычисляются один раз при импорте
+ALL_TRIGGERS = frozenset(get_all_triggers(Triggers))
@@ -1,7 +1,35 @@
+import hashlib
+import hmac
 from abc import ABC, abstractmethod
 from decimal import Decimal
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from money import Amount
+from settings.common import ADDRESS_POOL_SECRET, FEE_PRIORITY_MULTIPLIERS
+
+
+def balance_cache_key(unit: 'Unit', address: str) -> tuple:
+    # один кэш на все экземпляры юнита, поэтому сеть входит в ключ
+    return unit.crypto, unit.network, address
+
+
+def pool_seed(crypto: str, index: int) -> bytes:
+    """32 байта секрета для адреса пула с номером index: HMAC по ключу из настроек, а не хэш от user_id"""
+    if not ADDRESS_POOL_SECRET:
+        raise RuntimeError('ADDRESS_POOL_SECRET is not set')
+    return hmac.new(ADDRESS_POOL_SECRET.encode(), f'{crypto}:{index}'.encode(), hashlib.sha256).digest()
+
+
+class StaleTransaction(Exception):
+    """Подписанная транзакция уже не попадет в сеть (nonce занят), ее нужно подписать заново"""
+    pass
+
+
+class SignedTransaction(NamedTuple):
+    """Подписанная, но еще не отправленная транзакция: raw можно безопасно отправлять повторно"""
+    txid: str
+    raw: Any
 
-from database.db import DB
 
 class Unit(ABC):
     crypto = None
@@ -15,31 +43,89 @@ class Unit(ABC):
         pass
 
     @abstractmethod
-    async def get_balance(self, address: str) -> float:
+    async def get_balance(self, address: str) -> Optional[Amount]:
+        """Баланс адреса в сети, None - если провайдер не ответил"""
+        pass
+
+    @abstractmethod
+    async def fetch_balances(self, addresses: List[str]) -> Dict[str, Amount]:
+        """Балансы пачки адресов в сети (без учета холдов) одним батч-запросом к провайдеру"""
         pass
 
     @abstractmethod
-    async def get_network_fee(self) -> dict:
+    async def estimate_fees(self) -> Dict[str, Decimal]:
+        """Комиссия за один перевод в монетах сети по приоритетам low/medium/high"""
         pass
 
+    @staticmethod
+    def tiered_fees(fee: Decimal, market: bool = True) -> Dict[str, Decimal]:
+        # для сетей без рынка комиссий (фиксированная плата) все приоритеты стоят одинаково
+        return {
+            priority: fee * Decimal(str(multiplier)) if market else fee
+            for priority, multiplier in FEE_PRIORITY_MULTIPLIERS.items()
+        }
+
     @abstractmethod
     async def generate_address(self, user_id: int) -> tuple:
         pass
 
     @abstractmethod
-    async def send_coins(self, user: dict, to_address: str, amount: float) -> str:
+    async def derive_address(self, index: int) -> tuple:
+        """(адрес, приватный ключ строкой) для адреса пула с номером index"""
+        pass
+
+    @abstractmethod
+    async def send_coins(self, user: dict, to_address: str, amount: Amount) -> str:
+        pass
+
+    async def sign_coins(
+        self, user: dict, to_address: str, amount: Amount, priority: str = 'medium'
+    ) -> Optional[SignedTransaction]:
+        """Подпись без отправки; None - сеть подписывает и отправляет одним вызовом send_coins"""
+        return None
+
+    async def transfer_fee(self, priority: str = 'medium') -> Amount:
+        """Наибольшая комиссия простого перевода, подписанного sign_coins с этим приоритетом"""
+        return Amount.of(self.crypto, (await self.estimate_fees())[priority])
+
+    async def get_transaction_fee(self, txid: str) -> Optional[Amount]:
+        """Фактически списанная комиссия транзакции в блоке; None - сеть не умеет это проверять"""
+        return None
+
+    @abstractmethod
+    async def broadcast(self, raw) -> str:
+        """Отправка подписанной sign_coins транзакции; повторная отправка той же транзакции не ошибка"""
+        pass
+
+    async def bump(self, user: dict, raw, max_fee: Optional[Amount] = None) -> Optional[SignedTransaction]:
+        """
+        Та же транзакция с повышенной комиссией взамен зависшей, комиссия не выше max_fee;
+        None - сеть замену не поддерживает или замена в max_fee не укладывается
+        """
+        return None
+
+    async def discard(self, raw):
+        """Подписанная транзакция не будет отправлена: освободить то, что она заняла при подписи (nonce)"""
+        pass
+
+    async def get_confirmations(self, txid: str) -> Optional[int]:
+        """Сколько подтверждений у транзакции, 0 - еще не в блоке; None - сеть не умеет это проверять"""
+        return None
+
+    async def is_known(self, txid: str) -> Optional[bool]:
+        """Знает ли сеть транзакцию (в мемпуле или в блоке); False - неизвестна или вытеснена другой"""
+        return None
+
+    async def open(self):
+        """Подготовка долгоживущих соединений экземпляра из реестра"""
+        pass
+
+    async def close(self):
         pass
 
-    async def has_sufficient_balance(self, address: str, amount: float) -> tuple:
-        balance = await self.get_balance(address)
-        fee_info = await DB.network_fees.find_one({'crypto': self.crypto})
-        network_fee = fee_info['network_fee']
-        fee = self.from_satoshis(network_fee * self.estimate_transaction_size())
-        return balance >= Decimal(amount) + Decimal(fee), round(Decimal(fee), 5)
-    
-    async def get_hold(self, user_id: int, crypto: str) -> float:
-        user = await DB.users.find_one({'user_id': user_id})
-        return float(user['profile']['wallet'][crypto]['hold'])
+    async def health_check(self) -> bool:
+        """Легкий запрос к ноде, чтобы убедиться, что клиент рабочий"""
+        return True
 
     @abstractmethod
     def estimate_transaction_size(self) -> int:
@@ -1,17 +1,47 @@
 from decimal import Decimal
+import hashlib
 import logging
 from traceback import print_tb
-from typing import Optional
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import aiohttp
+from bitcoin import compress, deserialize, privkey_to_pubkey, serialize, serialize_script
 from bitmerchant.wallet import Wallet
 from bitmerchant.network import BitcoinMainNet, BitcoinTestNet
 import blockcypher
 from database.db import DB
 from settings.common import CRYPTO_SETTINGS, BTC, ROOT_ID
-from units.base import Unit
-import hashlib
-import base58
+from units.base import SignedTransaction, Unit, balance_cache_key
+from units.clients import get_chain_client
+from validators.address import validate_address
+
+from decorators import async_cache
+from http_client import http_client
+from money import Amount
+
+# адреса пула выводятся по пути m/0'/index', адреса по user_id - по m/user_id'
+POOL_BRANCH = 0
+
+# размеры частей P2PKH транзакции в байтах и минимальный выход, который сеть пропускает
+TX_OVERHEAD_SIZE = 10
+INPUT_SIZE = 148
+OUTPUT_SIZE = 34
+DUST_LIMIT = 546
+
+
+def sha256d(data: bytes) -> bytes:
+    return hashlib.sha256(hashlib.sha256(data).digest()).digest()
+
+
+def tx_hash(raw: str) -> str:
+    # txid - двойной sha256 транзакции без свидетелей в обратном порядке байт
+    return sha256d(bytes.fromhex(raw))[::-1].hex()
+
 
-from decorators import timed_cache
+class Utxo(NamedTuple):
+    txid: str
+    index: int
+    value: int
+    address: str
 
 
 class BTCUnit(Unit):
@@ -20,14 +50,29 @@ class BTCUnit(Unit):
         self.network = network
         self.symbol = 'bcy' if self.network == 'testnet' else 'btc'
         self.api_token = CRYPTO_SETTINGS[BTC]['api_key']
+        self.client = get_chain_client(BTC)
     
-    def _add_faucet_coins(self, address):
-        faucet_tx = blockcypher.send_faucet_coins(
+    async def _add_faucet_coins(self, address):
+        faucet_tx = await self.client.call(
+            blockcypher.send_faucet_coins,
             address_to_fund=address, satoshis=1000000, coin_symbol=self.symbol, api_key=self.api_token
         )
         logging.info("Faucet txid is", faucet_tx['tx_ref'])
 
     async def _get_master_key(self):
+        master_user = await DB.users.find_one({'user_id': ROOT_ID})
+        if master_user is None:
+            raise LookupError(f'Root user {ROOT_ID} does not exist, BTC addresses cannot be derived')
+        private_key = master_user['profile']['wallet'].get(BTC, {}).get('private_key')
+        if private_key:
+            return private_key
+        # кошельки корневого пользователя выдаются лениво: первая деривация заводит мастер-ключ сама.
+        # Ключ записывается, только если его еще нет, - при гонке процессы берут ключ победителя
+        address, private_key = await self.generate_address(ROOT_ID)
+        await DB.users.update_one(
+            {'user_id': ROOT_ID, f'profile.wallet.{BTC}.private_key': {'$exists': False}},
+            {'$set': {f'profile.wallet.{BTC}.address': address, f'profile.wallet.{BTC}.private_key': private_key}},
+        )
         master_user = await DB.users.find_one({'user_id': ROOT_ID})
         return master_user['profile']['wallet'][BTC]['private_key']
 
@@ -40,78 +85,80 @@ class BTCUnit(Unit):
     
     async def generate_address(self, user_id: int) -> tuple:
         if user_id == ROOT_ID:
-            keypair = blockcypher.generate_new_address(coin_symbol=self.symbol, api_key=self.api_token)
+            keypair = await self.client.call(
+                blockcypher.generate_new_address, coin_symbol=self.symbol, api_key=self.api_token
+            )
             public_address = keypair['address']
             private_key = keypair['private']
-            self._add_faucet_coins(address=public_address)
+            await self._add_faucet_coins(address=public_address)
         else:
-            network = BitcoinTestNet if self.network == 'testnet' else BitcoinMainNet
-            master_key = self._get_master_key()
-            master_wallet = Wallet.from_master_secret(master_key, network=network)
-            user_wallet = master_wallet.get_child(user_id, is_prime=True)
-            public_address = user_wallet.to_address()
-            private_key = user_wallet.export_to_wif()
+            master_key = await self._get_master_key()
+            # HD деривация - чистая математика на python, в event loop ее не выполняем
+            public_address, private_key = await self.client.call(self._derive_child, master_key, user_id)
         return public_address, private_key
 
-    def validate_address(self, address: str) -> bool:
-        try:
-            if not blockcypher.api.is_valid_address_for_coinsymbol(address, coin_symbol=self.symbol):
-                raise ValueError(f"Invalid address ")
-
-            # Decode the address using base58
-            decoded_address = base58.b58decode(address)
-
-            # The address should be 25 bytes long (1 byte network + 20 bytes hash + 4 bytes checksum)
-            if len(decoded_address) != 25:
-                return False
+    async def derive_address(self, index: int) -> tuple:
+        master_key = await self._get_master_key()
+        return await self.client.call(self._derive_child, master_key, index, POOL_BRANCH)
 
-            # Separate the checksum and the address
-            network_byte_and_hash = decoded_address[:-4]
-            checksum = decoded_address[-4:]
+    def _derive_child(self, master_key: str, index: int, branch: Optional[int] = None) -> tuple:
+        network = BitcoinTestNet if self.network == 'testnet' else BitcoinMainNet
+        parent_wallet = Wallet.from_master_secret(master_key, network=network)
+        if branch is not None:
+            parent_wallet = parent_wallet.get_child(branch, is_prime=True)
+        child_wallet = parent_wallet.get_child(index, is_prime=True)
+        return child_wallet.to_address(), child_wallet.export_to_wif()
 
-            # Perform SHA-256 hash twice
-            sha256_1 = hashlib.sha256(network_byte_and_hash).digest()
-            sha256_2 = hashlib.sha256(sha256_1).digest()
+    async def health_check(self) -> bool:
+        overview = await self.client.call(
+            blockcypher.get_blockchain_overview, coin_symbol=self.symbol, api_key=self.api_token
+        )
+        return bool(overview.get('height'))
 
-            # Validate the checksum
-            if sha256_2[:4] == checksum:
-                return True
-            else:
-                return False
-        except Exception as e:
-            # If any exception occurs during decoding or hashing, the address is invalid
-            return False
+    def validate_address(self, address: str) -> bool:
+        # base58check и bech32/bech32m разбираются локально, без запросов к blockcypher
+        return validate_address(BTC, address, self.network)
 
-    @timed_cache(seconds=30)
-    async def get_balance(self, address: str) -> Optional[float]:
+    @async_cache(ttl=30, key=balance_cache_key)
+    async def get_balance(self, address: str) -> Optional[Amount]:
         # self._add_faucet_coins(address=address)
         try:
-            address_overview = blockcypher.get_address_overview(
+            address_overview = await self.client.call(
+                blockcypher.get_address_overview,
                 address=address,
                 coin_symbol=self.symbol,
                 api_key=self.api_token
             )
-            user = await DB.users.find_one({f'profile.wallet.{BTC}.address': address})
-            balance =  address_overview['final_balance'] / Decimal(1e8)
-            return float(balance) - await self.get_hold(user_id=user['user_id'], crypto=BTC)
-        
+            return Amount(BTC, address_overview['final_balance'])
+
         except Exception as e:
             print(f"[{BTC}] Error fetching balance: {e}")
             print_tb(e.__traceback__)
             return None
 
-    async def get_network_fee(self) -> float:
-        try:
-            fees = blockcypher.get_blockchain_fee_estimates(coin_symbol=self.symbol, api_key=self.api_token)
-            return fees['medium_fee_per_kb']
-        except Exception as e:
-            print(f"Error fetching network fees: {e}")
-            return {}
+    async def fetch_balances(self, addresses: List[str]) -> Dict[str, Amount]:
+        # batch-эндпоинт blockcypher: адреса через ';' в одном запросе
+        url = f'{self.api_url}/addrs/{";".join(addresses)}/balance'
+        params = {'token': self.api_token} if self.api_token else None
+        data = await self.client.wait(http_client.get_json(url, params=params))
+        if isinstance(data, dict):
+            data = [data]
+        return {item['address']: Amount(BTC, item['final_balance']) for item in data if 'address' in item}
+
+    async def estimate_fees(self) -> Dict[str, Decimal]:
+        fees = await self.client.call(
+            blockcypher.get_blockchain_fee_estimates, coin_symbol=self.symbol, api_key=self.api_token
+        )
+        size = Decimal(str(self.estimate_transaction_size()))
+        return {
+            priority: Decimal(fees[f'{priority}_fee_per_kb']) * size / Decimal(10**8)
+            for priority in ('low', 'medium', 'high')
+        }
 
-    async def send_coins(self, user: dict, to_address: str, amount: float) -> str:
-        # Convert the amount from BTC to satoshis
-        amount_satoshi = int(amount * Decimal(1e8))
-        tx_ref = blockcypher.simple_spend(
+    async def send_coins(self, user: dict, to_address: str, amount: Amount) -> str:
+        amount_satoshi = amount.units
+        tx_ref = await self.client.call(
+            blockcypher.simple_spend,
             from_privkey=user['profile']['wallet'][BTC]['private_key'],
             to_address=to_address,
             to_satoshis=amount_satoshi,
@@ -121,6 +168,97 @@ class BTCUnit(Unit):
         print("Txid is", tx_ref)
         return tx_ref
 
+    @property
+    def api_url(self) -> str:
+        chain = 'test' if self.network == 'testnet' else 'main'
+        return f'https://api.blockcypher.com/v1/{self.symbol}/{chain}'
+
+    async def list_unspent(self, address: str) -> List[Utxo]:
+        """Подтвержденные непотраченные выходы адреса"""
+        details = await self.client.call(
+            blockcypher.get_address_details, address, coin_symbol=self.symbol, api_key=self.api_token, unspent_only=True
+        )
+        return [
+            Utxo(txid=ref['tx_hash'], index=ref['tx_output_n'], value=ref['value'], address=address)
+            for ref in details.get('txrefs', [])
+        ]
+
+    async def fee_per_byte(self, priority: str = 'medium') -> int:
+        fees = await self.client.call(
+            blockcypher.get_blockchain_fee_estimates, coin_symbol=self.symbol, api_key=self.api_token
+        )
+        return max(1, fees[f'{priority}_fee_per_kb'] // 1000)
+
+    async def sign_batch(
+        self, inputs: List[Utxo], outputs: List[Tuple[str, int]], fee: int, keys: Dict[str, str]
+    ) -> SignedTransaction:
+        """
+        Одна транзакция из выбранных выходов нескольких адресов на несколько получателей.
+        Комиссия задается явно, сдача уже включена в outputs, поэтому blockcypher не добавляет своих выходов.
+        keys - приватные ключи адресов входов. Транзакция собирается и подписывается без отправки:
+        txid известен заранее, и после сбоя отправка повторяется той же транзакцией.
+        """
+        params = {'token': self.api_token, 'includeToSignTx': 'true'}
+        skeleton = {
+            'inputs': [{'prev_hash': utxo.txid, 'output_index': utxo.index} for utxo in inputs],
+            'outputs': [{'addresses': [address], 'value': value} for address, value in outputs],
+            'fees': fee,
+        }
+        unsigned_tx = await self.client.wait(
+            http_client.post_json(f'{self.api_url}/txs/new', json=skeleton, params=params)
+        )
+        if unsigned_tx.get('errors'):
+            raise ValueError(f"Batch transaction rejected: {unsigned_tx['errors']}")
+        built = sorted((output['addresses'][0], output['value']) for output in unsigned_tx['tx']['outputs'])
+        if built != sorted(outputs) or unsigned_tx['tx']['fees'] != fee:
+            raise ValueError('Batch transaction does not match requested outputs')
+        # tosign - хэши tosign_tx: транзакции с кодом скрипта подписываемого входа и типом подписи в конце
+        if [sha256d(bytes.fromhex(preimage)).hex() for preimage in unsigned_tx['tosign_tx']] != unsigned_tx['tosign']:
+            raise ValueError('Batch transaction does not match its signing data')
+
+        privkeys, pubkeys = [], []
+        for tx_input in unsigned_tx['tx']['inputs']:
+            privkey = keys[tx_input['addresses'][0]]
+            privkeys.append(privkey)
+            pubkeys.append(compress(privkey_to_pubkey(privkey)))
+        signatures = await self.client.call(blockcypher.make_tx_signatures, unsigned_tx['tosign'], privkeys, pubkeys)
+        # без 4 байт типа подписи остается неподписанная транзакция, в ее входы ставятся подписи P2PKH
+        tx = deserialize(unsigned_tx['tosign_tx'][0][:-8])
+        for tx_input, signature, pubkey in zip(tx['ins'], signatures, pubkeys):
+            tx_input['script'] = serialize_script([signature + '01', pubkey])
+        raw = serialize(tx)
+        return SignedTransaction(txid=tx_hash(raw), raw=raw)
+
+    async def broadcast(self, raw: str) -> str:
+        try:
+            sent = await self.client.wait(
+                http_client.post_json(
+                    f'{self.api_url}/txs/push', json={'tx': raw}, params={'token': self.api_token}, retries=0
+                )
+            )
+        except aiohttp.ClientResponseError:
+            # повторную отправку той же транзакции blockcypher отклоняет, хотя она уже в сети
+            txid = tx_hash(raw)
+            if await self.is_known(txid):
+                return txid
+            raise
+        if sent.get('errors') or sent.get('error'):
+            raise ValueError(f"Broadcast failed: {sent.get('errors') or sent.get('error')}")
+        return sent['tx']['hash']
+
+    async def get_confirmations(self, txid: str) -> int:
+        details = await self.client.call(
+            blockcypher.get_transaction_details, txid, coin_symbol=self.symbol, api_key=self.api_token
+        )
+        return details.get('confirmations', 0)
+
+    async def is_known(self, txid: str) -> bool:
+        details = await self.client.call(
+            blockcypher.get_transaction_details, txid, coin_symbol=self.symbol, api_key=self.api_token
+        )
+        # неизвестная транзакция приходит как {'error': ...}, вытесненная - с признаком double_spend
+        return 'error' not in details and not details.get('double_spend')
+
     def estimate_transaction_size(self) -> float:
         return 0.5  # Примерная оценка размера транзакции в kb для расчета комиссии
 
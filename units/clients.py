@@ -0,0 +1,64 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Awaitable, Callable, Dict
+
+from settings.common import CHAIN_CLIENT_SETTINGS
+
+
+class ChainClient:
+    """
+    Обертка над клиентом блокчейна с лимитом одновременных запросов и таймаутом.
+    Синхронные библиотеки (blockcypher, tronpy) выполняются в отдельном пуле потоков,
+    асинхронные клиенты - прямо в event loop.
+    """
+
+    def __init__(self, crypto: str, timeout: float = 10, concurrency: int = 8, threads: int = 4, pool_size: int = 8):
+        self.crypto = crypto
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.threads = threads
+        self.pool_size = pool_size
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._executor = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix=f'{self.crypto.lower()}-client')
+        return self._executor
+
+    async def call(self, func: Callable, *args, **kwargs):
+        """Вызов блокирующей функции в пуле потоков"""
+        loop = asyncio.get_running_loop()
+        async with self._semaphore:
+            return await asyncio.wait_for(
+                loop.run_in_executor(self.executor, partial(func, *args, **kwargs)), timeout=self.timeout
+            )
+
+    async def wait(self, awaitable: Awaitable):
+        """Ожидание асинхронного вызова с теми же лимитами"""
+        async with self._semaphore:
+            return await asyncio.wait_for(awaitable, timeout=self.timeout)
+
+    def shutdown(self):
+        if self._executor is not None:
+            # зависшие вызовы не держат остановку приложения
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+_clients: Dict[str, ChainClient] = {}
+
+
+def get_chain_client(crypto: str) -> ChainClient:
+    if crypto not in _clients:
+        _clients[crypto] = ChainClient(crypto=crypto, **CHAIN_CLIENT_SETTINGS.get(crypto, {}))
+    return _clients[crypto]
+
+
+async def shutdown_chain_clients(app=None):
+    for client in _clients.values():
+        client.shutdown()
+    logging.info('Chain clients stopped')
@@ -1,10 +1,70 @@
 import hashlib
+import statistics
+import time
+from decimal import Decimal
+from typing import Dict, List, Optional
 # from eth_account import Account
-from web3 import Web3
-from database.db import DB
-from decorators import timed_cache
-from settings.common import CRYPTO_SETTINGS, ETH
-from units.base import Unit
+import aiohttp
+from eth_account.typed_transactions import TypedTransaction
+from hexbytes import HexBytes
+from web3 import AsyncWeb3, Web3
+from web3.exceptions import TransactionNotFound, Web3RPCError
+from decorators import async_cache
+from http_client import http_client
+from money import Amount
+from settings.common import CRYPTO_SETTINGS, ETH, ETH_GAS_SETTINGS
+from units.base import SignedTransaction, StaleTransaction, Unit, balance_cache_key, pool_seed
+from units.clients import get_chain_client
+from units.nonce import NonceManager
+from validators.address import validate_address
+
+# газ на простой перевод эфира
+TRANSFER_GAS = 21000
+# ошибки ноды, после которых подписанная транзакция уже не попадет в сеть: ее nonce занят другой
+STALE_ERRORS = ('nonce too low', 'replacement transaction underpriced')
+
+
+class GasOracle:
+    """
+    Комиссии EIP-1559 по истории последних блоков (eth_feeHistory): базовая плата следующего блока
+    и перцентили чаевых. Оценка кэшируется на ttl секунд, подпись вывода не ходит в ноду за ценой газа.
+    """
+
+    def __init__(
+        self,
+        unit: 'ETHUnit',
+        ttl: int = 15,
+        blocks: int = 20,
+        percentiles: Optional[Dict[str, int]] = None,
+        bump: float = 1.125,
+    ):
+        self.unit = unit
+        self.ttl = ttl
+        self.blocks = blocks
+        self.percentiles = percentiles or {'low': 10, 'medium': 50, 'high': 90}
+        self.bump = bump
+        self._fees: Dict[str, Dict[str, int]] = {}
+        self._updated_at = 0.0
+
+    async def fees(self) -> Dict[str, Dict[str, int]]:
+        """{priority: {'base_fee', 'max_priority_fee', 'max_fee'}} в wei за единицу газа"""
+        if self._fees and time.monotonic() - self._updated_at < self.ttl:
+            return self._fees
+        history = await self.unit.client.wait(
+            self.unit.web3.eth.fee_history(self.blocks, 'latest', list(self.percentiles.values()))
+        )
+        # последний элемент - базовая плата следующего блока
+        base_fee = history['baseFeePerGas'][-1]
+        fees = {}
+        for column, priority in enumerate(self.percentiles):
+            tip = int(statistics.median(reward[column] for reward in history['reward']))
+            # запас на рост базовой платы: она может удвоиться за шесть полных блоков подряд
+            fees[priority] = {'base_fee': base_fee, 'max_priority_fee': tip, 'max_fee': 2 * base_fee + tip}
+        self._fees, self._updated_at = fees, time.monotonic()
+        return fees
+
+    async def get(self, priority: str = 'medium') -> Dict[str, int]:
+        return (await self.fees())[priority]
 
 
 class ETHUnit(Unit):
@@ -26,7 +86,25 @@ class ETHUnit(Unit):
 
         self.crypto = ETH
         self.network = network
-        self.web3 = Web3(Web3.HTTPProvider(f'https://{self.NETWORKS[self.network]}/{CRYPTO_SETTINGS[ETH]['api_key']}'))
+        self.endpoint_uri = f'https://{self.NETWORKS[self.network]}/{CRYPTO_SETTINGS[ETH]['api_key']}'
+        self.web3 = AsyncWeb3(AsyncWeb3.AsyncHTTPProvider(self.endpoint_uri))
+        self.client = get_chain_client(ETH)
+        self.gas = GasOracle(self, **ETH_GAS_SETTINGS)
+        self.nonces = NonceManager()
+        self._chain_id = None
+
+    async def open(self):
+        # собственная сессия с ограниченным пулом соединений вместо сессии web3 по умолчанию
+        session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.client.pool_size))
+        await self.web3.provider.cache_async_session(session)
+        self._session = session
+
+    async def close(self):
+        if getattr(self, '_session', None):
+            await self._session.close()
+
+    async def health_check(self) -> bool:
+        return await self.client.wait(self.web3.eth.block_number) > 0
 
     def get_wallet_url(self, address) -> str:
         return f"{self.EXPLORER_URLS.get(self.network, '')}/{address}"
@@ -38,57 +116,158 @@ class ETHUnit(Unit):
         pa = self.web3.eth.account.from_key(private_key)
         return  pa.address, private_key
 
+    async def derive_address(self, index: int) -> tuple:
+        private_key = pool_seed(ETH, index).hex()
+        return self.web3.eth.account.from_key(private_key).address, private_key
+
     @staticmethod
     def validate_address(address: str) -> bool:
-        return Web3.is_address(address)
+        return validate_address(ETH, address)
 
-    @timed_cache(seconds=30)
-    async def get_balance(self, address: str) -> float:
+    @async_cache(ttl=30, key=balance_cache_key)
+    async def get_balance(self, address: str) -> Optional[Amount]:
         try:
-            balance_wei = self.web3.eth.get_balance(address)
-            balance_eth = self.web3.from_wei(balance_wei, 'ether')
-            user = await DB.users.find_one({f'profile.wallet.{ETH}.address': address})
-            return balance_eth  - await self.get_hold(user_id=user['user_id'], crypto=ETH)
+            balance_wei = await self.client.wait(self.web3.eth.get_balance(address))
+            return Amount(ETH, balance_wei)
         except Exception as e:
             print(f"[{ETH}] Error fetching balance: {e}")
-            return 0.0
+            return None
 
-    async def get_network_fee(self) -> float:
-        try:
-            gas_price_wei = self.web3.eth.gas_price
-            gas_price_gwei = self.web3.from_wei(gas_price_wei, 'gwei')
-            return gas_price_gwei
-        except Exception as e:
-            print(f"Error fetching network fees: {e}")
-            return {}
+    async def fetch_balances(self, addresses: List[str]) -> Dict[str, Amount]:
+        # JSON-RPC batch: все eth_getBalance пачки одним http запросом
+        payload = [
+            {'jsonrpc': '2.0', 'id': index, 'method': 'eth_getBalance', 'params': [address, 'latest']}
+            for index, address in enumerate(addresses)
+        ]
+        response = await self.client.wait(http_client.post_json(self.endpoint_uri, json=payload))
+        results = {item['id']: item.get('result') for item in response}
+        return {
+            address: Amount(ETH, int(results[index], 16))
+            for index, address in enumerate(addresses)
+            if results.get(index)
+        }
 
-    async def send_coins(self, user: dict, to_address: str, amount: float) -> str:
-        # Convert the amount from ETH to Wei
-        amount_wei = self.web3.to_wei(amount, 'ether')
+    async def estimate_fees(self) -> Dict[str, Decimal]:
+        # ожидаемая плата за перевод - базовая плата и чаевые, а не потолок max_fee
+        fees = await self.gas.fees()
+        return {
+            priority: Decimal(fee['base_fee'] + fee['max_priority_fee']) * TRANSFER_GAS / Decimal(10**18)
+            for priority, fee in fees.items()
+        }
 
-        # Generate private key from user_id
-        private_key = hashlib.sha256(user['user_id'].encode('utf-8')).hexdigest()
+    async def chain_id(self) -> int:
+        if self._chain_id is None:
+            self._chain_id = await self.client.wait(self.web3.eth.chain_id)
+        return self._chain_id
+
+    async def _pending_nonce(self, address: str) -> int:
+        return await self.client.wait(self.web3.eth.get_transaction_count(address, 'pending'))
+
+    def _sign(self, tx: dict, private_key: str) -> SignedTransaction:
+        signed_tx = self.web3.eth.account.sign_transaction(tx, private_key)
+        return SignedTransaction(txid=self.web3.to_hex(signed_tx.hash), raw=self.web3.to_hex(signed_tx.raw_transaction))
+
+    async def transfer_fee(self, priority: str = 'medium') -> Amount:
+        # потолок max_fee: столько адрес должен держать сверх суммы перевода
+        return Amount(ETH, (await self.gas.get(priority))['max_fee'] * TRANSFER_GAS)
 
+    async def sign_coins(
+        self, user: dict, to_address: str, amount: Amount, priority: str = 'medium'
+    ) -> SignedTransaction:
+        wallet = user['profile']['wallet'][ETH]
+        fee = await self.gas.get(priority)
+        tx = {
+            'type': 2,
+            'chainId': await self.chain_id(),
+            'to': Web3.to_checksum_address(to_address),
+            'value': amount.units,
+            'gas': TRANSFER_GAS,
+            'maxFeePerGas': fee['max_fee'],
+            'maxPriorityFeePerGas': fee['max_priority_fee'],
+        }
+        # nonce выдается из счетчика в базе, без get_transaction_count на каждый вывод
+        tx['nonce'] = await self.nonces.allocate(wallet['address'], lambda: self._pending_nonce(wallet['address']))
         try:
-            # Create account
-            # account = Account.from_key(private_key)
+            # ключ хранится в кошельке: адреса из пула не выводятся из user_id
+            return self._sign(tx, wallet['private_key'])
+        except Exception:
+            # выданный nonce не будет использован - иначе следующие выводы адреса зависнут за дырой
+            await self.nonces.resync(wallet['address'], lambda: self._pending_nonce(wallet['address']))
+            raise
 
-            # Build transaction
-            tx = {
-                'nonce': self.web3.eth.get_transaction_count(user['profile']['wallet'][ETH]['address']),
-                'to': to_address,
-                'value': amount_wei,
-                'gas': 2000000,
-                'gasPrice': self.web3.to_wei('50', 'gwei')
-            }
+    async def bump(self, user: dict, raw: str, max_fee: Optional[Amount] = None) -> Optional[SignedTransaction]:
+        """Замена с тем же nonce: комиссия не ниже текущей высокой оценки и не меньше чем в bump раз выше прежней"""
+        wallet = user['profile']['wallet'][ETH]
+        tx = TypedTransaction.from_bytes(HexBytes(raw)).as_dict()
+        fee = await self.gas.get('high')
+        min_fee = int(tx['maxFeePerGas'] * self.gas.bump) + 1
+        max_fee_per_gas = max(min_fee, fee['max_fee'])
+        if max_fee is not None:
+            max_fee_per_gas = min(max_fee_per_gas, max_fee.units // tx['gas'])
+            # замену дешевле bump раз нода отклонит как underpriced
+            if max_fee_per_gas < min_fee:
+                return None
+        priority_fee = max(int(tx['maxPriorityFeePerGas'] * self.gas.bump) + 1, fee['max_priority_fee'])
+        replacement = {
+            'type': 2,
+            'chainId': tx['chainId'],
+            'nonce': tx['nonce'],
+            'to': Web3.to_checksum_address(tx['to']),
+            'value': tx['value'],
+            'gas': tx['gas'],
+            'maxPriorityFeePerGas': min(priority_fee, max_fee_per_gas),
+            'maxFeePerGas': max_fee_per_gas,
+        }
+        return self._sign(replacement, wallet['private_key'])
 
-            # Sign transaction
-            signed_tx = self.web3.eth.account.sign_transaction(tx, private_key)
+    async def broadcast(self, raw: str) -> str:
+        txid = self.web3.to_hex(Web3.keccak(hexstr=raw))
+        try:
+            await self.client.wait(self.web3.eth.send_raw_transaction(raw))
+        except (ValueError, Web3RPCError) as e:
+            message = str(e).lower()
+            # повторная отправка той же подписанной транзакции - она уже в мемпуле
+            if 'already known' in message:
+                return txid
+            if any(error in message for error in STALE_ERRORS):
+                sender = self.web3.eth.account.recover_transaction(raw)
+                await self.nonces.resync(sender, lambda: self._pending_nonce(sender))
+                raise StaleTransaction(message) from e
+            raise
+        return txid
+
+    async def discard(self, raw: str):
+        # nonce неотправленной транзакции остался бы дырой, за которой зависнут следующие выводы адреса
+        sender = self.web3.eth.account.recover_transaction(raw)
+        await self.nonces.resync(sender, lambda: self._pending_nonce(sender))
 
-            # Send transaction
-            tx_hash = self.web3.eth.send_raw_transaction(signed_tx.rawTransaction)
+    async def get_confirmations(self, txid: str) -> int:
+        try:
+            receipt = await self.client.wait(self.web3.eth.get_transaction_receipt(txid))
+        except TransactionNotFound:
+            return 0
+        latest = await self.client.wait(self.web3.eth.block_number)
+        return latest - receipt['blockNumber'] + 1
 
-            return self.web3.to_hex(tx_hash)
+    async def is_known(self, txid: str) -> bool:
+        # транзакция, вытесненная другой с тем же nonce, пропадает из мемпула ноды
+        try:
+            await self.client.wait(self.web3.eth.get_transaction(txid))
+        except TransactionNotFound:
+            return False
+        return True
+
+    async def get_transaction_fee(self, txid: str) -> Optional[Amount]:
+        try:
+            receipt = await self.client.wait(self.web3.eth.get_transaction_receipt(txid))
+        except TransactionNotFound:
+            return None
+        return Amount(ETH, receipt['gasUsed'] * receipt['effectiveGasPrice'])
+
+    async def send_coins(self, user: dict, to_address: str, amount: Amount) -> str:
+        try:
+            signed = await self.sign_coins(user, to_address, amount)
+            return await self.broadcast(signed.raw)
         except Exception as e:
             print(f"Error sending coins: {e}")
             return None
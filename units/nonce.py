@@ -0,0 +1,41 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Set
+
+from database.nonce import allocate_nonce, reset_nonce, sync_nonce
+
+
+class NonceManager:
+    """
+    Nonce исходящих транзакций по адресам. Счетчик хранится в базе и выдается атомарным $inc,
+    с нодой процесс сверяется только при первой транзакции адреса и после ошибок, а не на каждый вывод.
+    """
+
+    def __init__(self):
+        self._synced: Set[str] = set()
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._allocated = 0
+        self._resyncs = 0
+
+    async def allocate(self, address: str, fetch: Callable[[], Awaitable[int]]) -> int:
+        address = address.lower()
+        if address not in self._synced:
+            async with self._locks.setdefault(address, asyncio.Lock()):
+                if address not in self._synced:
+                    await sync_nonce(address, await fetch())
+                    self._synced.add(address)
+        self._allocated += 1
+        return await allocate_nonce(address)
+
+    async def resync(self, address: str, fetch: Callable[[], Awaitable[int]]):
+        """Сбрасывает счетчик на pending nonce ноды: выданный nonce не дошел до сети и образовал дыру"""
+        address = address.lower()
+        async with self._locks.setdefault(address, asyncio.Lock()):
+            chain_nonce = await fetch()
+            await reset_nonce(address, chain_nonce)
+            self._synced.add(address)
+        self._resyncs += 1
+        logging.warning(f'Nonce of {address} resynced to {chain_nonce}')
+
+    def stats(self) -> dict:
+        return {'addresses': len(self._synced), 'allocated': self._allocated, 'resyncs': self._resyncs}
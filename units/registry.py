@@ -0,0 +1,49 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Optional, Tuple
+
+from settings.common import CRYPTO_SETTINGS
+from units.base import Unit
+from utils import get_unit
+
+
+class UnitRegistry:
+    """Один настроенный экземпляр юнита на пару (крипта, сеть) на весь процесс"""
+
+    def __init__(self):
+        self._units: Dict[Tuple[str, str], Unit] = {}
+
+    def get(self, crypto: str, network: Optional[str] = None) -> Unit:
+        network = network or CRYPTO_SETTINGS[crypto]['network']
+        key = (crypto, network)
+        if key not in self._units:
+            self._units[key] = get_unit(crypto)(network=network)
+        return self._units[key]
+
+    async def start(self, app=None):
+        for crypto in CRYPTO_SETTINGS:
+            await self.get(crypto).open()
+        logging.info(f'Unit registry started: {", ".join(f"{c}/{n}" for c, n in self._units)}')
+
+    async def stop(self, app=None):
+        for unit in self._units.values():
+            await unit.close()
+        self._units = {}
+
+    async def _check(self, unit: Unit) -> dict:
+        started_at = time.monotonic()
+        try:
+            ok = await unit.health_check()
+            error = None
+        except Exception as e:
+            ok, error = False, str(e) or e.__class__.__name__
+        return {'ok': ok, 'latency': round(time.monotonic() - started_at, 3), 'error': error}
+
+    async def health(self) -> dict:
+        keys = list(self._units)
+        results = await asyncio.gather(*[self._check(self._units[key]) for key in keys])
+        return {f'{crypto}/{network}': result for (crypto, network), result in zip(keys, results)}
+
+
+registry = UnitRegistry()
@@ -1,12 +1,12 @@
 from base64 import b64encode
 import json
 import logging
+from decimal import Decimal
 
-from database.db import DB
-from decorators import timed_cache
+from decorators import async_cache
+from http_client import http_client
+from money import Amount
 from settings.common import CRYPTO_SETTINGS, TON
-import re
-import aiohttp
 import nacl.signing
 from nacl.encoding import HexEncoder
 
@@ -14,19 +14,23 @@ from mnemonic import Mnemonic
 import hashlib
 from binascii import unhexlify
 from hashlib import sha512
-from typing import Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
-from units.base import Unit
+from units.base import Unit, balance_cache_key, pool_seed
+from units.clients import get_chain_client
+from validators.address import validate_address
 
 MAINNET_URL = "https://toncenter.com"
 TESTNET_URL = "https://testnet.toncenter.com"
 
 class TONUnit(Unit):
+    _mnemo = None
+
     def __init__(self, network='mainnet', access_key: Optional[str] = None):
         self.network = network
         self.access_key = access_key
-        self.mnemo = Mnemonic("english")
         self.crypto = TON
+        self.client = get_chain_client(TON)
 
         if network == 'mainnet':
             self.base_url = MAINNET_URL
@@ -35,6 +39,17 @@ class TONUnit(Unit):
         else:
             raise ValueError("Invalid network. Choose 'mainnet' or 'testnet'.")
 
+    @property
+    def mnemo(self) -> Mnemonic:
+        # словарь BIP-39 загружается один раз на процесс
+        if TONUnit._mnemo is None:
+            TONUnit._mnemo = Mnemonic("english")
+        return TONUnit._mnemo
+
+    async def health_check(self) -> bool:
+        data = await self.client.wait(http_client.get_json(f"{self.base_url}/api/v2/getMasterchainInfo"))
+        return bool(data.get('ok'))
+
     def get_wallet_url(self, address) -> str:
         if self.network == 'mainnet':
             return f'https://tonscan.org/address/{address}'
@@ -47,6 +62,11 @@ class TONUnit(Unit):
         key_pair = self._derive_sign_keys(mnemonic_phrase)
         return self._get_address_from_public_key(key_pair['public']), key_pair['secret']
 
+    async def derive_address(self, index: int) -> Tuple[str, str]:
+        mnemonic_phrase = self._mnemonic_from_entropy(pool_seed(TON, index))
+        key_pair = self._derive_sign_keys(mnemonic_phrase)
+        return self._get_address_from_public_key(key_pair['public']), key_pair['secret']
+
     def _mnemonic_from_entropy(self, entropy: bytes) -> str:
         return self.mnemo.to_mnemonic(entropy)
 
@@ -86,46 +106,45 @@ class TONUnit(Unit):
         # Add the "0:" prefix
         return "0:" + address
     
-    @timed_cache(seconds=10)
-    async def get_balance(self, address: str) -> float:
-        base_url = f"{self.base_url}/api/v2/getAddressBalance"
-        params = f"?address={address}&api_key={CRYPTO_SETTINGS[TON]['api_key']}"
-        url = base_url + params
-
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.get(url) as response:
-                    data = await response.json()
-                    user = await DB.users.find_one({f'profile.wallet.{TON}.address': address})
-                    if 'result' in data and data['ok']:
-                        return float(data['result']) / 10**9 - await self.get_hold(user_id=user['user_id'], crypto=TON)
-                    else:
-                        raise ValueError("Invalid response: 'balance' not found")
-            except Exception as e:
-                logging.error(f"[{TON}] Error fetching balance: {e}")
-                return 0.0
+    @async_cache(ttl=10, key=balance_cache_key)
+    async def get_balance(self, address: str) -> Optional[Amount]:
+        url = f"{self.base_url}/api/v2/getAddressBalance"
+        params = {'address': address, 'api_key': CRYPTO_SETTINGS[TON]['api_key']}
 
-    @staticmethod
-    def validate_address(address: str) -> bool:
-        return True
-        try:
-            # TON addresses usually start with "0:" followed by a 64-character hash
-            match = re.fullmatch(r"0:[a-fA-F0-9]{64}", address)
-            return match is not None
-        except Exception:
-            return False
-    
-    async def get_network_fee(self) -> float:
         try:
-            estimated_size = self.estimate_transaction_size()
-            # Примерная оценка стоимости газа для сети TON
-            fee_per_byte = 0.000001  # Примерная стоимость за байт в Нано ТОН (нужно уточнять)
-            total_fee = fee_per_byte * estimated_size
-
-            return total_fee
+            data = await self.client.wait(http_client.get_json(url, params=params))
+            if 'result' in data and data['ok']:
+                return Amount(TON, int(data['result']))
+            else:
+                raise ValueError("Invalid response: 'balance' not found")
         except Exception as e:
-            print(f"Error fetching network fees: {e}")
-            return {}
+            logging.error(f"[{TON}] Error fetching balance: {e}")
+            return None
+
+    async def fetch_balances(self, addresses: List[str]) -> Dict[str, Amount]:
+        # toncenter v3 отдает состояния нескольких аккаунтов одним запросом
+        api_key = CRYPTO_SETTINGS[TON]['api_key']
+        params = [('address', address) for address in addresses] + [('include_boc', 'false')]
+        data = await self.client.wait(
+            http_client.get_json(
+                f"{self.base_url}/api/v3/accountStates",
+                params=params,
+                headers={'X-API-Key': api_key} if api_key else None,
+            )
+        )
+        # неинициализированные аккаунты не попадают в ответ, их баланс нулевой
+        balances = {account['address'].lower(): account.get('balance') or 0 for account in data.get('accounts', [])}
+        return {address: Amount(TON, int(balances.get(address.lower(), 0))) for address in addresses}
+
+    def validate_address(self, address: str) -> bool:
+        # сырой адрес workchain:hash и user-friendly base64 с CRC16
+        return validate_address(TON, address, self.network)
+    
+    async def estimate_fees(self) -> Dict[str, Decimal]:
+        estimated_size = Decimal(str(self.estimate_transaction_size()))
+        # Примерная оценка стоимости газа для сети TON
+        fee_per_byte = Decimal('0.000001')  # Примерная стоимость за байт в Нано ТОН (нужно уточнять)
+        return self.tiered_fees(fee_per_byte * estimated_size, market=False)
 
     @staticmethod
     def sign_transaction(transaction_json: str, private_key: str) -> str:
@@ -149,9 +168,23 @@ class TONUnit(Unit):
 
         return signature_base64
 
-    async def send_coins(self, user: dict, to_address: str, amount: float) -> str:
+    async def send_coins(self, user: dict, to_address: str, amount: Amount) -> str:
         pass
 
+    async def broadcast(self, raw: str) -> str:
+        # raw - подписанное внешнее сообщение в base64 BoC, toncenter возвращает его хэш
+        data = await self.client.wait(
+            http_client.post_json(
+                f"{self.base_url}/api/v2/sendBocReturnHash",
+                json={'boc': raw},
+                params={'api_key': CRYPTO_SETTINGS[TON]['api_key']},
+                retries=0,
+            )
+        )
+        if not data.get('ok'):
+            raise ValueError(f"Broadcast failed: {data.get('error')}")
+        return data['result']['hash']
+
     def estimate_transaction_size(self) -> float:
         # Примерная оценка размера транзакции в kb для TON
         return 0.5
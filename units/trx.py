@@ -1,22 +1,36 @@
+import asyncio
 from decimal import Decimal
 import hashlib
+from typing import Dict, List, Optional
+from requests.adapters import HTTPAdapter
 from tronpy import Tron
+from tronpy.exceptions import TransactionNotFound
 from tronpy.providers import HTTPProvider
 from tronpy.keys import PrivateKey
-from database.db import DB
-from decorators import timed_cache
+from decorators import async_cache
+from http_client import http_client
+from money import Amount
 from settings.common import CRYPTO_SETTINGS, TRX
-from units.base import Unit
+from units.base import SignedTransaction, StaleTransaction, Unit, balance_cache_key, pool_seed
+from units.clients import get_chain_client
+from validators.address import validate_address
+
+# транзакция истекла или ссылается на блок, которого нода уже не держит: в блок она не попадет
+STALE_ERRORS = ('TRANSACTION_EXPIRATION_ERROR', 'TAPOS_ERROR')
 
 class TRXUnit(Unit):
     def __init__(self, network='mainnet'):
         self.crypto = TRX
         self.network = network
-        endpoint_uri = 'https://api.shasta.trongrid.io' if network == 'testnet' else 'https://api.trongrid.io'
+        self.endpoint_uri = 'https://api.shasta.trongrid.io' if network == 'testnet' else 'https://api.trongrid.io'
         provider = HTTPProvider(
-            api_key=CRYPTO_SETTINGS[TRX]['api_key'], endpoint_uri=endpoint_uri
+            api_key=CRYPTO_SETTINGS[TRX]['api_key'], endpoint_uri=self.endpoint_uri
         )
-        self.client = Tron(network=network, provider=provider)
+        self.tron = Tron(network=network, provider=provider)
+        self.client = get_chain_client(TRX)
+        # соединения к trongrid переиспользуются всеми потоками пула клиента
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.client.pool_size)
+        provider.sess.mount('https://', adapter)
 
     def get_wallet_url(self, address) -> str:
         if self.network == 'mainnet':
@@ -31,64 +45,115 @@ class TRXUnit(Unit):
         private_key = PrivateKey.fromhex(private_key_hex)
         return private_key.public_key.to_base58check_address(), private_key
 
+    async def derive_address(self, index: int) -> tuple:
+        private_key = PrivateKey(pool_seed(TRX, index))
+        return private_key.public_key.to_base58check_address(), private_key.hex()
+
+    async def health_check(self) -> bool:
+        return await self.client.call(self.tron.get_latest_block_number) > 0
+
     @staticmethod
     def validate_address(address: str) -> bool:
-        try:
-            return Tron.is_address(address)
-        except Exception:
-            return False
+        return validate_address(TRX, address)
 
-    async def get_network_fee(self) -> float:
-        try:
-            # Получаем рекомендуемую комиссию за транзакцию
-            chain_parameters = self.client.get_chain_parameters()
-            for param in chain_parameters:
-                if param['key'] == 'getEnergyFee':
-                    energy_fee = param['value']
-                elif param['key'] == 'getTransactionFee':
-                    transaction_fee = param['value']
-            
-            estimated_size = self.estimate_transaction_size()
-            total_fee = transaction_fee + (estimated_size * energy_fee)
-
-            return total_fee / 1e6  # Переводим из Sun в TRX
-        except Exception as e:
-            print(f"Error fetching network fees: {e}")
-            return {}
+    async def estimate_fees(self) -> Dict[str, Decimal]:
+        # Получаем рекомендуемую комиссию за транзакцию
+        chain_parameters = await self.client.call(self.tron.get_chain_parameters)
+        params = {param['key']: param.get('value', 0) for param in chain_parameters}
+        estimated_size = Decimal(str(self.estimate_transaction_size()))
+        total_fee = params['getTransactionFee'] + estimated_size * params['getEnergyFee']
+        # цена ресурсов задается параметрами сети, приоритета за доплату нет
+        return self.tiered_fees(Decimal(total_fee) / Decimal(10**6), market=False)  # Переводим из Sun в TRX
 
-    @timed_cache(seconds=10)
-    async def get_balance(self, address: str) -> float:
+    async def _fetch_account_balance(self, address: str) -> Amount:
+        api_key = CRYPTO_SETTINGS[TRX]['api_key']
+        data = await self.client.wait(
+            http_client.get_json(
+                f'{self.endpoint_uri}/v1/accounts/{address}',
+                headers={'TRON-PRO-API-KEY': api_key} if api_key else None,
+            )
+        )
+        accounts = data.get('data') or [{}]
+        return Amount(TRX, accounts[0].get('balance', 0))
+
+    async def fetch_balances(self, addresses: List[str]) -> Dict[str, Amount]:
+        # у trongrid нет запроса на несколько аккаунтов: пачка уходит параллельно в пределах лимита клиента
+        balances = await asyncio.gather(
+            *[self._fetch_account_balance(address) for address in addresses], return_exceptions=True
+        )
+        return {
+            address: balance for address, balance in zip(addresses, balances) if not isinstance(balance, Exception)
+        }
+
+    @async_cache(ttl=10, key=balance_cache_key)
+    async def get_balance(self, address: str) -> Optional[Amount]:
         try:
-            account_info = self.client.get_account(address)
-            balance = account_info.get('balance', 0)
-            user = await DB.users.find_one({f'profile.wallet.{TRX}.address': address})
-            
-            return balance / 1e6 - await self.get_hold(user_id=user['user_id'], crypto=TRX) # Convert from SUN to TRX
+            account_info = await self.client.call(self.tron.get_account, address)
+            return Amount(TRX, account_info.get('balance', 0))
         except Exception as e:
             print(f"[{TRX}] Error fetching balance: {e}")
-            return 0.0
-
-    async def send_coins(self, user: dict, to_address: str, amount: float) -> str:
-        # Convert the amount from TRX to SUN
-        amount_sun = int(amount * Decimal(1e6))
+            return None
 
-        # Generate private key from user_id
-        private_key_hex = hashlib.sha256(str(user['user_id']).encode('utf-8')).hexdigest()
-        private_key = PrivateKey.fromhex(private_key_hex)
+    async def sign_coins(
+        self, user: dict, to_address: str, amount: Amount, priority: str = 'medium'
+    ) -> SignedTransaction:
+        wallet = user['profile']['wallet'][TRX]
+        # ключ хранится в кошельке: адреса из пула не выводятся из user_id
+        private_key = PrivateKey.fromhex(wallet['private_key'])
 
-        try:
-            # Create and sign transaction
-            txn = (
-                self.client.trx.transfer(user['profile']['wallet'][TRX]['address'], to_address, amount_sun)
+        def _build_and_sign():
+            # build() ходит в сеть за референсным блоком, поэтому выполняется в пуле вместе с подписью
+            return (
+                self.tron.trx.transfer(wallet['address'], to_address, amount.units)
                 .memo("TRX transfer")
                 .build()
                 .sign(private_key)
             )
 
-            # Broadcast transaction
-            result = self.client.broadcast(txn)
+        txn = await self.client.call(_build_and_sign)
+        return SignedTransaction(txid=txn.txid, raw=txn.to_json())
+
+    async def broadcast(self, raw: dict) -> str:
+        result = await self.client.call(self.tron.provider.make_request, 'wallet/broadcasttransaction', raw)
+        # повторная отправка той же подписанной транзакции - она уже в сети
+        if not result.get('result') and result.get('code') != 'DUP_TRANSACTION_ERROR':
+            if result.get('code') in STALE_ERRORS:
+                raise StaleTransaction(f"{result.get('code')} {result.get('message')}")
+            raise ValueError(f"Broadcast failed: {result.get('code')} {result.get('message')}")
+        return raw['txID']
+
+    async def get_confirmations(self, txid: str) -> int:
+        try:
+            info = await self.client.call(self.tron.get_transaction_info, txid)
+        except TransactionNotFound:
+            return 0
+        if 'blockNumber' not in info:
+            return 0
+        latest = await self.client.call(self.tron.get_latest_block_number)
+        return latest - info['blockNumber'] + 1
+
+    async def is_known(self, txid: str) -> bool:
+        # транзакция, не попавшая в блок до expiration, нодой забывается
+        try:
+            await self.client.call(self.tron.get_transaction, txid)
+        except TransactionNotFound:
+            return False
+        return True
 
-            return result['txid']
+    async def get_transaction_fee(self, txid: str) -> Optional[Amount]:
+        try:
+            info = await self.client.call(self.tron.get_transaction_info, txid)
+        except TransactionNotFound:
+            return None
+        if 'blockNumber' not in info:
+            return None
+        # перевод в пределах бесплатной пропускной способности не сжигает TRX, поля fee тогда нет
+        return Amount(TRX, info.get('fee', 0))
+
+    async def send_coins(self, user: dict, to_address: str, amount: Amount) -> str:
+        try:
+            signed = await self.sign_coins(user, to_address, amount)
+            return await self.broadcast(signed.raw)
         except Exception as e:
             print(f"Error sending coins: {e}")
             return None
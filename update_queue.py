@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from traceback import print_tb
+from typing import Awaitable, Callable, Dict, Hashable, Optional
+
+
+class UpdateQueue:
+    """
+    Очередь апдейтов телеграма с пулом воркеров.
+    Апдейты одного пользователя обрабатываются строго по порядку и никогда параллельно,
+    апдейты разных пользователей - параллельно.
+    """
+
+    def __init__(self, handler: Callable[[dict], Awaitable[None]], workers: int = 8, max_size: int = 10000):
+        self.handler = handler
+        self.workers = workers
+        self.max_size = max_size
+        self._pending: Dict[Hashable, deque] = {}
+        self._ready: Optional[asyncio.Queue] = None
+        self._tasks = []
+        self._depth = 0
+        self._busy = 0
+        self._busy_time = 0.0
+        self._started_at = None
+        self._processed = 0
+        self._failed = 0
+        self._dropped = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def put(self, key: Hashable, update: dict) -> bool:
+        if self._depth >= self.max_size:
+            self._dropped += 1
+            return False
+        self._depth += 1
+        if key in self._pending:
+            # пользователь уже в очереди или обрабатывается воркером - просто дописываем в хвост
+            self._pending[key].append((time.monotonic(), update))
+        else:
+            self._pending[key] = deque([(time.monotonic(), update)])
+            self._ready.put_nowait(key)
+        return True
+
+    async def _worker(self):
+        while True:
+            key = await self._ready.get()
+            enqueued_at, update = self._pending[key].popleft()
+            self._depth -= 1
+            started_at = time.monotonic()
+            wait = started_at - enqueued_at
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+            self._busy += 1
+            try:
+                await self.handler(update)
+                self._processed += 1
+            except Exception as error:
+                self._failed += 1
+                logging.error(error)
+                print_tb(error.__traceback__)
+                logging.error('Error while processing update')
+            finally:
+                self._busy -= 1
+                self._busy_time += time.monotonic() - started_at
+                # ключ остается занятым, пока у пользователя есть апдейты,
+                # поэтому второй воркер не возьмет его апдейты параллельно
+                if self._pending[key]:
+                    self._ready.put_nowait(key)
+                else:
+                    del self._pending[key]
+                self._ready.task_done()
+
+    def stats(self) -> dict:
+        started = self._processed + self._failed
+        uptime = time.monotonic() - self._started_at if self._started_at else 0
+        return {
+            'workers': self.workers,
+            'busy_workers': self._busy,
+            'depth': self._depth,
+            'users_pending': len(self._pending),
+            'processed': self._processed,
+            'failed': self._failed,
+            'dropped': self._dropped,
+            'wait_avg': round(self._wait_total / started, 4) if started else 0,
+            'wait_max': round(self._wait_max, 4),
+            'utilisation': round(self._busy_time / (uptime * self.workers), 4) if uptime else 0,
+        }
+
+    async def start(self, app=None):
+        self._ready = asyncio.Queue()
+        self._started_at = time.monotonic()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logging.info(f'Update queue started with {self.workers} workers')
+
+    async def stop(self, app=None, timeout: float = 10):
+        # даем воркерам дообработать очередь перед остановкой
+        try:
+            await asyncio.wait_for(self._ready.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f'Update queue stopped with {self._depth} unprocessed updates')
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
@@ -0,0 +1,201 @@
+"""
+Проверка адресов всех сетей без запросов в сеть и без клиентов библиотек: только разбор формата
+и контрольные суммы. Результаты запоминаются в LRU, повторная проверка того же адреса - поиск в словаре.
+
+    python -m validators.address  # микробенчмарк
+"""
+import base64
+import binascii
+import re
+from functools import lru_cache
+from typing import Dict, Iterable
+
+import base58
+from eth_utils import keccak
+
+from settings.common import BTC, ETH, TON, TRX
+
+# сколько последних проверок помнить; длиннее MAX_LENGTH адресов не бывает, такие строки не кэшируются
+CACHE_SIZE = 4096
+MAX_LENGTH = 100
+
+# версии base58 адресов (P2PKH, P2SH) и префиксы bech32 по сетям; bcy - тестовая сеть blockcypher
+BTC_VERSIONS = {'mainnet': (0x00, 0x05), 'testnet': (0x6F, 0xC4, 0x1B, 0x1F)}
+BTC_HRPS = {'mainnet': 'bc', 'testnet': 'tb'}
+TRX_VERSION = 0x41
+
+BECH32_CHARSET = 'qpzry9x8gf2tvdw0s3jn54khce6mua7l'
+BECH32_CONST = 1
+BECH32M_CONST = 0x2BC830A3
+
+ETH_PATTERN = re.compile(r'0x[0-9a-fA-F]{40}')
+TON_RAW_PATTERN = re.compile(r'(-1|0):[0-9a-fA-F]{64}')
+# флаги user-friendly адреса TON: bounceable, non-bounceable и признак тестовой сети
+TON_BOUNCEABLE = 0x11
+TON_NON_BOUNCEABLE = 0x51
+TON_TESTNET_FLAG = 0x80
+
+
+def _base58check(address: str, versions: Iterable[int]) -> bool:
+    # b58decode_check бросает ValueError на чужих символах и неверной контрольной сумме
+    payload = base58.b58decode_check(address)
+    return len(payload) == 21 and payload[0] in versions
+
+
+def _bech32_polymod(values: Iterable[int]) -> int:
+    generator = (0x3B6A57B2, 0x26508E6D, 0x1EA119FA, 0x3D4233DD, 0x2A1462B3)
+    checksum = 1
+    for value in values:
+        top = checksum >> 25
+        checksum = (checksum & 0x1FFFFFF) << 5 ^ value
+        for index in range(5):
+            checksum ^= generator[index] if (top >> index) & 1 else 0
+    return checksum
+
+
+def _convert_bits(data: Iterable[int], from_bits: int, to_bits: int) -> bytes:
+    """Перепаковка 5-битных групп bech32 в байты; ValueError на ненулевом или слишком длинном хвосте"""
+    accumulator, bits, result = 0, 0, bytearray()
+    for value in data:
+        accumulator = accumulator << from_bits | value
+        bits += from_bits
+        while bits >= to_bits:
+            bits -= to_bits
+            result.append(accumulator >> bits & (1 << to_bits) - 1)
+    if bits >= from_bits or accumulator << to_bits - bits & (1 << to_bits) - 1:
+        raise ValueError('Invalid bech32 padding')
+    return bytes(result)
+
+
+def _segwit(address: str, hrp: str) -> bool:
+    """BIP-173 и BIP-350: версия 0 - bech32 с программой 20 или 32 байта, версии 1-16 - bech32m"""
+    if len(address) > 90 or address.lower() != address and address.upper() != address:
+        return False
+    address = address.lower()
+    separator = address.rfind('1')
+    if address[:separator] != hrp or len(address) - separator < 8:
+        return False
+    try:
+        data = [BECH32_CHARSET.index(char) for char in address[separator + 1 :]]
+    except ValueError:
+        return False
+    expanded = [ord(char) >> 5 for char in hrp] + [0] + [ord(char) & 31 for char in hrp]
+    constant = _bech32_polymod(expanded + data)
+    version, program = data[0], _convert_bits(data[1:-6], 5, 8)
+    if version > 16 or not 2 <= len(program) <= 40:
+        return False
+    if version == 0:
+        return constant == BECH32_CONST and len(program) in (20, 32)
+    return constant == BECH32M_CONST
+
+
+def is_btc_address(address: str, network: str = 'mainnet') -> bool:
+    if address[:3].lower() == BTC_HRPS[network] + '1':
+        return _segwit(address, BTC_HRPS[network])
+    return _base58check(address, BTC_VERSIONS[network])
+
+
+def is_eth_address(address: str, network: str = 'mainnet') -> bool:
+    """Адрес в одном регистре принимается как есть, в смешанном - только с верной контрольной суммой EIP-55"""
+    if not ETH_PATTERN.fullmatch(address):
+        return False
+    body = address[2:]
+    if body == body.lower() or body == body.upper():
+        return True
+    digest = bytes(keccak(text=body.lower())).hex()
+    return all(
+        char == (char.upper() if int(nibble, 16) >= 8 else char.lower()) for char, nibble in zip(body, digest)
+    )
+
+
+def is_trx_address(address: str, network: str = 'mainnet') -> bool:
+    return _base58check(address, (TRX_VERSION,))
+
+
+def _crc16(data: bytes) -> int:
+    # CRC-16/XMODEM, которым подписан user-friendly адрес TON
+    crc = 0
+    for byte in data:
+        crc ^= byte << 8
+        for _ in range(8):
+            crc = (crc << 1 ^ 0x1021 if crc & 0x8000 else crc << 1) & 0xFFFF
+    return crc
+
+
+def is_ton_address(address: str, network: str = 'mainnet') -> bool:
+    """Сырой адрес workchain:hash или user-friendly: 36 байт в base64 (обычном или url-safe) с CRC16"""
+    if ':' in address:
+        return TON_RAW_PATTERN.fullmatch(address) is not None
+    if len(address) != 48:
+        return False
+    try:
+        data = base64.b64decode(address, altchars=b'-_' if '-' in address or '_' in address else None, validate=True)
+    except binascii.Error:
+        return False
+    tag, workchain = data[0], data[1]
+    if tag & TON_TESTNET_FLAG and network != 'testnet':
+        return False
+    if tag & ~TON_TESTNET_FLAG not in (TON_BOUNCEABLE, TON_NON_BOUNCEABLE) or workchain not in (0x00, 0xFF):
+        return False
+    return _crc16(data[:34]) == int.from_bytes(data[34:], 'big')
+
+
+VALIDATORS = {BTC: is_btc_address, ETH: is_eth_address, TRX: is_trx_address, TON: is_ton_address}
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _validate(crypto: str, address: str, network: str) -> bool:
+    try:
+        return VALIDATORS[crypto](address, network)
+    except (ValueError, KeyError):
+        return False
+
+
+def validate_address(crypto: str, address: str, network: str = 'mainnet') -> bool:
+    if not isinstance(address, str) or not address or len(address) > MAX_LENGTH:
+        return False
+    return _validate(crypto, address, network)
+
+
+def validate_addresses(crypto: str, addresses: Iterable[str], network: str = 'mainnet') -> Dict[str, bool]:
+    """Проверка пачки адресов одной сети; повторы в пачке проверяются один раз"""
+    return {address: validate_address(crypto, address, network) for address in addresses}
+
+
+def validation_stats() -> dict:
+    info = _validate.cache_info()
+    return {'size': info.currsize, 'hits': info.hits, 'misses': info.misses}
+
+
+# примеры адресов для бенчмарка: по одному на каждый формат
+SAMPLES = {
+    BTC: [
+        '1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa',
+        'bc1qw508d6qejxtdg4y5r3zarvary0c5xw7kv8f3t4',
+        'bc1p0xlxvlhemja6c4dqv22uapctqupfhlxm9h8z3k2e72q4k9hcz7vqzk5jj0',
+    ],
+    ETH: ['0x5aAeb6053F3E94C9b9A09f33669435E7Ef1BeAed'],
+    TRX: ['TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6t'],
+    TON: [
+        '0:83dfd552e63729b472fcbcc8c45ebcc6691702558b68ec7527e1ba403a0f31a8',
+        'EQDtFpEwcFAEcRe5mLVh2N6C0x-_hJEM7W61_JLnSF74p4q2',
+    ],
+}
+
+
+def benchmark(number: int = 10000) -> Dict[str, Dict[str, float]]:
+    """Микросекунды на проверку: без кэша (разбор формата) и повторная проверка из кэша"""
+    import timeit
+
+    results = {}
+    for crypto, addresses in SAMPLES.items():
+        cold = timeit.timeit(lambda: [VALIDATORS[crypto](address) for address in addresses], number=number)
+        cached = timeit.timeit(lambda: [validate_address(crypto, address) for address in addresses], number=number)
+        calls = number * len(addresses)
+        results[crypto] = {'uncached_us': cold / calls * 1e6, 'cached_us': cached / calls * 1e6}
+    return results
+
+
+if __name__ == '__main__':
+    for crypto, timings in benchmark().items():
+        print(f"{crypto}: {timings['uncached_us']:.2f} us uncached, {timings['cached_us']:.2f} us cached")
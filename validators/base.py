@@ -1,5 +1,5 @@
 from database.state import States, set_state
-from triggers import get_all_triggers
+from triggers import ALL_TRIGGERS
 
 
 class DefaultValidator():
@@ -8,7 +8,7 @@ class DefaultValidator():
 
     async def clear_chain(self, selected: list):
         # удаляем не прошедший триггер из цепочки
-        if selected[-1] not in get_all_triggers(self.context.triggers):
+        if selected[-1] not in ALL_TRIGGERS:
             await set_state(self.context.user['user_id'], States.SELECTED, selected[:-1])
 
     async def update_chain(self, selected: list, value: str):
@@ -1,51 +1,64 @@
+import logging
 from gettext import gettext as _
-from database.db import DB
-from database.user import update_user_hold
-from settings.common import BOT_NAME, CRYPTO_SETTINGS
-from decimal import Decimal, InvalidOperation
-from utils import get_unit
+from database.ledger import observe, release, reserve
+from database.state import States, get_state
+from fees import fee_oracle
+from settings.common import BOT_NAME
+from decimal import InvalidOperation
+from money import Amount
+from units.registry import registry
 from validators.base import DefaultValidator
 from database.bill import create_bill
-from database.check import create_check
+from database.check import create_check, delete_check_by_code
+from database.user import is_hot_wallet
+from database.withdrawal import activate_withdrawal, create_withdrawal, delete_withdrawal, get_withdrawal_by_key
 
 
 class CheckAmountValidator(DefaultValidator):
     async def validate(self, value: str) -> str:
         selected = await self.context.selected()
         bot_settings = await self.context.bot_settings
-        rates = await self.context.get_rates()
-        rate = rates.get(selected[-2], 0)
+        conversion = await self.context.get_conversion()
+        wallet_currency = self.context.user['profile']['wallet_currency']
 
         await self.clear_chain(selected)
 
-        min_check_amount = bot_settings['limits'][selected[-2]]['min']
-        max_check_amount = bot_settings['limits'][selected[-2]]['max']
+        crypto = selected[-2]
+        min_check_amount = Amount.of(crypto, bot_settings['limits'][crypto]['min'])
+        max_check_amount = Amount.of(crypto, bot_settings['limits'][crypto]['max'])
 
         text = await self.context.render_template(
             'errors/create_check_error.html',
             {
-                "crypto": selected[-2],
-                "balance": self.context.user['profile']['wallet'][selected[-2]]['balance'],
+                "crypto": crypto,
+                "balance": Amount.of(crypto, self.context.user['profile']['wallet'][crypto]['balance']).format(),
                 "min_check_amount": min_check_amount,
                 "max_check_amount": max_check_amount,
             },
         )
+        estimate = fee_oracle.get(crypto)
+        if estimate is None:
+            return await self.context.render_template('errors/fee_error.html', {'crypto': crypto})
         try:
-            value = Decimal(value)
+            value = Amount.parse(crypto, value)
             if min_check_amount <= value <= max_check_amount:
                 await self.update_chain(selected=selected, value=value)
-                check = await create_check(user=self.context.user, amount=value, cryptocurrency=selected[-2])
-                db_fee = await DB.network_fees.find_one({'crypto': selected[-2]})
-                amount = value + Decimal(db_fee['network_fee'])
-                await update_user_hold(
-                    user_id=self.context.user['user_id'], crypto=selected[-2], amount=amount
+                amount = value + Amount.of(crypto, estimate.medium)
+                check = await create_check(
+                    user=self.context.user, amount=value, cryptocurrency=crypto, hold=amount
                 )
+                # холд ставится одним условным $inc: не хватило свободного баланса - чек не создается
+                if not await reserve(
+                    user_id=self.context.user['user_id'], crypto=crypto, amount=amount, ref=f"check:{check['code']}"
+                ):
+                    await delete_check_by_code(check['code'])
+                    return text
                 text = await self.context.render_template(
                     'wallet/check.html',
                     {
-                        "fiat_amount": round(Decimal(check['amount']) * Decimal(rate), 2),
+                        "fiat_amount": conversion.convert(check['amount'], crypto, wallet_currency),
                         "check": check,
-                        "wallet_currency": self.context.user['profile']['wallet_currency'],
+                        "wallet_currency": wallet_currency,
                         "bot_name": BOT_NAME,
                     },
                 )
@@ -58,34 +71,35 @@ class BillAmountValidator(DefaultValidator):
     async def validate(self, value: str) -> str:
         selected = await self.context.selected()
         bot_settings = await self.context.bot_settings
-        rates = await self.context.get_rates()
-        rate = rates.get(selected[-2], 0)
+        conversion = await self.context.get_conversion()
+        wallet_currency = self.context.user['profile']['wallet_currency']
 
         await self.clear_chain(selected)
 
-        min_bill_amount = bot_settings['limits'][selected[-2]]['min']
-        max_bill_amount = bot_settings['limits'][selected[-2]]['max']
+        crypto = selected[-2]
+        min_bill_amount = Amount.of(crypto, bot_settings['limits'][crypto]['min'])
+        max_bill_amount = Amount.of(crypto, bot_settings['limits'][crypto]['max'])
 
         text = await self.context.render_template(
             'errors/create_bill_error.html',
             {
-                "crypto": selected[-2],
-                "balance": self.context.user['profile']['wallet'][selected[-2]]['balance'],
+                "crypto": crypto,
+                "balance": Amount.of(crypto, self.context.user['profile']['wallet'][crypto]['balance']).format(),
                 "min_bill_amount": min_bill_amount,
                 "max_bill_amount": max_bill_amount,
             },
         )
         try:
-            value = Decimal(value)
+            value = Amount.parse(crypto, value)
             if min_bill_amount < value < max_bill_amount:
                 await self.update_chain(selected=selected, value=value)
-                bill = await create_bill(user=self.context.user, amount=value, cryptocurrency=selected[-2])
+                bill = await create_bill(user=self.context.user, amount=value, cryptocurrency=crypto)
                 text = await self.context.render_template(
                     'wallet/bill.html',
                     {
-                        "fiat_amount": round(bill.amount * rate, 2),
+                        "fiat_amount": conversion.convert(bill['amount'], crypto, wallet_currency),
                         "bill": bill,
-                        "wallet_currency": self.user['profile']['wallet_currency'],
+                        "wallet_currency": wallet_currency,
                         "bot_name": BOT_NAME,
                     },
                 )
@@ -100,16 +114,18 @@ class WithdrawAddressValidator(DefaultValidator):
         crypto = selected[-2]
 
         await self.clear_chain(selected)
-        crypto_unit = get_unit(crypto)
-        unit = crypto_unit(network=CRYPTO_SETTINGS[crypto]['network'])
+        unit = registry.get(crypto)
         text = _("Неправильный адрес кошелька")
         wallet = self.context.user['profile']['wallet'][crypto]
         # todo: холд + комиссия + проверка на минимальный баланс
 
+        # проверка формата и контрольной суммы локальная, без запросов в сеть
+        value = value.strip()
         if unit.validate_address(value):
             await self.update_chain(selected=selected, value=value)
             text = await self.context.render_template(
-                'wallet/withdraw_amount.html', {'crypto': crypto, 'available_balance': wallet['balance']}
+                'wallet/withdraw_amount.html',
+                {'crypto': crypto, 'available_balance': Amount.of(crypto, wallet['balance']).format()},
             )
 
         return text
@@ -122,19 +138,53 @@ class WithdrawAmountValidator(DefaultValidator):
         bot_settings = await self.context.bot_settings
         wallet = self.context.user['profile']['wallet'][crypto]
         await self.clear_chain(selected)
-        crypto_unit = get_unit(crypto)
-        unit = crypto_unit(network=CRYPTO_SETTINGS[crypto]['network'])
-        has_balance, fee = await unit.has_sufficient_balance(address=wallet['address'], amount=value)
-        text = await self.context.render_template('errors/withdraw_error.html', {'fee': fee, "crypto": crypto})
+        unit = registry.get(crypto)
+        try:
+            # холд покрывает потолок комиссии, с которым вывод будет подписан, а не ожидаемую плату из оценки
+            fee = await unit.transfer_fee('medium') if fee_oracle.get(crypto) is not None else None
+        except Exception as e:
+            logging.error(f'[{crypto}] Failed to get transfer fee: {e!r}')
+            fee = None
+        if fee is None:
+            return await self.context.render_template('errors/fee_error.html', {'crypto': crypto})
+        text = await self.context.render_template('errors/withdraw_error.html', {'fee': fee.format(), "crypto": crypto})
+        user_id = self.context.user['user_id']
         try:
-            value = Decimal(value)
-            min_withdraw_amount = bot_settings['limits'][crypto]['min']
-            max_withdraw_amount = bot_settings['limits'][crypto]['max']
-            if has_balance:
-                if min_withdraw_amount <= value <= max_withdraw_amount:
-                    await self.update_chain(selected=selected, value=value)
-                    tx_hash = await unit.send_coins(user=self.context.user, to_address=selected[-2], amount=value)
-                    text = _('Монеты успешно отправлены') + f"\n{tx_hash}"
+            value = Amount.parse(crypto, value)
+            min_withdraw_amount = Amount.of(crypto, bot_settings['limits'][crypto]['min'])
+            max_withdraw_amount = Amount.of(crypto, bot_settings['limits'][crypto]['max'])
+            if min_withdraw_amount <= value <= max_withdraw_amount:
+                # ключ - сообщение бота с запросом суммы: повтор того же вебхука не создаст второй вывод
+                last = await get_state(user_id=user_id, key=States.LAST_MESSAGE)
+                key = f"{user_id}:{crypto}:{last or '|'.join(selected[-3:])}"
+                withdrawal = await get_withdrawal_by_key(key)
+                if withdrawal is None:
+                    amount = value + fee
+                    # перед выводом сверяем баланс с сетью, холды чеков уже учтены в проекции;
+                    # баланс горячего кошелька принадлежит всем пользователям и не наблюдается
+                    balance = None if is_hot_wallet(user_id, crypto) else await unit.get_balance(wallet['address'])
+                    if balance is not None:
+                        await observe(user_id=user_id, crypto=crypto, balance=balance)
+                    withdrawal = await create_withdrawal(
+                        key=key, user_id=user_id, crypto=crypto, address=selected[-2], amount=value, fee=fee
+                    )
+                    if withdrawal is None:
+                        # тот же апдейт параллельно обрабатывает другой воркер вебхука
+                        withdrawal = await get_withdrawal_by_key(key)
+                    elif await reserve(user_id=user_id, crypto=crypto, amount=amount, ref=f'withdrawal:{key}'):
+                        # задание уходит воркерам только после холда
+                        if not await activate_withdrawal(withdrawal['_id']):
+                            # холд не успел до уборки заданий воркером, задание удалено - холд снимается
+                            await release(user_id=user_id, crypto=crypto, amount=amount, ref=f'withdrawal:{key}')
+                            return text
+                    else:
+                        await delete_withdrawal(withdrawal['_id'])
+                        return text
+                await self.update_chain(selected=selected, value=value)
+                text = await self.context.render_template(
+                    'wallet/withdraw_queued.html',
+                    {'amount': withdrawal['amount'].format(), 'fee': withdrawal['fee'].format(), 'crypto': crypto},
+                )
         except InvalidOperation:
             pass
         return text
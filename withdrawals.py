@@ -0,0 +1,366 @@
+import asyncio
+import logging
+import os
+import socket
+from datetime import datetime, timedelta, timezone
+from gettext import gettext as _
+from typing import Dict, Iterable, Optional, Tuple
+
+from aiogram import Bot
+
+from balances import balance_refresher
+from database.ledger import EntryKind, debit, has_entry, release, spend as ledger_spend
+from database.user import get_hot_wallet, get_user_by_id
+from database.withdrawal import (
+    ACTIVE_STATUSES,
+    WithdrawalStatus,
+    activate_withdrawal,
+    delete_withdrawal,
+    get_inactive_withdrawals,
+    lock_withdrawal,
+    update_withdrawal,
+)
+from payouts import PayoutBatcher
+from settings.common import PAYOUT_BATCH_SETTINGS, ROOT_ID, SWEEP_SETTINGS, WITHDRAWAL_SETTINGS
+from telegram import send_message
+from units.base import StaleTransaction
+from units.registry import registry
+
+
+def ledger_ref(withdrawal: dict) -> str:
+    return f"withdrawal:{withdrawal['key']}"
+
+
+class WithdrawalWorker:
+    """
+    Отправляет выводы из очереди в базе вне обработки апдейта. Задание проходит статусы
+    queued -> signed -> broadcast -> confirmed (или failed), каждый шаг сохраняется, поэтому после
+    рестарта или падения воркера обработка продолжается с последнего шага. Подписанная транзакция
+    хранится в задании и при повторе отправляется та же, а не подписывается новая.
+    """
+
+    def __init__(
+        self,
+        bot: Optional[Bot] = None,
+        interval: float = 5,
+        lock_timeout: float = 120,
+        max_attempts: int = 5,
+        retry_delay: float = 30,
+        bump_after: float = 600,
+        max_bumps: int = 3,
+        reap_after: float = 300,
+        chains: Optional[Dict[str, dict]] = None,
+        owner: Optional[str] = None,
+        batches: Optional[Dict[str, dict]] = None,
+        hot: Iterable[str] = (),
+    ):
+        self.bot = bot
+        self.interval = interval
+        self.lock_timeout = lock_timeout
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.bump_after = bump_after
+        self.max_bumps = max_bumps
+        # через сколько секунд задание, не ставшее доступным воркерам, разбирается уборкой (reap)
+        self.reap_after = reap_after
+        self.chains = chains or {}
+        self.owner = owner or f'{socket.gethostname()}:{os.getpid()}'
+        # сети, где депозиты собираются на горячий кошелек и выводы оплачиваются с него
+        self.hot = set(hot)
+        self._processed = {status: 0 for status in (WithdrawalStatus.CONFIRMED, WithdrawalStatus.FAILED)}
+        self._retries = 0
+        self._bumps = 0
+        # сети, где новые выводы собираются в пачки, а воркер только отправляет и подтверждает их
+        self.batchers = {
+            crypto: PayoutBatcher(self, crypto=crypto, **settings) for crypto, settings in (batches or {}).items()
+        }
+
+    async def poll(self):
+        await asyncio.gather(*[self.poll_crypto(crypto) for crypto in self.chains])
+
+    async def poll_crypto(self, crypto: str):
+        await self.reap(crypto)
+        statuses = ACTIVE_STATUSES
+        if crypto in self.batchers:
+            await self.batchers[crypto].poll()
+            statuses = [WithdrawalStatus.SIGNED, WithdrawalStatus.BROADCAST]
+        # не больше concurrency заданий сети одновременно: пропускная способность ограничена задержкой ноды
+        jobs = []
+        for _ in range(self.chains[crypto].get('concurrency', 1)):
+            withdrawal = await lock_withdrawal(crypto, self.owner, self.lock_timeout, statuses=statuses)
+            if withdrawal is None:
+                break
+            jobs.append(withdrawal)
+        await asyncio.gather(*[self.process(withdrawal) for withdrawal in jobs])
+
+    async def reap(self, crypto: str):
+        """
+        Задание создается до холда и становится доступным воркерам после него. Если обработка апдейта
+        прервалась между этими шагами, задание с холдом активируется, а без холда удаляется.
+        """
+        created_before = datetime.now(timezone.utc) - timedelta(seconds=self.reap_after)
+        for withdrawal in await get_inactive_withdrawals(crypto, created_before):
+            if await has_entry(ledger_ref(withdrawal), EntryKind.HOLD):
+                await activate_withdrawal(withdrawal['_id'])
+            else:
+                await delete_withdrawal(withdrawal['_id'])
+
+    async def process(self, withdrawal: dict):
+        try:
+            if withdrawal['status'] == WithdrawalStatus.QUEUED:
+                await self.sign(withdrawal)
+            if withdrawal['status'] == WithdrawalStatus.SIGNED:
+                await self.broadcast(withdrawal)
+            if withdrawal['status'] == WithdrawalStatus.BROADCAST:
+                await self.confirm(withdrawal)
+        except Exception as e:
+            logging.error(f"[{withdrawal['crypto']}] Withdrawal {withdrawal['key']} failed at {withdrawal['status']}: {e!r}")
+            await self.retry(withdrawal, error=repr(e))
+
+    async def payer(self, withdrawal: dict) -> Tuple[dict, bool]:
+        """(пользователь, чей адрес оплачивает вывод, оплачивает ли его горячий кошелек)"""
+        if withdrawal['crypto'] in self.hot and withdrawal['user_id'] != ROOT_ID:
+            hot_wallet = await get_hot_wallet(withdrawal['crypto'])
+            if hot_wallet is not None:
+                return hot_wallet, True
+        return await get_user_by_id(withdrawal['user_id']), False
+
+    async def sign(self, withdrawal: dict):
+        user, hot = await self.payer(withdrawal)
+        unit = registry.get(withdrawal['crypto'])
+        signed = await unit.sign_coins(user, withdrawal['address'], withdrawal['amount'])
+        if signed is not None:
+            await update_withdrawal(
+                withdrawal, self.owner, status=WithdrawalStatus.SIGNED, txid=signed.txid, raw=signed.raw, hot=hot
+            )
+            return
+        # сеть подписывает и отправляет одним вызовом: отметка до вызова, чтобы после падения не отправить второй раз
+        if not await update_withdrawal(withdrawal, self.owner, status=WithdrawalStatus.SIGNED, raw=None, hot=hot):
+            return
+        try:
+            txid = await unit.send_coins(user=user, to_address=withdrawal['address'], amount=withdrawal['amount'])
+        except Exception as e:
+            # обрыв или таймаут не значит, что сеть отклонила перевод
+            await self.abandon(withdrawal, repr(e))
+            return
+        if txid:
+            await self.mark_broadcast(withdrawal, txid)
+        else:
+            await self.fail(withdrawal, 'send_coins returned no transaction')
+
+    async def broadcast(self, withdrawal: dict):
+        if withdrawal.get('raw') is None:
+            # воркер упал посреди send_coins
+            await self.abandon(withdrawal, 'interrupted')
+            return
+        try:
+            txid = await registry.get(withdrawal['crypto']).broadcast(withdrawal['raw'])
+        except StaleTransaction:
+            if await self.landed(withdrawal):
+                await self.mark_broadcast(withdrawal, withdrawal['txid'])
+                return
+            # nonce занят другой транзакцией: следующая попытка подпишет вывод заново
+            await update_withdrawal(
+                withdrawal,
+                self.owner,
+                status=WithdrawalStatus.QUEUED,
+                txid=None,
+                raw=None,
+                next_attempt_at=datetime.now(timezone.utc),
+                locked_until=None,
+            )
+            return
+        await self.mark_broadcast(withdrawal, txid)
+
+    async def mark_broadcast(self, withdrawal: dict, txid: str):
+        await update_withdrawal(
+            withdrawal,
+            self.owner,
+            status=WithdrawalStatus.BROADCAST,
+            txid=txid,
+            attempts=0,
+            broadcast_at=datetime.now(timezone.utc),
+        )
+        # монеты ушли из сети: холд превращается в списание
+        await self.debit(withdrawal)
+        await balance_refresher.touch(withdrawal['user_id'])
+
+    async def debit(self, withdrawal: dict):
+        await debit(
+            user_id=withdrawal['user_id'],
+            crypto=withdrawal['crypto'],
+            amount=withdrawal['amount'] + withdrawal['fee'],
+            ref=ledger_ref(withdrawal),
+            hot=withdrawal.get('hot', False),
+        )
+
+    async def confirmations(self, withdrawal: dict) -> Tuple[Optional[str], Optional[int]]:
+        """(txid, подтверждения) транзакции, попавшей в блок, среди текущей и замененных; (None, 0) - ни одной"""
+        unit = registry.get(withdrawal['crypto'])
+        for txid in [withdrawal['txid'], *withdrawal.get('replaced', [])]:
+            if not txid:
+                continue
+            confirmations = await unit.get_confirmations(txid)
+            if confirmations is None or confirmations > 0:
+                return txid, confirmations
+        return None, 0
+
+    async def confirm(self, withdrawal: dict):
+        txid, confirmations = await self.confirmations(withdrawal)
+        required = self.chains[withdrawal['crypto']].get('confirmations', 1)
+        if confirmations is not None and confirmations < required:
+            if not confirmations and self.stuck(withdrawal):
+                await self.bump(withdrawal)
+            await update_withdrawal(
+                withdrawal,
+                self.owner,
+                confirmations=confirmations,
+                next_attempt_at=datetime.now(timezone.utc) + timedelta(seconds=self.interval),
+                locked_until=None,
+            )
+            return
+        # статус broadcast мог сохраниться без списания (падение между ними); повтор с тем же ref не задвоит его
+        await self.debit(withdrawal)
+        if not withdrawal.get('hot'):
+            await self.spend(withdrawal)
+        await update_withdrawal(
+            withdrawal,
+            self.owner,
+            status=WithdrawalStatus.CONFIRMED,
+            txid=txid or withdrawal['txid'],
+            confirmations=confirmations,
+            locked_until=None,
+        )
+        self._processed[WithdrawalStatus.CONFIRMED] += 1
+        await self.notify(withdrawal, _('Вывод выполнен') + f"\n{withdrawal['txid']}")
+
+    async def spend(self, withdrawal: dict):
+        """Вывод с адреса пользователя в блоке: отправленная сумма снимается с outgoing вместе с балансом адреса"""
+        crypto = withdrawal['crypto']
+        unit = registry.get(crypto)
+        user = await get_user_by_id(withdrawal['user_id'])
+        address = user['profile']['wallet'][crypto]['address']
+        # баланс без кэша: в нем уже видно списание, иначе доступный остаток снова вырос бы до прежнего
+        balances = await unit.fetch_balances([address])
+        await ledger_spend(
+            user_id=withdrawal['user_id'],
+            crypto=crypto,
+            amount=withdrawal['amount'] + withdrawal['fee'],
+            balance=balances[address],
+            ref=ledger_ref(withdrawal),
+        )
+        await balance_refresher.touch(withdrawal['user_id'])
+
+    def stuck(self, withdrawal: dict) -> bool:
+        broadcast_at = withdrawal.get('broadcast_at')
+        if not broadcast_at or withdrawal.get('bumps', 0) >= self.max_bumps:
+            return False
+        age = datetime.now(timezone.utc) - broadcast_at.replace(tzinfo=timezone.utc)
+        return age > timedelta(seconds=self.bump_after)
+
+    async def bump(self, withdrawal: dict):
+        """Заменяет зависшую транзакцию той же с повышенной комиссией; в блок может попасть любая из них"""
+        unit = registry.get(withdrawal['crypto'])
+        # замену подписывает тот же адрес, что и исходную транзакцию
+        user = await get_user_by_id(ROOT_ID if withdrawal.get('hot') else withdrawal['user_id'])
+        # с адреса пользователя замена не может потратить на комиссию больше замороженного под нее
+        max_fee = None if withdrawal.get('hot') else withdrawal['fee']
+        signed = await unit.bump(user, withdrawal['raw'], max_fee=max_fee)
+        if signed is None:
+            return
+        await unit.broadcast(signed.raw)
+        await update_withdrawal(
+            withdrawal,
+            self.owner,
+            txid=signed.txid,
+            raw=signed.raw,
+            replaced=[withdrawal['txid'], *withdrawal.get('replaced', [])],
+            bumps=withdrawal.get('bumps', 0) + 1,
+            broadcast_at=datetime.now(timezone.utc),
+        )
+        self._bumps += 1
+        logging.info(f"[{withdrawal['crypto']}] Withdrawal {withdrawal['key']} bumped with {signed.txid}")
+
+    async def retry(self, withdrawal: dict, error: str):
+        attempts = withdrawal.get('attempts', 0) + 1
+        # отправленную транзакцию не бросаем: проверка подтверждений повторяется без лимита попыток
+        if attempts >= self.max_attempts and withdrawal['status'] != WithdrawalStatus.BROADCAST:
+            known = await self.landed(withdrawal) or await self.known(withdrawal)
+            if known:
+                # транзакция в блоке или в мемпуле: дальше задание ждет подтверждений
+                await self.mark_broadcast(withdrawal, withdrawal['txid'])
+            elif known is False:
+                await self.fail(withdrawal, error)
+            else:
+                await self.abandon(withdrawal, error)
+            return
+        self._retries += 1
+        await update_withdrawal(
+            withdrawal,
+            self.owner,
+            attempts=attempts,
+            error=error,
+            next_attempt_at=datetime.now(timezone.utc) + timedelta(seconds=self.retry_delay * attempts),
+            locked_until=None,
+        )
+
+    async def landed(self, withdrawal: dict) -> bool:
+        # перед тем как разморозить средства, убеждаемся, что подписанная транзакция не попала в блок
+        if not withdrawal.get('txid'):
+            return False
+        # если нода недоступна, исключение оставит задание заблокированным до следующей попытки
+        txid, confirmations = await self.confirmations(withdrawal)
+        return bool(txid and confirmations)
+
+    async def known(self, withdrawal: dict) -> Optional[bool]:
+        """
+        Знает ли сеть подписанную транзакцию или одну из ее замен. False - ни одной нет ни в мемпуле,
+        ни в блоке, монеты точно не ушли; None - сеть не умеет это проверять
+        """
+        if not withdrawal.get('txid'):
+            return False
+        unit = registry.get(withdrawal['crypto'])
+        results = [await unit.is_known(txid) for txid in [withdrawal['txid'], *withdrawal.get('replaced', [])]]
+        if True in results:
+            return True
+        return None if None in results else False
+
+    async def abandon(self, withdrawal: dict, error: str):
+        """Исход отправки неизвестен: монеты могли уйти, поэтому холд остается до ручной сверки"""
+        logging.error(f"[{withdrawal['crypto']}] Withdrawal {withdrawal['key']} needs reconciliation: {error}")
+        await update_withdrawal(withdrawal, self.owner, status=WithdrawalStatus.FAILED, error=error, locked_until=None)
+
+    async def fail(self, withdrawal: dict, error: str):
+        """Сеть перевод точно не приняла: холд размораживается"""
+        if not await update_withdrawal(
+            withdrawal, self.owner, status=WithdrawalStatus.FAILED, error=error, locked_until=None
+        ):
+            return
+        if withdrawal.get('raw') is not None:
+            await registry.get(withdrawal['crypto']).discard(withdrawal['raw'])
+        await release(
+            user_id=withdrawal['user_id'],
+            crypto=withdrawal['crypto'],
+            amount=withdrawal['amount'] + withdrawal['fee'],
+            ref=ledger_ref(withdrawal),
+        )
+        await balance_refresher.touch(withdrawal['user_id'])
+        self._processed[WithdrawalStatus.FAILED] += 1
+        await self.notify(withdrawal, _('Вывод не выполнен, средства разморожены'))
+
+    async def notify(self, withdrawal: dict, text: str):
+        if self.bot:
+            text = f"{withdrawal['amount'].format()} {withdrawal['crypto']}\n{text}"
+            await send_message(bot=self.bot, chat_id=withdrawal['user_id'], text=text)
+
+    def stats(self) -> dict:
+        return {
+            **self._processed,
+            'retries': self._retries,
+            'bumps': self._bumps,
+            'batches': {crypto: batcher.stats() for crypto, batcher in self.batchers.items()},
+        }
+
+
+def create_withdrawal_worker(bot: Bot) -> WithdrawalWorker:
+    return WithdrawalWorker(bot=bot, batches=PAYOUT_BATCH_SETTINGS, hot=SWEEP_SETTINGS['chains'], **WITHDRAWAL_SETTINGS)